@@ -1,20 +1,49 @@
-from flask import Flask, render_template
-from workflow.make_figures import make_start_end_figure, make_tracks_figure
-
-from bokeh.embed import server_document
-from bokeh.server.server import Server
-from tornado.ioloop import IOLoop
+import hashlib
+import hmac
+import json
+from flask import Flask, Response, render_template, jsonify, request, abort, send_from_directory, url_for, \
+    make_response
 from threading import Thread
+from workflow.config import BOKEH_URL, BOKEH_PORT, ALLOWED_ORIGINS, ADMIN_TOKEN, TILE_MAX_AGE, TILE_PREFETCH_MAX_ZOOM, \
+    COMPRESSION_ENABLED, SNAPSHOT_DIR, SNAPSHOT_MAX_AGE, DOCUMENT_POOL_SIZE, BASINS, RELOAD_INTERVAL
+from workflow.compression import compress_response
+from workflow.startup import Startup
+
+# Heavy imports (pandas, bokeh, the figures modules) are done lazily, in the startup sequence run by bk_worker,
+# so that importing this module stays fast and the Flask app can answer health checks right away.
 
 app = Flask(__name__)
+app.after_request(compress_response)
+
+startup = Startup()
+
+
+# Documents built in advance for the new sessions, created by prewarm
+pools = dict()
 
 
 def spawnapp(doc):
-    make_start_end_figure(doc)
+    from workflow.metrics import session_metrics
+    from workflow.sessions import SESSIONS
+    from workflow.snapshots import apply_filters, session_filters
+    with SESSIONS.open_session('spawns', doc) as admitted:
+        if not admitted:
+            return
+        with session_metrics('spawns', doc):
+            pools['spawns'].populate(doc)
+            apply_filters(doc, session_filters('spawns', doc))
 
 
 def tracksapp(doc):
-    make_tracks_figure(doc)
+    from workflow.metrics import session_metrics
+    from workflow.sessions import SESSIONS
+    from workflow.snapshots import apply_filters, session_filters
+    with SESSIONS.open_session('tracks', doc) as admitted:
+        if not admitted:
+            return
+        with session_metrics('tracks', doc):
+            pools['tracks'].populate(doc)
+            apply_filters(doc, session_filters('tracks', doc))
 
 
 @app.route('/', methods=['GET'])
@@ -22,28 +51,335 @@ def home():
     return render_template("index.html", template="Flask")
 
 
+def app_page(name: str):
+    """
+    Page of an app, set up with the widgets values given in the url. Shows a pre-rendered snapshot when one matches
+    them, unless ?live=1 is given, and the live session otherwise.
+    """
+
+    from bokeh.embed import server_document
+    from workflow.snapshots import SNAPSHOTS, widget_filters
+
+    filters = widget_filters(name, request.args)
+    script = server_document(BOKEH_URL + '/' + name, arguments=filters)
+
+    snapshot = None
+    if not request.args.get('live'):
+        from workflow.versions import dataset_store
+        snapshot = SNAPSHOTS.find(name, filters, dataset_store().current.version)
+
+    if snapshot is None:
+        return render_template("embed.html", script=script, template="Flask")
+
+    from bokeh.resources import Resources
+    resources = Resources(mode='server', root_url=BOKEH_URL + '/').render_js()
+
+    return render_template("snapshot.html", script=script, resources=resources,
+                           snapshot_url=url_for('snapshot', name=snapshot), template="Flask")
+
+
 @app.route('/spawns/', methods=['GET'])
 def spawn_page():
-    script = server_document('http://localhost:5006/spawns')
-    return render_template("embed.html", script=script, template="Flask")
+    return app_page('spawns')
 
 
 @app.route('/tracks/', methods=['GET'])
 def tracks_page():
-    script = server_document('http://localhost:5006/tracks')
-    return render_template("embed.html", script=script, template="Flask")
+    return app_page('tracks')
+
+
+@app.route('/snapshots/<name>', methods=['GET'])
+def snapshot(name):
+    # Snapshots files are named after their content, they never change
+    response = send_from_directory(SNAPSHOT_DIR, name, max_age=SNAPSHOT_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness: the process answers, and the startup sequence did not crash.
+    report = startup.report()
+    return jsonify(report), 500 if report['failed'] else 200
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    # Readiness: the data is loaded and the bokeh server accepts sessions.
+    report = startup.report()
+    return jsonify(report), 200 if report['ready'] else 503
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    from workflow.metrics import REGISTRY
+    return Response(REGISTRY.expose(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/storms', methods=['GET'])
+def storms():
+    # The hurricanes matching the filters of the apps, in the binary columnar format of workflow/queries.py, from
+    # the version of the datasets in service when the request arrived, held until the response is sent
+    from workflow.versions import DatasetLease
+
+    lease = DatasetLease()
+    try:
+        with lease.pinned() as version:
+            response = make_response(query_storms(version.version))
+    except BaseException:
+        lease.release()
+        raise
+
+    response.call_on_close(lease.release)
+    return response
+
+
+def query_storms(version: str):
+    from workflow.datasets import load_start_end_df, load_tracks_df
+    from workflow.queries import parse_filters, select_storms, binary_columns
+    from workflow.partitions import BBOX_COLUMNS, load_partitioned_tracks, storms_in_bbox
+    import numpy as np
+
+    try:
+        dataset, filters, columns = parse_filters(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    etag = hashlib.sha1(json.dumps([version, dataset, filters, columns]).encode()).hexdigest()
+    headers = {'ETag': '"{}"'.format(etag), 'Cache-Control': 'no-cache', 'X-Dataset-Version': version}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    kwargs = dict(filters)
+    basins = kwargs.pop('basins', list(BASINS))
+    bbox = kwargs.pop('bbox', None)
+
+    partitions = load_partitioned_tracks()
+    if partitions is not None and partitions.meta.get('version') != version:
+        partitions = None
+
+    # The datasets of the apps, in memory, hold the hurricanes of BASINS. The other basins and the viewports are read
+    # from the partitions of the tracks, only the ones their filters and viewport can match.
+    pruned = partitions is not None and (bbox is not None or not set(basins) <= set(BASINS))
+    outside = sorted(set(basins) - set(BASINS))
+    if outside and (dataset != 'tracks' or partitions is None):
+        # The start and end points of the hurricanes are only computed for BASINS
+        return jsonify(error='Basin {} not available for {}'.format(', '.join(outside), dataset)), 400
+
+    if dataset == 'tracks' and pruned:
+        df = partitions.select(basins, kwargs['years'], bbox)
+    else:
+        df = load_tracks_df() if dataset == 'tracks' else load_start_end_df()
+        if not set(BASINS) <= set(basins):
+            kwargs['basins'] = basins
+
+    unknown = [column for column in columns if column not in df.columns]
+    if unknown:
+        return jsonify(error='Unknown columns {}'.format(', '.join(unknown))), 400
+
+    # The indexes of the apps only hold the hurricanes of BASINS, the other basins are searched in the rows read from
+    # the partitions
+    indexed = not (dataset == 'tracks' and outside)
+
+    near = kwargs.pop('near', None)
+    if near is not None:
+        from workflow.spatial import TrackPointIndex, load_track_index
+        index = load_track_index() if indexed else TrackPointIndex(df)
+        kwargs['ids'] = index.storms_within(near[1], near[0], near[2])['ID']
+
+    dates = kwargs.pop('dates', None)
+    if dates is not None:
+        from workflow.intervals import StormIntervalIndex, load_interval_index
+        if indexed:
+            intervals = load_interval_index()
+        else:
+            df_intervals = df.groupby(by='ID').Time.agg(['min', 'max']).reset_index()
+            intervals = StormIntervalIndex(df_intervals.rename(columns={'min': 'Time_start', 'max': 'Time_end'}))
+        active = intervals.active_between(*dates)
+        kwargs['ids'] = active if near is None else np.intersect1d(kwargs['ids'], active)
+
+    if bbox is not None:
+        if dataset == 'tracks':
+            df_tracks = df
+        else:
+            df_tracks = partitions.select(basins, kwargs['years'], bbox, columns=BBOX_COLUMNS) if pruned else \
+                load_tracks_df()
+        in_view = storms_in_bbox(df_tracks, bbox)
+        kwargs['ids'] = in_view if kwargs.get('ids') is None else np.intersect1d(kwargs['ids'], in_view)
+
+    df_temp = select_storms(df, per_storm=dataset == 'tracks', **kwargs)
+    if columns:
+        df_temp = df_temp[columns]
+
+    # Without a Content-Length, the response is sent with chunked transfer encoding
+    meta = {'dataset': dataset, 'version': version, 'filters': filters}
+    return Response(binary_columns(df_temp, meta), mimetype='application/octet-stream', headers=headers)
+
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+def tile(z, x, y):
+    # Map tiles, from the disk cache or else from the upstream tile server.
+    from workflow.tiles import get_tile_cache
+
+    try:
+        content, etag = get_tile_cache().get(z, x, y)
+    except ValueError:
+        abort(404)
+    except OSError:
+        abort(502)
+
+    headers = {'ETag': etag, 'Cache-Control': 'public, max-age={}'.format(TILE_MAX_AGE)}
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+    return Response(content, mimetype='image/png', headers=headers)
+
+
+def admin_allowed() -> bool:
+    # With a token configured, admin routes need it in the X-Admin-Token header, otherwise they only answer to localhost
+    if ADMIN_TOKEN:
+        return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN)
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+def profiling():
+    # POST with enabled=1 or enabled=0 switches profiling of the callbacks on or off, and with session=<id> restricts it
+    # to a session (session= for all of them), GET lists the profiles.
+    if not admin_allowed():
+        abort(403)
+
+    from workflow.profiling import PROFILING
+
+    if request.method == 'POST':
+        PROFILING.enabled = request.values.get('enabled', '1') not in ('0', 'false', 'off')
+        if 'session' in request.values:
+            PROFILING.session = request.values['session'] or None
+
+    return jsonify(enabled=PROFILING.enabled, session=PROFILING.session, interval=PROFILING.interval,
+                   directory=PROFILING.directory, profiles=PROFILING.profiles())
+
+
+@app.route('/admin/reload', methods=['GET', 'POST'])
+def reload():
+    # POST reloads the datasets if the preprocessed files changed, GET gives the version in service.
+    if not admin_allowed():
+        abort(403)
+
+    from workflow.versions import dataset_store, versions_sessions
+
+    store = dataset_store()
+    reloaded = store.check(wait_stable=False) if request.method == 'POST' else False
+
+    return jsonify(reloaded=reloaded, version=store.current.version,
+                   sessions={version: count for (version,), count in versions_sessions().items()})
+
+
+@app.route('/admin/sessions', methods=['GET'])
+def sessions():
+    # The open sessions, with their idle time and the size of their data
+    if not admin_allowed():
+        abort(403)
+
+    from workflow.sessions import SESSIONS
+
+    return jsonify(max_sessions=SESSIONS.max_sessions, idle_timeout=SESSIONS.idle_timeout, sessions=SESSIONS.report())
+
+
+def prewarm():
+    """
+    Loads the datasets and fills the documents pools, so that the first sessions do not pay for it.
+    """
+
+    with startup.phase('import_figures'):
+        from bokeh.document import Document
+        from workflow.make_figures import make_start_end_figure, make_tracks_figure
+        from workflow.datasets import load_start_end_df, load_tracks_df
+        from workflow.pool import DocumentPool
+        from workflow.intervals import load_interval_index
+        from workflow.similarity import load_similarity_index
+        from workflow.climatology import load_climatology
+        from workflow.spatial import load_track_index
+        from workflow.partitions import load_partitioned_tracks
+        from workflow.versions import dataset_store
+
+    with startup.phase('load_datasets'):
+        load_start_end_df()
+        load_tracks_df()
+        load_track_index()
+        load_similarity_index()
+        load_climatology()
+        load_interval_index()
+        load_partitioned_tracks()
+
+    with startup.phase('document_pools'):
+        pools['spawns'] = DocumentPool('spawns', make_start_end_figure, DOCUMENT_POOL_SIZE)
+        pools['tracks'] = DocumentPool('tracks', make_tracks_figure, DOCUMENT_POOL_SIZE)
+        for pool in pools.values():
+            if pool.size:
+                pool.fill()
+                pool.start()
+            else:
+                # Still builds a document, which warms up bokeh
+                pool.make_figure(Document())
+
+    # The documents ready hold the datasets of the previous version
+    store = dataset_store()
+    store.on_reload(lambda version: [pool.flush() for pool in pools.values()])
+    if RELOAD_INTERVAL > 0:
+        store.watch(RELOAD_INTERVAL)
+
+
+def prefetch_tiles():
+    """
+    Fills the tile cache with the tiles of the initial views of the maps, up to TILE_PREFETCH_MAX_ZOOM.
+    """
+
+    from workflow.datasets import load_start_end_df, load_tracks_df
+    from workflow.fixed_values import get_boundaries
+    from workflow.tiles import get_tile_cache, tiles_covering
+
+    tiles = set()
+    for df in (load_start_end_df(), load_tracks_df()):
+        _, _, lon_boundaries, lat_boundaries = get_boundaries(df)
+        tiles.update(tiles_covering(lon_boundaries, lat_boundaries, TILE_PREFETCH_MAX_ZOOM))
+
+    count = get_tile_cache().prefetch(sorted(tiles))
+    print('Prefetched {}/{} map tiles'.format(count, len(tiles)))
 
 
 def bk_worker():
     # Can't pass num_procs > 1 in this configuration. If you need to run multiple
     # processes, see e.g. flask_gunicorn_embed.py
-    server = Server({'/spawns': spawnapp, '/tracks': tracksapp}, io_loop=IOLoop(),
-                    allow_websocket_origin=["127.0.0.1:8000", "localhost:5006", "localhost:8000"])
-    server.start()
+    prewarm()
+
+    with startup.phase('bokeh_server'):
+        from bokeh.server.server import Server
+        from tornado.ioloop import IOLoop
+        from workflow.compression import enable_websocket_compression
+        from workflow.sessions import SESSIONS
+
+        if COMPRESSION_ENABLED:
+            enable_websocket_compression()
+
+        # compress_response is passed through to tornado, and gzips bokehjs and the other static assets
+        server = Server({'/spawns': spawnapp, '/tracks': tracksapp}, io_loop=IOLoop(),
+                        port=BOKEH_PORT, allow_websocket_origin=ALLOWED_ORIGINS,
+                        compress_response=COMPRESSION_ENABLED)
+        server.start()
+
+        # Closes the sessions left idle
+        SESSIONS.start(server)
+
+    startup.mark_ready()
+
+    # Not part of the startup sequence: the maps work without it, and the upstream tile server may be unreachable.
+    Thread(target=prefetch_tiles, daemon=True).start()
+
     server.io_loop.start()
 
 
-Thread(target=bk_worker).start()
+Thread(target=bk_worker, daemon=True).start()
 
 if __name__ == '__main__':
     app.run(threaded=True, port=8000)
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+from typing import Tuple
+
+
+def scale_tracks(df_names: pd.DataFrame, df_tracks: pd.DataFrame,
+                 scale: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Replicates every hurricane of df_names and df_tracks `scale` times, with new ID's.
+
+    Replicas keep the year of the original hurricane, so the year filters of the apps keep working. The storm number
+    of the ID is extended with the replica number, e.g. AL011970 becomes AL01011970 for the second replica.
+
+    Parameters
+    ----------
+
+    df_names : pd.DataFrame
+        The names DataFrame, as saved by extraction_pipeline.
+    df_tracks : pd.DataFrame
+        The tracks DataFrame, as saved by extraction_pipeline.
+    scale: int
+        The number of copies of the data.
+
+    Return
+    ------
+
+    names: pd.DataFrame
+        df_names with `scale` times as many hurricanes.
+    tracks: pd.DataFrame
+        df_tracks with `scale` times as many hurricanes, in the same order as names.
+    """
+
+    if scale == 1:
+        return df_names.copy(), df_tracks.copy()
+
+    names, tracks = [], []
+
+    for i in range(scale):
+        names.append(df_names.assign(ID=df_names.ID.map(lambda x: x[:2] + '{:02d}'.format(i) + x[2:])))
+        tracks.append(df_tracks.assign(ID=df_tracks.ID.map(lambda x: x[:2] + '{:02d}'.format(i) + x[2:])))
+
+    names = pd.concat(names, ignore_index=True)
+    tracks = pd.concat(tracks, ignore_index=True)
+
+    # Sort the hurricanes by year, as in the original file. The tracks of each hurricane are contiguous, so they are
+    # reordered with the rank of their hurricane.
+    order = np.argsort(names.Year.values, kind='mergesort')
+    rank = np.empty(len(order), dtype='int64')
+    rank[order] = np.arange(len(order))
+
+    storm = np.repeat(np.arange(len(names)), names.Data_length.values)
+    tracks = tracks.iloc[np.argsort(rank[storm], kind='mergesort')].reset_index(drop=True)
+    names = names.iloc[order].reset_index(drop=True)
+
+    return names, tracks
+
+
+def write_hurdat(df_names: pd.DataFrame, df_tracks: pd.DataFrame, filepath: str):
+    """
+    Writes df_names and df_tracks back to the NOAA text format read by load_hurdat.
+
+    Missing values are written as -999, the record identifier column (dropped by create_tracks_df) is left blank.
+
+    Parameters
+    ----------
+
+    df_names : pd.DataFrame
+        The names DataFrame, as saved by extraction_pipeline.
+    df_tracks : pd.DataFrame
+        The tracks DataFrame, as saved by extraction_pipeline, in the same order as df_names.
+    filepath: str
+        The pathname of the text file to write.
+    """
+
+    float_cols = [col for col in df_tracks.columns if col not in ['ID', 'Date', 'Hour', 'Status',
+                                                                   'Latitude', 'Longitude']]
+
+    values = df_tracks[float_cols].fillna(-999).astype('int64').astype(str)
+    for col in float_cols:
+        values[col] = values[col].str.rjust(4 if col == 'Max_Speed' else 5)
+
+    lines = (df_tracks.Date.astype(str) + ',' + df_tracks.Hour.astype(str) + ',  ,'
+             + df_tracks.Status.astype(str) + ',' + df_tracks.Latitude.astype(str) + ','
+             + df_tracks.Longitude.astype(str) + ',' + values.apply(','.join, axis=1) + ',\n').values
+
+    headers = (df_names.ID + ',' + df_names.Name.astype(str) + ','
+               + df_names.Data_length.astype(str).str.rjust(7) + ',\n').values
+
+    with open(filepath, 'w') as text:
+        start = 0
+        for header, length in zip(headers, df_names.Data_length.values):
+            text.write(header)
+            text.writelines(lines[start:start + length])
+            start += length
@@ -0,0 +1,342 @@
+"""
+Load test of the embedded bokeh server with concurrent headless sessions.
+
+Each simulated user opens a session over the bokeh websocket protocol, pulls the document, then replays a script of
+widgets interactions (slider drags, zone and number changes). The latency of an interaction is the time between
+sending the widget change and receiving the reply of the server, after the resulting PATCH-DOC if any.
+
+Everything runs on localhost. Either point the tool to a running server (and give its pid to sample its memory),
+or let it start `app.py` in a subprocess:
+
+    $ python -m benchmarks.load_test --spawn --app spawns --sessions 50 --rounds 3
+    $ python -m benchmarks.load_test --url http://localhost:5006 --pid 1234 --app tracks --sessions 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from bokeh.document import Document
+from bokeh.protocol import Protocol
+from bokeh.protocol.receiver import Receiver
+from bokeh.util.token import generate_jwt_token, generate_session_id
+from bokeh.client.websocket import WebSocketClientConnectionWrapper
+from tornado.httpclient import HTTPRequest
+from tornado.websocket import websocket_connect
+
+from workflow.config import BOKEH_URL
+
+
+def slider_drag(name: str, start: Tuple[int, int], end: Tuple[int, int], steps: int) -> List[Tuple[str, tuple]]:
+    """
+    Interactions of a user dragging the handles of a range slider from `start` to `end`.
+    """
+
+    lows = np.linspace(start[0], end[0], steps + 1).round().astype(int)
+    highs = np.linspace(start[1], end[1], steps + 1).round().astype(int)
+
+    return [(name, (int(low), int(high))) for low, high in zip(lows[1:], highs[1:])]
+
+
+# Scripted interactions of each app: (widget name, value). The script is replayed `rounds` times by each user.
+SCRIPTS = {
+    'spawns': (slider_drag('slider_year', (1970, 2017), (1990, 2010), 5)
+               + [('select_zone', 'Atlantic'), ('select_number', '-1'), ('select_number', '10')]
+               + slider_drag('slider_month', (1, 12), (6, 10), 3)
+               + [('select_zone', 'All'), ('tabs', 1), ('select_season', 'Summer'),
+                  ('select_zone_season', 'Mexico_Caribbean'), ('select_number_season', '-1'),
+                  ('select_season', 'All'), ('select_zone_season', 'All'), ('select_number_season', '5'),
+                  ('tabs', 0), ('slider_month', (1, 12)), ('slider_year', (1970, 2017)), ('select_number', '5')]),
+    'tracks': (slider_drag('slider_year', (1970, 2017), (1995, 2010), 5)
+               + [('select_zone', 'Atlantic'), ('select_number', '-1'), ('select_number', '20')]
+               + slider_drag('slider_month', (1, 12), (8, 9), 3)
+               + [('select_zone', 'All'), ('slider_month', (1, 12)), ('slider_year', (1970, 2017)),
+                  ('select_number', '5')]),
+}
+
+# Callback run by the server for a change of each widget.
+CALLBACKS = {
+    'spawns': {'slider_year': 'update_map_se', 'slider_month': 'update_map_se', 'select_zone': 'update_map_se',
+               'select_number': 'update_map_se', 'slider_year_season': 'update_map_season',
+               'select_season': 'update_map_season', 'select_zone_season': 'update_map_season',
+               'select_number_season': 'update_map_season', 'tabs': 'tab_change'},
+    'tracks': {'slider_year': 'update_map_se', 'slider_month': 'update_map_se', 'select_zone': 'update_map_se',
+               'select_number': 'update_map_se'},
+}
+
+
+class HeadlessSession:
+    """
+    A bokeh session driven over the websocket protocol, without a browser.
+    """
+
+    def __init__(self, url: str, timeout: float):
+        self.url = url.replace('http', 'ws', 1) + '/ws'
+        self.timeout = timeout
+        self.protocol = Protocol()
+        self.receiver = Receiver(self.protocol)
+        self.document = Document()
+        self.socket = None
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    async def open(self):
+        """
+        Connects, waits for the ACK, then pulls the document.
+        """
+
+        token = generate_jwt_token(generate_session_id())
+        socket = await websocket_connect(HTTPRequest(self.url, connect_timeout=self.timeout),
+                                         subprotocols=['bokeh', token])
+        self.socket = WebSocketClientConnectionWrapper(socket)
+
+        await self._wait_for(lambda msg: msg.msgtype == 'ACK')
+
+        request = self.protocol.create('PULL-DOC-REQ')
+        self.bytes_sent += await request.send(self.socket)
+
+        reply = await self._wait_for(lambda msg: msg.msgtype == 'PULL-DOC-REPLY')
+        reply.push_to_document(self.document)
+
+    async def change(self, name: str, value):
+        """
+        Sets the value of a widget and waits for the server to reply, after the changes of the document if the
+        callback made any.
+        """
+
+        model = self.document.get_model_by_name(name)
+        attr = 'active' if name == 'tabs' else 'value'
+
+        events = []
+        self.document.on_change(events.append)
+        setattr(model, attr, value)
+        self.document.remove_on_change(events.append)
+
+        if not events:  # No change, so nothing is sent to the server.
+            return
+
+        message = self.protocol.create('PATCH-DOC', events, use_buffers=False)
+        self.bytes_sent += await message.send(self.socket)
+
+        # The server sends the changes made by the callback as PATCH-DOC messages before replying OK to the change,
+        # and only the OK when the callback changed nothing (e.g. a tab showing the hurricanes it last selected).
+        def done(msg) -> bool:
+            if msg.msgtype == 'ERROR':
+                raise RuntimeError(msg.content.get('text'))
+            return msg.msgtype == 'OK' and msg.header.get('reqid') == message.header['msgid']
+
+        await self._wait_for(done)
+
+    def close(self):
+        if self.socket is not None:
+            self.socket._socket.close()
+
+    async def _wait_for(self, predicate):
+        while True:
+            fragment = await asyncio.wait_for(self.socket._socket.read_message(), self.timeout)
+            if fragment is None:
+                raise ConnectionError('Connection closed by the server')
+
+            self.bytes_received += len(fragment)
+
+            message = await self.receiver.consume(fragment)
+            if message is not None and predicate(message):
+                return message
+
+
+class RssSampler:
+    """
+    Samples the resident memory of a process from /proc (Linux only).
+    """
+
+    def __init__(self, pid: Optional[int]):
+        self.pid = pid
+        self.samples = []
+
+    def sample(self) -> Optional[int]:
+        if self.pid is None:
+            return None
+
+        try:
+            with open('/proc/{}/status'.format(self.pid)) as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        rss = int(line.split()[1]) * 1024
+                        self.samples.append(rss)
+                        return rss
+        except OSError:
+            return None
+
+    async def run(self, interval: float):
+        while True:
+            self.sample()
+            await asyncio.sleep(interval)
+
+    def report(self) -> dict:
+        if not self.samples:
+            return {}
+
+        return {'start': self.samples[0], 'peak': max(self.samples), 'end': self.samples[-1]}
+
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {'n': 0}
+
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+
+    return {'n': len(values), 'p50': p50, 'p90': p90, 'p99': p99, 'max': max(values)}
+
+
+async def user(url: str, app: str, rounds: int, think: float, timeout: float,
+               latencies: Dict[str, List[float]], totals: Dict[str, int]):
+    """
+    Opens a session and replays the script of `app`, recording the latencies of each callback.
+    """
+
+    session = HeadlessSession(url, timeout)
+
+    try:
+        t_0 = time.perf_counter()
+        await session.open()
+        latencies['session_open'].append(time.perf_counter() - t_0)
+
+        for _ in range(rounds):
+            for name, value in SCRIPTS[app]:
+                t_0 = time.perf_counter()
+                await session.change(name, value)
+                latencies[CALLBACKS[app][name]].append(time.perf_counter() - t_0)
+
+                await asyncio.sleep(think)
+
+    except Exception as e:
+        totals['errors'] += 1
+        print('Session failed: {!r}'.format(e))
+
+    finally:
+        session.close()
+        totals['bytes_received'] += session.bytes_received
+        totals['bytes_sent'] += session.bytes_sent
+
+
+async def load_test(url: str, app: str, sessions: int, rounds: int, think: float, ramp_up: float,
+                    timeout: float, pid: Optional[int]) -> dict:
+    """
+    Runs `sessions` concurrent users against the `app` of the bokeh server at url.
+
+    Return
+    ------
+
+    report: dict
+        Latency percentiles (in seconds) of the opening of sessions and of each callback, bytes exchanged and
+        memory of the server.
+    """
+
+    latencies = {name: [] for name in ['session_open'] + sorted(set(CALLBACKS[app].values()))}
+    totals = {'errors': 0, 'bytes_received': 0, 'bytes_sent': 0}
+
+    rss = RssSampler(pid)
+    sampler = asyncio.ensure_future(rss.run(0.5))
+
+    t_0 = time.perf_counter()
+
+    users = []
+    for i in range(sessions):
+        users.append(asyncio.ensure_future(user(url + '/' + app, app, rounds, think, timeout, latencies, totals)))
+        await asyncio.sleep(ramp_up / sessions)
+
+    await asyncio.gather(*users)
+
+    duration = time.perf_counter() - t_0
+    sampler.cancel()
+    rss.sample()
+
+    return {'app': app, 'sessions': sessions, 'rounds': rounds, 'think': think, 'duration': duration,
+            'errors': totals['errors'], 'bytes_received': totals['bytes_received'],
+            'bytes_sent': totals['bytes_sent'],
+            'latencies': {name: percentiles(values) for name, values in latencies.items()},
+            'server_rss': rss.report()}
+
+
+def spawn_server(timeout: float = 60.0) -> subprocess.Popen:
+    """
+    Starts app.py in a subprocess and waits until it is ready.
+    """
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen([sys.executable, 'app.py'], cwd=root,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    t_0 = time.time()
+    while time.time() - t_0 < timeout:
+        try:
+            with urllib.request.urlopen('http://localhost:8000/ready', timeout=1) as response:
+                if response.status == 200:
+                    return process
+        except OSError:
+            pass
+
+        if process.poll() is not None:
+            raise RuntimeError('app.py exited with code {}'.format(process.returncode))
+        time.sleep(0.2)
+
+    process.kill()
+    raise TimeoutError('app.py was not ready after {}s'.format(timeout))
+
+
+def print_report(report: dict):
+    print('\n{} sessions of {} in {:.1f}s, {} error(s)'.format(report['sessions'], report['app'],
+                                                                report['duration'], report['errors']))
+    print('Bytes received {}, sent {}'.format(report['bytes_received'], report['bytes_sent']))
+
+    if report['server_rss']:
+        print('Server RSS start {start} peak {peak} end {end} bytes'.format(**report['server_rss']))
+
+    for name, stats in report['latencies'].items():
+        if stats['n']:
+            print('  {:<20} n {:>6}  p50 {:>8.4f}s  p90 {:>8.4f}s  p99 {:>8.4f}s  max {:>8.4f}s'
+                  .format(name, stats['n'], stats['p50'], stats['p90'], stats['p99'], stats['max']))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=BOKEH_URL, help='Url of the bokeh server.')
+    parser.add_argument('--app', choices=list(SCRIPTS), default='spawns')
+    parser.add_argument('--sessions', type=int, default=10, help='Number of concurrent sessions.')
+    parser.add_argument('--rounds', type=int, default=1, help='Number of replays of the script by each session.')
+    parser.add_argument('--think', type=float, default=0.0, help='Pause between two interactions, in seconds.')
+    parser.add_argument('--ramp-up', type=float, default=1.0, help='Time to open all the sessions, in seconds.')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Timeout of each server reply, in seconds.')
+    parser.add_argument('--pid', type=int, help='Pid of the server, to sample its memory.')
+    parser.add_argument('--spawn', action='store_true', help='Start app.py in a subprocess for the test.')
+    parser.add_argument('--output', help='Path of the json file to write the report to.')
+    args = parser.parse_args(argv)
+
+    process = spawn_server() if args.spawn else None
+    pid = process.pid if process is not None else args.pid
+
+    try:
+        report = asyncio.run(load_test(args.url, args.app, args.sessions, args.rounds, args.think,
+                                       args.ramp_up, args.timeout, pid))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,456 @@
+"""
+Benchmarks of the preprocessing pipeline and of the bokeh apps.
+
+The bundled data is replicated `scale` times and written back to the NOAA text format (or, with --synthetic,
+`scale` times SYNTHETIC_STORMS synthetic hurricanes are generated), then every step of the pipeline is timed on it,
+followed by the opening of a session of each app and the widgets callbacks, driven headlessly on a bokeh Document.
+
+Usage, from the root of the repository:
+
+    $ python -m benchmarks.run_benchmarks --scales 1 4 --repeat 5 --output before.json
+    $ python -m benchmarks.run_benchmarks --scales 1 4 --repeat 5 --output after.json --compare before.json
+    $ python -m benchmarks.run_benchmarks --scales 10 100 --repeat 1 --synthetic
+    $ python -m benchmarks.run_benchmarks --scales 1 --repeat 3 --synthetic --basins AL EP
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+from typing import Callable, Dict, List, Optional, Sequence
+
+import pandas as pd
+from bokeh.document import Document
+from bokeh.models import ColumnDataSource
+from bokeh.protocol import Protocol
+
+from benchmarks.fixtures import scale_tracks, write_hurdat
+from tools.synthetic_tools import write_synthetic_hurdat
+from tools.extraction_tools import extraction_pipeline
+from tools.cleaning_tools import cleaning_pipeline, format_date_hours, format_lon_lat, fill_radii
+from tools.features_engineering_tools import wgs84_to_web_mercator, season, zones, haversine
+from tools.zones_tools import polygon_zones
+from workflow.df_for_figures import create_full_tracks_df, create_start_end_df, create_intervals_df
+from workflow.compression import compress_stream, deflate_size
+from workflow.config import ZONES_FILE
+from workflow.datasets import load_start_end_df, load_tracks_df
+from workflow.make_figures import make_start_end_figure, make_tracks_figure
+from workflow.pool import DocumentPool
+from workflow.resampling import resample_tracks_to_store
+from workflow.intervals import load_interval_index
+from workflow.partitions import build_partitions, load_partitioned_tracks
+from workflow.playback import PlaybackFrames
+from workflow.polylines import storm_line
+from workflow.queries import binary_columns
+from workflow.similarity import load_similarity_index
+from workflow.climatology import build_climatology_tables, load_climatology
+from workflow.spatial import load_track_index
+
+
+# Scripted interactions for the callbacks benchmarks: (app, callback, widget name, two alternating values).
+# Each value change triggers the callback once. The value of the tabs is their active tab.
+INTERACTIONS = [
+    ('spawns', 'update_map_se', 'select_number', '-1', '20'),
+    ('spawns', 'update_map_se', 'slider_year', (1990, 2005), (1970, 2017)),
+    ('spawns', 'update_map_se', 'slider_month', (6, 9), (1, 12)),
+    ('spawns', 'update_map_se', 'select_zone', 'Atlantic', 'All'),
+    ('spawns', 'update_map_se', 'slider_dates', (date(2005, 9, 1), date(2005, 9, 15)),
+     (date(1970, 1, 1), date(2017, 12, 31))),
+    ('spawns', 'update_map_season', 'select_number_season', '-1', '20'),
+    ('spawns', 'update_map_season', 'slider_year_season', (1990, 2005), (1970, 2017)),
+    ('spawns', 'update_map_season', 'select_season', 'Summer', 'All'),
+    ('spawns', 'update_map_season', 'select_zone_season', 'Mexico_Caribbean', 'All'),
+    ('spawns', 'tab_change', 'tabs', 1, 0),
+    ('tracks', 'update_map_se', 'select_number', '-1', '20'),
+    ('tracks', 'update_map_se', 'slider_year', (1990, 2005), (1970, 2017)),
+    ('tracks', 'update_map_se', 'slider_month', (6, 9), (1, 12)),
+    ('tracks', 'update_map_se', 'select_zone', 'Atlantic', 'All'),
+    ('tracks', 'update_map_se', 'text_near', '25.76, -80.19', '32.30, -64.80'),
+    ('tracks', 'update_map_se', 'slider_dates', (date(2005, 9, 1), date(2005, 9, 15)),
+     (date(1970, 1, 1), date(2017, 12, 31))),
+    ('tracks', 'update_similar', 'text_similar', 'AL122005', 'AL011970'),
+]
+
+# Number of synthetic hurricanes per scale unit, about as many as the bundled hurricanes since 1970.
+SYNTHETIC_STORMS = 800
+
+
+def summarize(timings: List[float], **extra) -> dict:
+    result = {'n': len(timings), 'min': min(timings), 'median': statistics.median(timings),
+              'mean': statistics.mean(timings), 'max': max(timings)}
+    result.update(extra)
+    return result
+
+
+def measure(func: Callable, repeat: int) -> dict:
+    """
+    Times `repeat` calls of func, silencing the prints of the pipeline.
+    """
+
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t_0 = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - t_0)
+
+    return summarize(timings)
+
+
+def patch_frames(events: list) -> List[bytes]:
+    """
+    Returns the websocket frames of the PATCH-DOC message the bokeh server would send for `events`.
+    """
+
+    if not events:
+        return []
+
+    msg = Protocol().create('PATCH-DOC', events)
+
+    frames = [msg.header_json, msg.metadata_json, msg.content_json] + [buffer for _, buffer in msg.buffers]
+
+    return [frame.encode() if isinstance(frame, str) else bytes(frame) for frame in frames]
+
+
+def patch_bytes(events: list) -> int:
+    """
+    Returns the size of the PATCH-DOC message the bokeh server would send for `events`.
+    """
+
+    return sum(len(frame) for frame in patch_frames(events))
+
+
+def patch_deflated_bytes(events: list) -> int:
+    """
+    Returns the size of the PATCH-DOC message for `events` once compressed by permessage-deflate.
+    """
+
+    return sum(deflate_size(frame) for frame in patch_frames(events))
+
+
+def prepare_data(work_dir: str, scale: int, synthetic: bool = False, basins: Sequence[str] = ('AL',)):
+    """
+    Writes a hurdat2.txt file in work_dir with `scale` times the hurricanes of the bundled data, or `scale` times
+    SYNTHETIC_STORMS synthetic hurricanes of each of basins.
+    """
+
+    if synthetic:
+        write_synthetic_hurdat(work_dir + 'hurdat2.txt', n_storms=SYNTHETIC_STORMS * scale, seed=scale,
+                               basins=basins)
+        return
+
+    df_names = pd.read_csv('files/df_names.csv', index_col=0)
+    df_tracks = pd.read_csv('files/df_tracks.csv', index_col=0, dtype={'Hour': str})
+
+    df_names, df_tracks = scale_tracks(df_names, df_tracks, scale)
+
+    write_hurdat(df_names, df_tracks, work_dir + 'hurdat2.txt')
+
+
+def bench_pipeline(work_dir: str, repeat: int) -> Dict[str, dict]:
+    """
+    Times each step of the preprocessing pipeline, in order, leaving its outputs in work_dir.
+    """
+
+    results = dict()
+
+    results['extraction_pipeline'] = measure(lambda: extraction_pipeline(files_dir=work_dir), repeat)
+
+    df_tracks = pd.read_csv(work_dir + 'df_tracks.csv', header=0, index_col=0, dtype={'Hour': str})
+    results['format_date_hours'] = measure(lambda: format_date_hours(df_tracks), repeat)
+    df_tracks = format_date_hours(df_tracks)
+    results['format_lon_lat'] = measure(lambda: format_lon_lat(df_tracks), repeat)
+    df_tracks = format_lon_lat(df_tracks)
+    results['fill_radii'] = measure(lambda: fill_radii(df_tracks), repeat)
+
+    results['cleaning_pipeline'] = measure(lambda: cleaning_pipeline(files_dir=work_dir), repeat)
+
+    df = pd.read_csv(work_dir + 'df_tracks_after_1970.csv', index_col=0, dtype={'Hour': str}, parse_dates=['Time'])
+    results['wgs84_to_web_mercator'] = measure(lambda: wgs84_to_web_mercator(df=df), repeat)
+    results['season'] = measure(lambda: season(df=df), repeat)
+    results['zones'] = measure(lambda: zones(df=df), repeat)
+    results['polygon_zones'] = measure(lambda: polygon_zones(df=df, zones_file=ZONES_FILE), repeat)
+
+    df = polygon_zones(df=season(df=wgs84_to_web_mercator(df=df)), zones_file=ZONES_FILE)
+    df.to_csv(work_dir + 'df_tracks_augmented.csv')
+
+    results['resample_tracks'] = measure(lambda: resample_tracks_to_store(df, work_dir + 'tracks_hourly/'), repeat)
+
+    results['create_full_tracks_df'] = measure(
+        lambda: create_full_tracks_df(file_path=work_dir + 'df_tracks_augmented.csv',
+                                      file_name=work_dir + 'df_full_tracks_bokeh.csv'), repeat)
+
+    df_full = pd.read_csv(work_dir + 'df_full_tracks_bokeh.csv', index_col=0, parse_dates=['Time'])
+    results['haversine'] = measure(lambda: haversine(df_full), repeat)
+
+    results['create_start_end_df'] = measure(
+        lambda: create_start_end_df(file_path=work_dir + 'df_full_tracks_bokeh.csv',
+                                    file_name=work_dir + 'df_start_end_bokeh.csv'), repeat)
+
+    results['create_intervals_df'] = measure(
+        lambda: create_intervals_df(file_path=work_dir + 'df_full_tracks_bokeh.csv',
+                                    file_name=work_dir + 'df_storm_intervals.csv'), repeat)
+
+    results['build_partitions'] = measure(lambda: build_partitions(files_dir=work_dir), repeat)
+
+    results['build_climatology_tables'] = measure(lambda: build_climatology_tables(files_dir=work_dir), repeat)
+
+    return results
+
+
+def bench_apps(work_dir: str, repeat: int) -> Dict[str, dict]:
+    """
+    Times the loading of the datasets, the opening of a session of each app and the widgets callbacks.
+    """
+
+    results = dict()
+    apps = {'spawns': (make_start_end_figure, load_start_end_df), 'tracks': (make_tracks_figure, load_tracks_df)}
+
+    for app, (make_figure, load) in apps.items():
+
+        def load_cold():
+            load.cache_clear()
+            load(files_dir=work_dir)
+
+        results['{}.load_dataset'.format(app)] = measure(load_cold, repeat)
+
+        results['{}.session_open'.format(app)] = measure(lambda: make_figure(Document(), files_dir=work_dir), repeat)
+
+        # Opening from a warm pool, filled beforehand
+        pool = DocumentPool(app, lambda doc: make_figure(doc, files_dir=work_dir), repeat)
+        with contextlib.redirect_stdout(io.StringIO()):
+            pool.fill()
+        results['{}.session_open_pooled'.format(app)] = measure(lambda: pool.populate(Document()), repeat)
+
+    # Hurricanes within 200km of Miami
+    index = load_track_index(files_dir=work_dir)
+    results['tracks.storms_within'] = measure(lambda: index.storms_within(-80.19, 25.76, 200), repeat)
+
+    # Tracks most similar to the one of a hurricane, and of every hurricane
+    similarity = load_similarity_index(files_dir=work_dir)
+    results['tracks.similar'] = measure(lambda: similarity.similar(similarity.ids[len(similarity) // 2]), repeat)
+    results['tracks.similar_table'] = measure(lambda: similarity.top_k_table(), repeat)
+
+    # ACE and intensity of the hurricanes of 1990 to 2005, from the prefix sums of the years
+    climatology = load_climatology(files_dir=work_dir)
+    results['climatology.window'] = measure(lambda: climatology.window(1990, 2005), repeat)
+
+    # Hurricanes active during the first half of September 2005
+    intervals = load_interval_index(files_dir=work_dir)
+    results['storms_active'] = measure(lambda: intervals.active_between(date(2005, 9, 1), date(2005, 9, 15)), repeat)
+
+    # Tracks of the hurricanes of a basin which started in 2005, from the partitions, reading them from the files or
+    # from memory
+    partitions = load_partitioned_tracks(files_dir=work_dir)
+    basin = partitions.basins[-1]
+
+    def select_cold():
+        partitions._frames.clear()
+        partitions.select([basin], (2005, 2005))
+
+    results['partitions.select'] = measure(select_cold, repeat)
+    results['partitions.select_warm'] = measure(lambda: partitions.select([basin], (2005, 2005)), repeat)
+
+    # Playback of the tracks of the hurricanes of 2005: the frames, then each frame streamed to a source
+    df_2005 = load_tracks_df(files_dir=work_dir)
+    df_2005 = df_2005.loc[df_2005['Time'].dt.year == 2005]
+    results['tracks.playback_frames'] = measure(lambda: PlaybackFrames(ColumnDataSource.from_df(df_2005)), repeat)
+    results['tracks.playback_frame'] = bench_playback(PlaybackFrames(ColumnDataSource.from_df(df_2005)))
+
+    # Line of the tracks of every hurricane
+    df_tracks = load_tracks_df(files_dir=work_dir)
+    results['tracks.storm_line'] = measure(lambda: storm_line(df_tracks), repeat)
+
+    # Every step of the tracks in the binary columns of /api/storms, compressed with gzip as they are streamed
+    chunks = list(binary_columns(df_tracks, {'dataset': 'tracks'}))
+    sizes = []
+    timings = measure(lambda: sizes.append(sum(len(chunk) for chunk in compress_stream(chunks, 'gzip'))), repeat)
+    results['api.storms_binary'] = dict(timings, bytes=sum(len(chunk) for chunk in chunks), deflated_bytes=sizes[-1])
+
+    docs = dict()
+    for app, (make_figure, _) in apps.items():
+        docs[app] = Document()
+        with contextlib.redirect_stdout(io.StringIO()):
+            make_figure(docs[app], files_dir=work_dir)
+
+    # The tracks app drawing a single line, without and with the markers, with the same interactions
+    docs['tracks_lines'] = Document()
+    make_tracks_figure(docs['tracks_lines'], files_dir=work_dir, rendering='lines', markers=False)
+    docs['tracks_lines_markers'] = Document()
+    make_tracks_figure(docs['tracks_lines_markers'], files_dir=work_dir, rendering='lines', markers=True)
+    interactions = INTERACTIONS + [(app,) + interaction[1:] for app in ('tracks_lines', 'tracks_lines_markers')
+                                   for interaction in INTERACTIONS if interaction[:2] == ('tracks', 'update_map_se')]
+
+    for app, callback, widget_name, value_a, value_b in interactions:
+        doc = docs[app]
+        widget = doc.get_model_by_name(widget_name)
+
+        events = []
+        doc.on_change(events.append)
+
+        timings, sizes, deflated_sizes = [], [], []
+        for _ in range(repeat):
+            for value in (value_a, value_b):
+                del events[:]
+                t_0 = time.perf_counter()
+                setattr(widget, 'active' if widget_name == 'tabs' else 'value', value)
+                timings.append(time.perf_counter() - t_0)
+                sizes.append(patch_bytes(events))
+                deflated_sizes.append(patch_deflated_bytes(events))
+
+        doc.remove_on_change(events.append)
+
+        results['{}.{}.{}'.format(app, callback, widget_name)] = summarize(timings, bytes=max(sizes),
+                                                                            deflated_bytes=max(deflated_sizes))
+
+    return results
+
+
+def bench_playback(frames: PlaybackFrames) -> dict:
+    """
+    Times the streaming of every frame of a playback to a source of a Document, with the size of their messages.
+    """
+
+    doc = Document()
+    source = ColumnDataSource(data=frames.empty())
+    doc.add_root(source)
+
+    events = []
+    doc.on_change(events.append)
+
+    timings, sizes = [], []
+    for i in range(len(frames)):
+        del events[:]
+        t_0 = time.perf_counter()
+        source.stream(frames.frame(i), rollover=frames.rollover(i))
+        timings.append(time.perf_counter() - t_0)
+        sizes.append(patch_bytes(events))
+
+    return summarize(timings or [0.0], bytes=max(sizes or [0]))
+
+
+def run(scales: List[int], repeat: int, work_dir: Optional[str] = None, synthetic: bool = False,
+        basins: Sequence[str] = ('AL',)) -> dict:
+    """
+    Runs every benchmark for each scale factor.
+
+    Return
+    ------
+
+    report: dict
+        Metadata of the run, and for each scale, the statistics of each benchmark (in seconds).
+    """
+
+    report = {'meta': {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'commit': git_commit(),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'pandas': pd.__version__,
+                       'repeat': repeat,
+                       'synthetic': synthetic,
+                       'basins': list(basins),
+                       'scales': scales},
+              'results': dict()}
+
+    for scale in scales:
+        with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+            tmp = tmp + '/'
+
+            print('Scale {}: preparing data'.format(scale))
+            prepare_data(tmp, scale, synthetic, basins)
+
+            print('Scale {}: pipeline'.format(scale))
+            results = bench_pipeline(tmp, repeat)
+
+            print('Scale {}: apps'.format(scale))
+            results.update(bench_apps(tmp, repeat))
+
+        report['results'][str(scale)] = results
+
+    return report
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> List[str]:
+    """
+    Lists the benchmarks of report whose median is more than `threshold` (relative) slower than in baseline.
+    """
+
+    regressions = []
+
+    for scale, results in report['results'].items():
+        for name, stats in results.items():
+            base = baseline['results'].get(scale, dict()).get(name)
+            if base is None:
+                continue
+
+            ratio = stats['median'] / base['median']
+            if ratio > 1 + threshold:
+                regressions.append('scale {}: {} {:.4f}s -> {:.4f}s (x{:.2f})'
+                                   .format(scale, name, base['median'], stats['median'], ratio))
+
+    return regressions
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report: dict):
+    for scale, results in report['results'].items():
+        print('\nScale {}'.format(scale))
+        for name, stats in results.items():
+            print('  {:<55} median {:>9.4f}s  min {:>9.4f}s{}'
+                  .format(name, stats['median'], stats['min'],
+                          '  {} bytes ({} deflated)'.format(stats['bytes'], stats.get('deflated_bytes', '-'))
+                          if 'bytes' in stats else ''))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1],
+                        help='Dataset scale factors, i.e. number of copies of the bundled hurricanes.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timings of each benchmark.')
+    parser.add_argument('--output', help='Path of the json file to write the results to.')
+    parser.add_argument('--compare', help='Path of a previous json results file to compare to.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative slow down of the median flagged as a regression.')
+    parser.add_argument('--synthetic', action='store_true',
+                        help='Use synthetic hurricanes instead of replicating the bundled ones.')
+    parser.add_argument('--basins', nargs='+', default=['AL'],
+                        help='Basins of the synthetic hurricanes, the apps only show the ones of HURRICANES_BASINS.')
+    parser.add_argument('--work-dir', help='Directory for the temporary data files.')
+    args = parser.parse_args(argv)
+
+    report = run(args.scales, args.repeat, args.work_dir, args.synthetic, args.basins)
+
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        regressions = compare(report, baseline, args.threshold)
+        print('\n{} regression(s) compared to {}'.format(len(regressions), args.compare))
+        for line in regressions:
+            print('  ' + line)
+
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
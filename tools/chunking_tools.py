@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+from typing import Iterator, Optional
+
+
+def read_storm_chunks(file_path: str, chunk_rows: Optional[int] = None, id_column: str = 'ID',
+                      **kwargs) -> Iterator[pd.DataFrame]:
+    """
+    Reads a csv file of observations of hurricanes by chunks of whole hurricanes, so that a hurricane is never split
+    between two chunks.
+
+    Parameters
+    ----------
+
+    file_path: str
+        The csv file, the observations of each hurricane in consecutive rows.
+    chunk_rows: Optional[int]
+        The number of rows read at once. A chunk holds at most chunk_rows rows, plus the rows of the hurricane at its
+        end. None or 0 to read the whole file as a single chunk.
+    id_column: str
+        The column of the IDs of the hurricanes.
+    kwargs:
+        The arguments of pd.read_csv.
+
+    Return
+    ------
+
+    chunks: Iterator[pd.DataFrame]
+        The chunks of the file, in order.
+
+    Raises
+    ------
+
+    ValueError
+        If the observations of a hurricane are not in consecutive rows.
+    """
+
+    if not chunk_rows:
+        yield pd.read_csv(file_path, **kwargs)
+        return
+
+    carry = None
+    done = set()
+
+    def complete(df: pd.DataFrame) -> pd.DataFrame:
+        ids = pd.unique(df[id_column])
+        if not done.isdisjoint(ids):
+            raise ValueError('The observations of the hurricanes of {} are not in consecutive rows'.format(file_path))
+        done.update(ids)
+        return df
+
+    for chunk in pd.read_csv(file_path, chunksize=chunk_rows, **kwargs):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+
+        # The rows of the last hurricane of the chunk may go on in the next one
+        ids = chunk[id_column].values
+        others = np.flatnonzero(ids != ids[-1])
+        split = others[-1] + 1 if len(others) else 0
+
+        carry = chunk.iloc[split:]
+        if split:
+            # Copies, not views of the chunk read, which the stages may modify
+            yield complete(chunk.iloc[:split].copy())
+
+    if carry is not None and len(carry):
+        yield complete(carry.copy())
+
+
+def write_chunk(df: pd.DataFrame, file_path: str, first: bool):
+    """
+    Writes a chunk of a csv file: the first one replaces the file, with the header, the next ones are appended.
+    """
+
+    df.to_csv(file_path, mode='w' if first else 'a', header=first)
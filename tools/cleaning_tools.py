@@ -1,7 +1,12 @@
 import pandas as pd
+from typing import Optional
+from tools.chunking_tools import read_storm_chunks, write_chunk
 
+# Hours of the 6-hourly scheme
+HOURS = ['06:00', '12:00', '18:00', '00:00']
 
-def format_date_hours(df: pd.DataFrame) -> pd.DataFrame:
+
+def format_date_hours(df: pd.DataFrame, check: bool = True) -> pd.DataFrame:
     """
     Format time and remove data points outside the 6-hourly scheme.
     
@@ -9,6 +14,8 @@ def format_date_hours(df: pd.DataFrame) -> pd.DataFrame:
     ----------
     df : pd.DataFrame
         The tracks DataFrame.
+    check : bool
+        Whether to check that every hour of the 6-hourly scheme is left, which only holds for enough data points.
     
     Return
     -------
@@ -25,7 +32,7 @@ def format_date_hours(df: pd.DataFrame) -> pd.DataFrame:
     df_temp['Time'] = df_temp['Time'].map(lambda x: pd.to_datetime(x))
 
     # Extraction of the 6-hourly scheme
-    hours = ['06:00', '12:00', '18:00', '00:00']
+    hours = HOURS
 
     filt = df_temp.Hour.map(lambda x: x in hours)
 
@@ -34,7 +41,7 @@ def format_date_hours(df: pd.DataFrame) -> pd.DataFrame:
     df_temp.reset_index(drop=True, inplace=True)
 
     # Reality Check
-    if set(df_temp.Hour.unique()) != set(hours):
+    if check and set(df_temp.Hour.unique()) != set(hours):
         raise ValueError('The extraction of the 6-hourly scheme failed.')
 
     df_temp.drop(columns=['Date', 'Hour'], inplace=True)
@@ -122,8 +129,22 @@ def format_lon_lat(df: pd.DataFrame) -> pd.DataFrame:
     return df_temp
 
 
+def clean_tracks(df_tracks: pd.DataFrame, year: int = 1970, check: bool = True) -> pd.DataFrame:
+    """
+    Cleans the tracks DataFrame df_tracks, keeping the data with year >= `year` (see cleaning_pipeline).
+    """
+
+    df_tracks = format_date_hours(df_tracks, check)
+
+    df_tracks = format_lon_lat(df_tracks)
+
+    df_tracks = fill_radii(df_tracks)
+
+    return df_tracks.loc[df_tracks.Time.map(lambda x: x.year) >= year]
+
+
 def cleaning_pipeline(files_dir: str, track_name: str = 'df_tracks.csv',
-                      new_name: str = 'df_tracks_after_1970', year: int = 1970):
+                      new_name: str = 'df_tracks_after_1970', year: int = 1970, chunk_rows: Optional[int] = None):
     """
     Cleans the data from df_tracks and saves the data with year >= `year`into a separate DataFrame.
 
@@ -138,29 +159,31 @@ def cleaning_pipeline(files_dir: str, track_name: str = 'df_tracks.csv',
         Name to use for saving the filtered data.
     year: int
         The year to use as a lower bound
+    chunk_rows: Optional[int]
+        The number of rows of df_tracks cleaned at once, by whole hurricanes (see read_storm_chunks), or None to
+        clean it all at once.
 
     Return
     ------
     """
     tracks_path = files_dir + track_name
 
+    save_path = files_dir + new_name + '.csv'
+
+    if chunk_rows:
+        clean_tracks_chunks(tracks_path, save_path, year, chunk_rows)
+        return
+
     # Necessary to set the dtype of Hour column, otherwise pandas infers int which yields errors
     df_tracks = pd.read_csv(tracks_path, header=0, index_col=0, dtype={'Hour': str})
 
     print(df_tracks.head())
     print('\n')
 
-    df_tracks = format_date_hours(df_tracks)
-
-    df_tracks = format_lon_lat(df_tracks)
-
-    df_tracks = fill_radii(df_tracks)
-
-    df_tracks = df_tracks.loc[df_tracks.Time.map(lambda x: x.year) >= year]
+    df_tracks = clean_tracks(df_tracks, year)
 
     df_tracks.reset_index(inplace=True, drop=True)
 
-    save_path = files_dir + new_name + '.csv'
     df_tracks.to_csv(save_path)
 
     print(df_tracks.info())
@@ -168,4 +191,27 @@ def cleaning_pipeline(files_dir: str, track_name: str = 'df_tracks.csv',
     print('There are {} missing values remaining.'.format(df_tracks.isnull().sum().sum()))
 
 
+def clean_tracks_chunks(tracks_path: str, save_path: str, year: int, chunk_rows: int):
+    """
+    Cleans the tracks of the csv file tracks_path chunk after chunk, by whole hurricanes, and writes them to the csv
+    file save_path, as cleaning_pipeline does all at once.
+    """
+
+    rows, hours = 0, set()
+
+    chunks = read_storm_chunks(tracks_path, chunk_rows, header=0, index_col=0, dtype={'Hour': str})
+    for i, df_tracks in enumerate(chunks):
+        df_tracks = clean_tracks(df_tracks, year, check=False)
+
+        # Numbered after the rows of the previous chunks, as when cleaned all at once
+        df_tracks.index = pd.RangeIndex(rows, rows + len(df_tracks))
+        write_chunk(df_tracks, save_path, first=i == 0)
+
+        rows += len(df_tracks)
+        hours.update(df_tracks.Time.dt.strftime('%H:%M').unique())
+
+    # Reality Check, on all the chunks
+    if hours != set(HOURS):
+        raise ValueError('The extraction of the 6-hourly scheme failed.')
 
+    print('{} measurements cleaned, by chunks of {} rows, to {}'.format(rows, chunk_rows, save_path))
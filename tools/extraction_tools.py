@@ -1,16 +1,18 @@
 import pandas as pd
 import numpy as np
-from typing import Tuple, List
+from typing import Tuple, List, Optional, Sequence, Union
 
 
-def load_hurdat(filepath: str) -> Tuple[List[str], List[str]]:
+def load_hurdat(filepath: str, basins: Optional[Sequence[str]] = None) -> Tuple[List[str], List[str]]:
     """
-    Extracts hurricane data from hurdat2.txt file
+    Extracts hurricane data from hurdat2.txt file, of any basin (Atlantic, Eastern or Central Pacific, ...)
 
     Parameters
     ----------
 
     filepath : The pathname to the hurdat2.txt file
+    basins : The basins of the hurricanes to keep, e.g. ['AL', 'EP'] (first two characters of their ID), or None to
+             keep all of them
 
 
     Return
@@ -29,12 +31,16 @@ def load_hurdat(filepath: str) -> Tuple[List[str], List[str]]:
     # When reading the text file, we separate two possible line formats: whether the line contains an ID or not. This is
     # due to the fact that ID's are followed by the corresponding data points without anymore mention of the ID.
     # So it will be easier, later on to just add the ID's separately.
+    # ID's start with the basin code (AL, EP, CP), while data points start with their date.
+    keep = True
     with open(filepath) as text:
         for line in text:
 
-            if line.startswith('AL'):
-                hurricanes.append(line)
-            else:
+            if line[:2].isalpha():
+                keep = basins is None or line[:2] in basins
+                if keep:
+                    hurricanes.append(line)
+            elif keep:
                 tracks.append(line)
 
     print(hurricanes[:5])
@@ -146,10 +152,11 @@ def create_tracks_df(tracks_list: List[str], id_list: List[str]) -> pd.DataFrame
     return df_temp
 
 
-def extraction_pipeline(files_dir: str, hurdat_name: str = 'hurdat2.txt',
-                        name_1: str = 'df_names', name_2:str = 'df_tracks'):
+def extraction_pipeline(files_dir: str, hurdat_name: Union[str, Sequence[str]] = 'hurdat2.txt',
+                        name_1: str = 'df_names', name_2:str = 'df_tracks', basins: Optional[Sequence[str]] = None):
     """
-    Extracts and saves as csv files two DataFrame 'df_names' and 'df_tracks' from the NOAA text data.
+    Extracts and saves as csv files two DataFrame 'df_names' and 'df_tracks' from the NOAA text data, of one or
+    several basins.
 
     df_names contains the ID, names, and length of every hurricane.
     df_tracks contains all the data points for every hurricane.
@@ -159,20 +166,27 @@ def extraction_pipeline(files_dir: str, hurdat_name: str = 'hurdat2.txt',
 
     files_dir: str
             Path to the directory which contains the NOAA text data.
-    hurdat_name: str
-            Name of the file containing the NOAA text data.
+    hurdat_name: Union[str, Sequence[str]]
+            Name of the file containing the NOAA text data, or names of the files of several basins
+            (e.g. hurdat2.txt and hurdat2-nepac.txt).
     name_1: str
             Name to use for saving the ID DataFrame
     name_2: str
             Name to use for saving the tracks DataFrame
+    basins: Optional[Sequence[str]]
+            The basins of the hurricanes to keep, or None to keep all of them.
 
     Return
     ------
 
     """
-    hurdat_path = files_dir + hurdat_name
+    hurdat_names = [hurdat_name] if isinstance(hurdat_name, str) else list(hurdat_name)
 
-    tracks, hurricanes = load_hurdat(filepath=hurdat_path)
+    tracks, hurricanes = [], []
+    for name in hurdat_names:
+        tracks_file, hurricanes_file = load_hurdat(filepath=files_dir + name, basins=basins)
+        tracks += tracks_file
+        hurricanes += hurricanes_file
 
     df_names, id_list = create_hurricanes_df(hurricanes_list=hurricanes)
 
@@ -2,6 +2,9 @@ import pandas as pd
 import numpy as np
 
 
+EARTH_RADIUS = 6371.0  # km
+
+
 def wgs84_to_web_mercator(df: pd.DataFrame, lon: str = "Longitude", lat: str = "Latitude") -> pd.DataFrame:
     """
     Converts latitude and longitudes to web mercator format (used by bokeh)
@@ -103,6 +106,32 @@ def zones(df: pd.DataFrame, lon: str = 'Longitude', lat: str = 'Latitude') -> pd
     return df_temp
 
 
+def haversine_distance(lon_1, lat_1, lon_2, lat_2):
+    """
+    Computes the distance between pairs of points given in degrees using the haversine formula, element-wise.
+
+    Parameters
+    ----------
+
+    lon_1, lat_1: array-like
+        The longitudes and latitudes of the first points.
+    lon_2, lat_2: array-like
+        The longitudes and latitudes of the second points.
+
+    Return
+    ------
+
+    distance: array-like
+        The distance (in km) between the points.
+    """
+
+    lon_1, lat_1, lon_2, lat_2 = (np.radians(value) for value in (lon_1, lat_1, lon_2, lat_2))
+
+    a = np.sin((lat_2 - lat_1) / 2) ** 2 + np.cos(lat_1) * np.cos(lat_2) * np.sin((lon_2 - lon_1) / 2) ** 2
+
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
 def haversine(df, lon_base: str = 'Longitude_start', lat_base: str ='Latitude_start',
               lon_s: str = 'Longitude_end', lat_s: str = 'Latitude_end',
               name: str = 'Distance') -> pd.DataFrame:
@@ -135,16 +164,6 @@ def haversine(df, lon_base: str = 'Longitude_start', lat_base: str ='Latitude_st
 
     df_temp = df.copy()
 
-    r = 6371
-
-    ratio = np.pi/360
-
-    lat_sine = np.sin((df_temp[lat_s] - df_temp[lat_base]) * ratio)
-
-    lat_cosines = np.cos(df_temp[lat_base] * ratio) * np.cos(df_temp[lat_s] * ratio)
-
-    lon_sine = np.sin((df_temp[lon_s] - df_temp[lon_base]) * ratio)
-
-    df_temp[name] = 2 * r * np.arcsin(np.sqrt(lat_sine ** 2 + lat_cosines * lon_sine ** 2))
+    df_temp[name] = haversine_distance(df_temp[lon_base], df_temp[lat_base], df_temp[lon_s], df_temp[lat_s])
 
     return df_temp
@@ -0,0 +1,256 @@
+import argparse
+import numpy as np
+from typing import Dict, Iterator, Sequence, Tuple
+
+
+# Genesis regions of each basin: (lat_min, lat_max, lon_min, lon_max), longitudes are negative west of Greenwich.
+BASINS = {'AL': (8.0, 30.0, -95.0, -20.0),
+          'EP': (8.0, 20.0, -130.0, -90.0),
+          'CP': (8.0, 20.0, -175.0, -140.0)}
+
+# Relative frequency of genesis for each month, peaking in August-September.
+MONTHS_WEIGHTS = np.array([0.2, 0.1, 0.1, 0.2, 1.0, 3.0, 6.0, 15.0, 20.0, 10.0, 3.0, 0.5])
+
+STORM_NAMES = ['ALPHA', 'BRAVO', 'CHARLIE', 'DELTA', 'ECHO', 'FOXTROT', 'GOLF', 'HOTEL', 'INDIA', 'JULIETT',
+               'KILO', 'LIMA', 'MIKE', 'NOVEMBER', 'OSCAR', 'PAPA', 'QUEBEC', 'ROMEO', 'SIERRA', 'TANGO',
+               'UNIFORM', 'VICTOR', 'WHISKEY', 'XRAY', 'YANKEE', 'ZULU']
+
+# Wind speed thresholds (in knots) of the low, medium and high wind radii.
+RADII_SPEEDS = [34, 50, 64]
+
+
+def storms_per_year(n_storms: int, years: Tuple[int, int], rng: np.random.RandomState) -> Dict[int, int]:
+    """
+    Splits n_storms among years, with a mild upward trend, as in the historical record.
+    """
+
+    year_list = np.arange(years[0], years[1] + 1)
+    weights = np.linspace(1.0, 2.0, year_list.size)
+
+    counts = rng.multinomial(n_storms, weights / weights.sum())
+
+    return dict(zip(year_list.tolist(), counts.tolist()))
+
+
+def random_track(rng: np.random.RandomState, basin: str, length: int,
+                 radii: bool) -> Dict[str, np.ndarray]:
+    """
+    Creates a random-walk track for one hurricane.
+
+    The hurricane moves westward in the trade winds, drifts poleward, and recurves to the north-east once it reaches
+    the subtropics. Its intensity grows to a random peak, then decays, faster over high latitudes.
+
+    Parameters
+    ----------
+
+    rng : np.random.RandomState
+        The random generator.
+    basin : str
+        Basin of the hurricane, a key of BASINS.
+    length : int
+        Number of 6-hourly fixes.
+    radii : bool
+        Whether the wind radii of the hurricane are known.
+
+    Return
+    ------
+
+    track: Dict[str, np.ndarray]
+        Latitudes, longitudes, maximal speeds (knots), minimal pressures (mb), statuses and, if radii is True,
+        the 12 wind radii (nautical miles) of each fix.
+    """
+
+    lat_min, lat_max, lon_min, lon_max = BASINS[basin]
+
+    lat = np.empty(length)
+    lon = np.empty(length)
+    lat[0] = rng.uniform(lat_min, lat_max)
+    lon[0] = rng.uniform(lon_min, lon_max)
+
+    # Motion in degrees per 6 hours, steered by the latitude, plus a random walk.
+    d_lon = -rng.uniform(0.5, 1.5)
+    d_lat = rng.uniform(0.0, 0.4)
+    recurvature = rng.uniform(22.0, 32.0)
+
+    for i in range(1, length):
+        steering = np.clip((lat[i - 1] - recurvature) / 10.0, -1.0, 1.0)
+        d_lon = 0.8 * d_lon + 0.2 * (1.2 * steering) + rng.normal(0, 0.15)
+        d_lat = 0.8 * d_lat + 0.2 * (0.3 + 0.5 * abs(steering)) + rng.normal(0, 0.1)
+        lat[i] = np.clip(lat[i - 1] + d_lat, 5.0, 65.0)
+        lon[i] = lon[i - 1] + d_lon
+
+    lon = (lon + 180.0) % 360.0 - 180.0
+
+    # Intensity: growth until a random peak, decay after, random noise.
+    peak = rng.randint(0, length)
+    peak_speed = rng.gamma(shape=4.0, scale=18.0) + 30.0
+    steps = np.arange(length)
+    speed = np.where(steps <= peak,
+                     25.0 + (peak_speed - 25.0) * (steps / max(peak, 1)),
+                     peak_speed - (steps - peak) * rng.uniform(2.0, 6.0))
+    speed = speed - np.clip(lat - 35.0, 0, None) * 1.5 + rng.normal(0, 3.0, length)
+    speed = np.clip(5 * np.round(speed / 5.0), 15, 165)
+
+    # Atkinson-Holliday wind-pressure relationship
+    pressure = np.round(1010.0 - (speed / 6.7) ** (1 / 0.644) + rng.normal(0, 2.0, length))
+
+    status = np.where(speed < 34, 'TD', np.where(speed < 64, 'TS', 'HU'))
+    status = np.where((lat > 40) & (steps > peak), 'EX', status)
+
+    track = {'Latitude': np.round(lat, 1), 'Longitude': np.round(lon, 1), 'Max_Speed': speed,
+             'Min_Pressure': pressure, 'Status': status}
+
+    if radii:
+        # Radii grow with intensity and latitude, are asymmetric (larger on the right side of the motion), and are 0
+        # below their speed threshold.
+        size = rng.uniform(0.6, 1.6)
+        quadrants = np.array([1.2, 1.1, 0.8, 0.9])
+        for rad, threshold in zip(['Low', 'Med', 'High'], RADII_SPEEDS):
+            extent = np.clip(speed - threshold, 0, None) * (1.5 + lat / 40.0) * size + 30.0
+            extent = np.where(speed >= threshold, extent, 0.0)
+            for quadrant, factor in zip(['NE', 'SE', 'SW', 'NW'], quadrants):
+                values = extent * factor * rng.uniform(0.8, 1.2, length)
+                track['{}_Rad_{}'.format(rad, quadrant)] = 5 * np.round(values / 5.0)
+
+    return track
+
+
+def format_storm(storm_id: str, name: str, start: np.datetime64, track: Dict[str, np.ndarray]) -> str:
+    """
+    Formats a hurricane as a header line and one line per fix, in the NOAA hurdat2 format.
+    """
+
+    times = start + np.arange(track['Latitude'].size) * np.timedelta64(6, 'h')
+    days = np.datetime_as_string(times, unit='D')
+    hours = np.datetime_as_string(times, unit='h')
+
+    lines = ['{},{:>19},{:>7},\n'.format(storm_id, name, times.size)]
+
+    rad_cols = ['{}_Rad_{}'.format(rad, quadrant) for rad in ['Low', 'Med', 'High']
+                for quadrant in ['NE', 'SE', 'SW', 'NW']]
+
+    for i in range(times.size):
+        lat, lon = track['Latitude'][i], track['Longitude'][i]
+        radii = ''.join(',{:>5d}'.format(int(track[col][i])) if col in track else ', -999' for col in rad_cols)
+
+        lines.append('{}, {}00,  , {},{:>5.1f}{},{:>6.1f}{},{:>4d},{:>5d}{},\n'.format(
+            days[i].replace('-', ''), hours[i][-2:], track['Status'][i],
+            abs(lat), 'N' if lat >= 0 else 'S', abs(lon), 'W' if lon < 0 else 'E',
+            int(track['Max_Speed'][i]), int(track['Min_Pressure'][i]), radii))
+
+    return ''.join(lines)
+
+
+def generate_storms(n_storms: int, seed: int = 0, years: Tuple[int, int] = (1970, 2017),
+                    track_length: Tuple[int, int] = (8, 60), radii_density: float = 0.5,
+                    radii_since: int = 2004, basins: Sequence[str] = ('AL',)) -> Iterator[str]:
+    """
+    Yields synthetic hurricanes, one at a time, in the NOAA hurdat2 format.
+
+    The output only depends on the parameters, so a given seed always yields the same data.
+
+    Parameters
+    ----------
+
+    n_storms : int
+        Number of hurricanes to create, for each basin.
+    seed : int
+        Seed of the random generator.
+    years : Tuple[int, int]
+        First and last year of the hurricanes.
+    track_length : Tuple[int, int]
+        Minimal and maximal number of 6-hourly fixes of a hurricane.
+    radii_density : float
+        Share of the hurricanes since `radii_since` whose wind radii are known, the others are missing (-999).
+    radii_since : int
+        First year with known wind radii.
+    basins : Sequence[str]
+        Basins of the hurricanes, keys of BASINS.
+
+    Return
+    ------
+
+    storms: Iterator[str]
+        For each hurricane, its header line followed by its fixes.
+    """
+
+    rng = np.random.RandomState(seed)
+
+    for basin in basins:
+        if basin not in BASINS:
+            raise ValueError('Unknown basin {}, expected one of {}.'.format(basin, list(BASINS)))
+
+    months = MONTHS_WEIGHTS / MONTHS_WEIGHTS.sum()
+
+    for year, count in storms_per_year(n_storms * len(basins), years, rng).items():
+
+        # Hurricanes of the year, in order of genesis, numbered per basin.
+        basin_list = rng.choice(list(basins), size=count)
+        starts = np.sort(np.array(['{}-{:02d}-01'.format(year, m) for m in rng.choice(np.arange(1, 13), size=count,
+                                                                                       p=months)],
+                                  dtype='datetime64[h]')
+                         + rng.randint(0, 28 * 4, size=count) * np.timedelta64(6, 'h'))
+
+        numbers = dict.fromkeys(basins, 0)
+
+        for basin, start in zip(basin_list, starts):
+            numbers[basin] += 1
+            storm_id = '{}{:02d}{}'.format(basin, numbers[basin], year)
+
+            name = STORM_NAMES[(numbers[basin] - 1) % len(STORM_NAMES)] if year >= 1950 else 'UNNAMED'
+            length = rng.randint(track_length[0], track_length[1] + 1)
+            radii = year >= radii_since and rng.uniform() < radii_density
+
+            yield format_storm(storm_id, name, start, random_track(rng, basin, length, radii))
+
+
+def write_synthetic_hurdat(filepath: str, n_storms: int, **kwargs) -> int:
+    """
+    Writes synthetic hurricanes to filepath, in the NOAA hurdat2 format read by load_hurdat.
+
+    Hurricanes are written one at a time, so memory does not depend on n_storms.
+
+    Parameters
+    ----------
+
+    filepath : str
+        The pathname of the text file to write.
+    n_storms : int
+        Number of hurricanes to create, for each basin.
+    kwargs:
+        Other parameters of generate_storms.
+
+    Return
+    ------
+
+    size: int
+        Number of characters written.
+    """
+
+    size = 0
+
+    with open(filepath, 'w') as text:
+        for storm in generate_storms(n_storms, **kwargs):
+            size += text.write(storm)
+
+    return size
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Writes a synthetic hurdat2.txt file.')
+    parser.add_argument('output', help='Pathname of the text file to write.')
+    parser.add_argument('--storms', type=int, default=1000, help='Number of hurricanes per basin.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--years', type=int, nargs=2, default=[1970, 2017])
+    parser.add_argument('--track-length', type=int, nargs=2, default=[8, 60],
+                        help='Minimal and maximal number of 6-hourly fixes.')
+    parser.add_argument('--radii-density', type=float, default=0.5)
+    parser.add_argument('--basins', nargs='+', default=['AL'], choices=list(BASINS))
+    args = parser.parse_args()
+
+    written = write_synthetic_hurdat(args.output, args.storms, seed=args.seed, years=tuple(args.years),
+                                     track_length=tuple(args.track_length), radii_density=args.radii_density,
+                                     basins=args.basins)
+
+    print('Wrote {} hurricanes per basin, {} characters.'.format(args.storms, written))
@@ -0,0 +1,274 @@
+import json
+import math
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from typing import List, Tuple
+
+
+# Maximum number of (point, edge) pairs tested at once by the exact tests
+EXACT_CHUNK = 2 ** 20
+
+
+def load_polygons(file_path: str) -> Tuple[List[Tuple[str, List[np.ndarray]]], str]:
+    """
+    Reads the zones of a GeoJSON FeatureCollection of Polygon and MultiPolygon features, named by their "name"
+    property.
+
+    Parameters
+    ----------
+
+    file_path: str
+        The path to the polygon file. Its optional "default" member is the zone of the points outside every polygon.
+
+    Return
+    ------
+
+    polygons: List[Tuple[str, List[np.ndarray]]]
+        The name and the rings, arrays of (longitude, latitude), of each polygon, in the order of the file.
+    default: str
+        The zone of the points outside every polygon.
+    """
+
+    with open(file_path) as f:
+        data = json.load(f)
+
+    polygons = []
+    for feature in data['features']:
+        name, geometry = feature['properties']['name'], feature['geometry']
+
+        if geometry['type'] == 'Polygon':
+            parts = [geometry['coordinates']]
+        elif geometry['type'] == 'MultiPolygon':
+            parts = geometry['coordinates']
+        else:
+            raise ValueError('Unsupported geometry {} for the zone {}'.format(geometry['type'], name))
+
+        for rings in parts:
+            polygons.append((name, [np.asarray(ring, dtype=float)[:, :2] for ring in rings]))
+
+    return polygons, data.get('default', 'Other')
+
+
+class ZoneClassifier:
+    """
+    Classifies points in zones defined by polygons, the first polygon of the file containing a point giving its zone.
+
+    A raster grid of `cell_degrees` covering the polygons is computed once. The cells crossed by no edge are entirely
+    inside or outside of each polygon: their zone is the one of their center, and most points are classified by
+    looking it up. Only the points of the cells crossed by an edge are tested against the polygons.
+
+    Parameters
+    ----------
+
+    polygons: List[Tuple[str, List[np.ndarray]]]
+        The name and the rings of each polygon, as returned by load_polygons.
+    default: str
+        The zone of the points outside every polygon.
+    cell_degrees: float
+        The size of the cells of the grid.
+    """
+
+    def __init__(self, polygons: List[Tuple[str, List[np.ndarray]]], default: str, cell_degrees: float = 0.1):
+        self.names = list(dict.fromkeys([name for name, _ in polygons] + [default]))
+        self.default_code = self.names.index(default)
+        self.polygons = [(self.names.index(name), rings) for name, rings in polygons]
+        self.cell_degrees = cell_degrees
+
+        points = np.concatenate([ring for _, rings in polygons for ring in rings]) if polygons else np.zeros((1, 2))
+        self.lon_0 = math.floor(points[:, 0].min() / cell_degrees) * cell_degrees
+        self.lat_0 = math.floor(points[:, 1].min() / cell_degrees) * cell_degrees
+        self.n_lon = int(math.floor((points[:, 0].max() - self.lon_0) / cell_degrees)) + 1
+        self.n_lat = int(math.floor((points[:, 1].max() - self.lat_0) / cell_degrees)) + 1
+
+        self._index_edges()
+        boundary = self._boundary_cells()
+
+        # No edge separates consecutive cells of a row which are not boundary cells: the zone of each run of such
+        # cells is the one of the center of its first cell. -1 for the boundary cells, left to the exact tests.
+        starts = ~boundary
+        starts[:, 1:] &= boundary[:, :-1]
+        i_lat, i_lon = np.nonzero(starts)
+        zones = self._exact(self.lon_0 + (i_lon + 0.5) * cell_degrees, self.lat_0 + (i_lat + 0.5) * cell_degrees)
+
+        self.grid = zones[np.cumsum(starts.ravel()) - 1].reshape(self.n_lat, self.n_lon)
+        self.grid[boundary] = -1
+
+    @classmethod
+    def from_file(cls, file_path: str, cell_degrees: float = 0.1) -> 'ZoneClassifier':
+        polygons, default = load_polygons(file_path)
+        return cls(polygons, default, cell_degrees)
+
+    def _boundary_cells(self) -> np.ndarray:
+        # Cells touched by an edge, widened by a small margin so that rounding errors never leave one out
+        boundary = np.zeros((self.n_lat, self.n_lon), dtype=bool)
+        margin = 1e-9 * self.cell_degrees
+
+        for _, rings in self.polygons:
+            for ring in rings:
+                for (x_1, y_1), (x_2, y_2) in zip(ring[:-1], ring[1:]):
+                    if x_1 > x_2:
+                        x_1, y_1, x_2, y_2 = x_2, y_2, x_1, y_1
+
+                    first, last = self._lon_index(x_1 - margin), self._lon_index(x_2 + margin)
+                    for column in range(first, last + 1):
+                        # The part of the edge within the column
+                        x_start = max(x_1, self.lon_0 + column * self.cell_degrees)
+                        x_end = min(x_2, self.lon_0 + (column + 1) * self.cell_degrees)
+                        if x_2 > x_1:
+                            y_start = y_1 + (x_start - x_1) * (y_2 - y_1) / (x_2 - x_1)
+                            y_end = y_1 + (x_end - x_1) * (y_2 - y_1) / (x_2 - x_1)
+                        else:
+                            y_start, y_end = y_1, y_2
+                        bottom = self._lat_index(min(y_start, y_end) - margin)
+                        top = self._lat_index(max(y_start, y_end) + margin)
+                        boundary[bottom:top + 1, column] = True
+
+        return boundary
+
+    def _lon_index(self, lon: float) -> int:
+        return min(max(int(math.floor((lon - self.lon_0) / self.cell_degrees)), 0), self.n_lon - 1)
+
+    def _lat_index(self, lat: float) -> int:
+        return min(max(int(math.floor((lat - self.lat_0) / self.cell_degrees)), 0), self.n_lat - 1)
+
+    def _index_edges(self):
+        # The edges of every polygon, but the horizontal ones which never cross a horizontal ray, listed by the rows of
+        # the grid they span, with the offset of each row in an array
+        edges = [(ring[:-1], ring[1:], polygon) for polygon, (_, rings) in enumerate(self.polygons) for ring in rings]
+        start = np.concatenate([edge[0] for edge in edges])
+        end = np.concatenate([edge[1] for edge in edges])
+        polygon = np.concatenate([np.full(len(edge[0]), edge[2]) for edge in edges])
+
+        sloped = start[:, 1] != end[:, 1]
+        self.edge_start, self.edge_end, self.edge_polygon = start[sloped], end[sloped], polygon[sloped]
+
+        margin = 1e-9 * self.cell_degrees
+        first = self._lat_indices(np.minimum(self.edge_start[:, 1], self.edge_end[:, 1]) - margin)
+        last = self._lat_indices(np.maximum(self.edge_start[:, 1], self.edge_end[:, 1]) + margin)
+        counts = last - first + 1
+
+        # Concatenation of the ranges of rows [first, last] of the edges
+        rows = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        edge_ids = np.repeat(np.arange(len(counts)), counts)
+        order = np.argsort(rows, kind='stable')
+
+        self.row_edges = edge_ids[order]
+        self.row_offsets = np.searchsorted(rows[order], np.arange(self.n_lat + 1))
+
+    def _lat_indices(self, lat: np.ndarray) -> np.ndarray:
+        return np.clip(np.floor((lat - self.lat_0) / self.cell_degrees).astype(int), 0, self.n_lat - 1)
+
+    def _exact(self, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        # Even-odd rule: a point is inside a polygon if a ray going east from it crosses an odd number of its edges.
+        # Only the edges spanning the row of the grid of a point can cross its ray.
+        codes = np.full(len(lon), self.default_code, dtype=np.int16)
+
+        rows = self._lat_indices(lat)
+        order = np.argsort(rows, kind='stable')
+        bounds = np.searchsorted(rows[order], np.arange(self.n_lat + 1))
+        polygon_codes = np.array([code for code, _ in self.polygons], dtype=np.int16)
+
+        for row in np.flatnonzero(np.diff(bounds)):
+            edges = self.row_edges[self.row_offsets[row]:self.row_offsets[row + 1]]
+            if len(edges) == 0:
+                continue
+
+            (x_1, y_1), (x_2, y_2) = self.edge_start[edges].T, self.edge_end[edges].T
+            polygons, edge_polygons = np.unique(self.edge_polygon[edges], return_inverse=True)
+            membership = np.zeros((len(edges), len(polygons)), dtype=np.int32)
+            membership[np.arange(len(edges)), edge_polygons] = 1
+
+            # In chunks of points, not to build huge (points, edges) arrays
+            positions = order[bounds[row]:bounds[row + 1]]
+            chunk = max(1, EXACT_CHUNK // len(edges))
+            for i in range(0, len(positions), chunk):
+                batch = positions[i:i + chunk]
+                p_lon, p_lat = lon[batch, None], lat[batch, None]
+
+                crosses = ((y_1 > p_lat) != (y_2 > p_lat)) & (p_lon < x_1 + (p_lat - y_1) * (x_2 - x_1) / (y_2 - y_1))
+                inside = (crosses.astype(np.int32) @ membership) % 2 == 1
+
+                # The first polygon of the file containing the point gives its zone
+                found = inside.any(axis=1)
+                codes[batch[found]] = polygon_codes[polygons[inside[found].argmax(axis=1)]]
+
+        return codes
+
+    def classify_codes(self, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        """
+        Returns the index, in self.names, of the zone of each point.
+        """
+
+        lon, lat = np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+        codes = np.full(len(lon), self.default_code, dtype=np.int16)
+
+        with np.errstate(invalid='ignore'):
+            i_lon = np.floor((lon - self.lon_0) / self.cell_degrees)
+            i_lat = np.floor((lat - self.lat_0) / self.cell_degrees)
+            in_grid = np.flatnonzero((i_lon >= 0) & (i_lon < self.n_lon) & (i_lat >= 0) & (i_lat < self.n_lat))
+
+        cells = self.grid[i_lat[in_grid].astype(int), i_lon[in_grid].astype(int)]
+        codes[in_grid] = cells
+
+        exact = in_grid[cells < 0]
+        codes[exact] = self._exact(lon[exact], lat[exact])
+
+        return codes
+
+    def classify(self, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        """
+        Returns the name of the zone of each point.
+        """
+
+        return np.asarray(self.names, dtype=object)[self.classify_codes(lon, lat)]
+
+
+@lru_cache(maxsize=None)
+def load_zone_classifier(file_path: str) -> ZoneClassifier:
+    """
+    Builds the classifier of the zones of a polygon file, once per process.
+    """
+
+    return ZoneClassifier.from_file(file_path)
+
+
+@lru_cache(maxsize=None)
+def load_zone_names(file_path: str) -> List[str]:
+    """
+    Returns the names of the zones of a polygon file, without building its grid.
+    """
+
+    polygons, default = load_polygons(file_path)
+
+    return list(dict.fromkeys([name for name, _ in polygons] + [default]))
+
+
+def polygon_zones(df: pd.DataFrame, zones_file: str, lon: str = 'Longitude', lat: str = 'Latitude') -> pd.DataFrame:
+    """
+    Adds a column to df with the zone of each entry, from the polygons of a polygon file.
+
+    Parameters
+    ----------
+
+    df: pd.DataFrame
+        A DataFrame containing geographical data expressed in longitudes and latitudes.
+    zones_file: str
+        The path to the polygon file (see load_polygons).
+    lon: str
+        The column of df containing the longitudes.
+    lat: str
+        The column of df containing the latitudes.
+
+    Return
+    ------
+
+    df_temp: pd.DataFrame
+        A copy of df with an additional column for the zones.
+    """
+
+    df_temp = df.copy()
+
+    df_temp['Zones'] = load_zone_classifier(zones_file).classify(df_temp[lon].values, df_temp[lat].values)
+
+    return df_temp
@@ -0,0 +1,286 @@
+"""
+Accumulated Cyclone Energy (ACE) and intensity climatology.
+
+The ACE of a hurricane is the sum of the squares of its 6-hourly maximal winds, in knots, over the observations with a
+tropical status (TD, TS or HU) and winds of tropical storm strength, divided by 10^4. The ACE and the intensity of
+every hurricane, and their totals for each basin and year, are computed in advance from df_tracks_augmented.csv, from
+the root of the repository, with
+
+    $ python -m workflow.climatology
+
+and are then only summed over the years selected, with prefix sums, while the preprocessed files are the ones they
+were computed from.
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from typing import List, Optional, Sequence, Tuple
+from tools.chunking_tools import read_storm_chunks
+from workflow.config import BASINS, FILES_DIR
+from workflow.store import read_columns, read_meta, write_columns
+from workflow.versions import versioned
+
+
+# Statuses of the observations counted in the ACE, and minimal winds (knots) of the observations counted
+TROPICAL_STATUSES = ('TD', 'TS', 'HU')
+ACE_MIN_SPEED = 34.0
+
+# Lowest maximal winds (knots) of the categories 1 to 5 of the Saffir-Simpson scale
+CATEGORY_SPEEDS = (64.0, 83.0, 96.0, 113.0, 137.0)
+MAJOR_CATEGORY = 3
+
+# Years of the rolling means
+ROLLING_YEARS = 10
+
+# Columns of the table of the years, summed over the years selected
+YEAR_COLUMNS = ('Storms', 'Hurricanes', 'Major_Hurricanes', 'ACE', 'Hurricane_Days', 'Peak_Speed')
+
+CLIMATOLOGY_DIR = 'climatology/'
+STORMS_DIR = CLIMATOLOGY_DIR + 'storms/'
+YEARS_DIR = CLIMATOLOGY_DIR + 'years/'
+
+
+def storm_intensities(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Computes the ACE and the intensity of every hurricane of df.
+
+    All the hurricanes are computed at once: their observations are stored one after the other, with the offset of
+    each hurricane in an array.
+
+    Parameters
+    ----------
+
+    df: pd.DataFrame
+        The tracks DataFrame, one row per 6-hourly observation, with the columns ID, Time, Status, Max_Speed (knots)
+        and Min_Pressure (hPa).
+
+    Return
+    ------
+
+    df_storms: pd.DataFrame
+        One row per hurricane, with its ID, Basin, Year (of its first observation), the number of its tropical
+        observations of tropical storm strength (Fixes), its ACE, its maximal winds (Max_Speed) and minimal pressure
+        (Min_Pressure) over its tropical observations, its Hurricane_Days (tropical observations of hurricane
+        strength, 6 hours each) and its Category on the Saffir-Simpson scale (0 below hurricane strength).
+    """
+
+    df = df.sort_values(by=['ID', 'Time'], kind='stable')
+    codes, ids = pd.factorize(df['ID'])
+    offsets = np.searchsorted(codes, np.arange(len(ids) + 1))
+    n_storms = len(ids)
+
+    speeds = df['Max_Speed'].values.astype(np.float64)
+    pressures = df['Min_Pressure'].values.astype(np.float64)
+    tropical = df['Status'].astype(str).str.strip().isin(TROPICAL_STATUSES).values
+
+    # Comparisons with NaN winds are False: the observations without winds are not counted
+    counted = tropical & (speeds >= ACE_MIN_SPEED)
+    hurricane = tropical & (speeds >= CATEGORY_SPEEDS[0])
+
+    # Maximal winds and minimal pressure over the tropical observations, NaN for the hurricanes without any
+    tropical_speeds = np.where(tropical, speeds, np.nan)
+    tropical_pressures = np.where(tropical, pressures, np.nan)
+    first = offsets[:-1]
+    with np.errstate(invalid='ignore'):
+        max_speed = np.fmax.reduceat(tropical_speeds, first) if n_storms else np.zeros(0)
+        min_pressure = np.fmin.reduceat(tropical_pressures, first) if n_storms else np.zeros(0)
+
+    category = np.searchsorted(CATEGORY_SPEEDS, np.nan_to_num(max_speed, nan=0.0), side='right')
+
+    return pd.DataFrame({'ID': np.asarray(ids, dtype=str),
+                         'Basin': pd.Series(np.asarray(ids, dtype=str)).str[:2].values,
+                         'Year': df['Time'].values[first].astype('datetime64[Y]').astype(np.int64) + 1970,
+                         'Fixes': np.bincount(codes, counted, minlength=n_storms).astype(np.int64),
+                         'ACE': np.bincount(codes, np.where(counted, speeds, 0.0) ** 2, minlength=n_storms) / 1e4,
+                         'Max_Speed': max_speed,
+                         'Min_Pressure': min_pressure,
+                         'Hurricane_Days': np.bincount(codes, hurricane, minlength=n_storms) / 4,
+                         'Category': category.astype(np.int64)})
+
+
+def year_totals(df_storms: pd.DataFrame, years: Optional[Tuple[int, int]] = None) -> pd.DataFrame:
+    """
+    Returns the totals of YEAR_COLUMNS of the hurricanes of df_storms for each basin and year, every year from the
+    first one to the last one of `years`, by default the years of the hurricanes, with zeros for the years without
+    hurricanes.
+
+    Only the hurricanes reaching tropical storm strength are counted: Storms, Hurricanes and Major_Hurricanes are
+    numbers of hurricanes, Peak_Speed the sum of their maximal winds.
+    """
+
+    df_storms = df_storms.loc[df_storms['Fixes'] > 0]
+    if years is None:
+        years = (int(df_storms['Year'].min()), int(df_storms['Year'].max())) if len(df_storms) else (0, -1)
+
+    grid = pd.MultiIndex.from_product([sorted(df_storms['Basin'].unique()), np.arange(years[0], years[1] + 1)],
+                                      names=['Basin', 'Year'])
+
+    df_temp = pd.DataFrame({'Basin': df_storms['Basin'].values, 'Year': df_storms['Year'].values,
+                            'Storms': 1,
+                            'Hurricanes': (df_storms['Category'] >= 1).astype(np.int64).values,
+                            'Major_Hurricanes': (df_storms['Category'] >= MAJOR_CATEGORY).astype(np.int64).values,
+                            'ACE': df_storms['ACE'].values,
+                            'Hurricane_Days': df_storms['Hurricane_Days'].values,
+                            'Peak_Speed': df_storms['Max_Speed'].values})
+
+    df_years = df_temp.groupby(by=['Basin', 'Year'])[list(YEAR_COLUMNS)].sum().reindex(grid, fill_value=0)
+
+    return df_years.reset_index()
+
+
+class Climatology:
+    """
+    The ACE and intensity of the hurricanes of some basins, answering the totals of any range of years in constant
+    time from prefix sums over the years.
+
+    Parameters
+    ----------
+
+    df_storms: pd.DataFrame
+        The intensities of the hurricanes (see storm_intensities).
+    df_years: pd.DataFrame
+        The totals of each basin and year, every year from the first one to the last one (see year_totals).
+    """
+
+    def __init__(self, df_storms: pd.DataFrame, df_years: pd.DataFrame):
+        self.storms = df_storms
+
+        # The basins together, year by year
+        df_years = df_years.groupby(by='Year')[list(YEAR_COLUMNS)].sum().sort_index()
+        self.years = df_years.index.values.astype(np.int64)
+        self.values = {column: df_years[column].values.astype(np.float64) for column in YEAR_COLUMNS}
+
+        # totals[column][i] is the total of the years before self.years[i]
+        self.totals = {column: np.concatenate([[0.0], np.cumsum(values)]) for column, values in self.values.items()}
+
+    def __len__(self) -> int:
+        return len(self.years)
+
+    def window(self, first_year: int, last_year: int) -> dict:
+        """
+        Returns the totals of YEAR_COLUMNS over the years from first_year to last_year included, and the number of
+        Years of the range within the years of the climatology.
+        """
+
+        start = int(np.clip(first_year - self.years[0], 0, len(self))) if len(self) else 0
+        end = int(np.clip(last_year - self.years[0] + 1, start, len(self))) if len(self) else 0
+
+        window = {column: float(totals[end] - totals[start]) for column, totals in self.totals.items()}
+        window['Years'] = end - start
+
+        return window
+
+    def rolling(self, column: str, years: int = ROLLING_YEARS) -> np.ndarray:
+        """
+        Returns the mean of column over the `years` years up to each year, or over the years since the first one.
+        """
+
+        end = np.arange(1, len(self) + 1)
+        start = np.maximum(end - years, 0)
+        totals = self.totals[column]
+
+        return (totals[end] - totals[start]) / (end - start)
+
+    def series(self) -> dict:
+        """
+        Returns the data of the time-series of the years: Year, the columns of YEAR_COLUMNS and the rolling mean of
+        the ACE (ACE_rolling).
+        """
+
+        data = {'Year': self.years}
+        data.update(self.values)
+        data['ACE_rolling'] = self.rolling('ACE')
+
+        return data
+
+
+def build_climatology_tables(files_dir: str = FILES_DIR, chunk_rows: Optional[int] = None) -> str:
+    """
+    Computes the intensities of the hurricanes of df_tracks_augmented.csv and their totals for each basin and year,
+    and writes them to the columnar stores files_dir + STORMS_DIR and files_dir + YEARS_DIR, with the version of the
+    preprocessed files.
+
+    Parameters
+    ----------
+
+    files_dir: str
+        Path to the directory which contains the preprocessed csv files.
+    chunk_rows: Optional[int]
+        The number of rows of df_tracks_augmented.csv read at once, by whole hurricanes (see read_storm_chunks), or
+        None to read it at once.
+
+    Return
+    ------
+
+    directory: str
+        The directory of the stores.
+    """
+
+    from workflow.datasets import dataset_version
+
+    columns = ['ID', 'Time', 'Status', 'Max_Speed', 'Min_Pressure']
+    chunks = read_storm_chunks(files_dir + 'df_tracks_augmented.csv', chunk_rows, usecols=columns,
+                               parse_dates=['Time'])
+    df_storms = pd.concat([storm_intensities(df) for df in chunks], ignore_index=True)
+    df_storms = df_storms.sort_values(by='ID', kind='stable').reset_index(drop=True)
+
+    meta = {'version': dataset_version(files_dir), 'rolling_years': ROLLING_YEARS}
+    write_columns(df_storms, files_dir + STORMS_DIR, meta=meta)
+    write_columns(year_totals(df_storms), files_dir + YEARS_DIR, meta=meta)
+
+    print('ACE and intensities of {} hurricanes written to {}'.format(len(df_storms), files_dir + CLIMATOLOGY_DIR))
+
+    return files_dir + CLIMATOLOGY_DIR
+
+
+def read_climatology_tables(files_dir: str = FILES_DIR) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Returns the tables of the hurricanes and of the years written by build_climatology_tables if they are up to date,
+    and otherwise computes them from df_tracks_augmented.csv.
+    """
+
+    from workflow.datasets import dataset_version
+
+    directories = [files_dir + STORMS_DIR, files_dir + YEARS_DIR]
+    if all(os.path.exists(directory) for directory in directories):
+        if all(read_meta(directory).get('version') == dataset_version(files_dir) for directory in directories):
+            df_storms, df_years = [read_columns(directory, mmap=False) for directory in directories]
+            return df_storms.astype({'ID': str, 'Basin': str}), df_years.astype({'Basin': str})
+
+    print('The climatology of {} is out of date, it is computed from the tracks'.format(files_dir + CLIMATOLOGY_DIR))
+
+    df = pd.read_csv(files_dir + 'df_tracks_augmented.csv', usecols=['ID', 'Time', 'Status', 'Max_Speed',
+                                                                     'Min_Pressure'], parse_dates=['Time'])
+    df_storms = storm_intensities(df)
+
+    return df_storms, year_totals(df_storms)
+
+
+def climatology_of(df_storms: pd.DataFrame, df_years: pd.DataFrame, basins: Sequence[str]) -> Climatology:
+    """
+    Returns the climatology of the hurricanes of basins.
+    """
+
+    return Climatology(df_storms.loc[df_storms['Basin'].isin(basins)], df_years.loc[df_years['Basin'].isin(basins)])
+
+
+@versioned
+def load_climatology(files_dir: str = FILES_DIR) -> Climatology:
+    """
+    Loads the ACE and intensity climatology of the hurricanes of BASINS, once per version of the files.
+    """
+
+    return climatology_of(*read_climatology_tables(files_dir), BASINS)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files-dir', default=FILES_DIR, help='Directory of the preprocessed csv files.')
+    args = parser.parse_args(argv)
+
+    build_climatology_tables(args.files_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import gzip
+import itertools
+import zlib
+from typing import Iterable, Iterator, Optional
+from workflow.config import COMPRESSION_ENABLED, COMPRESSION_MIN_BYTES, COMPRESSION_LEVEL, WEBSOCKET_COMPRESSION_LEVEL
+from workflow.metrics import REGISTRY, Counter
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Content types worth compressing. Images (the map tiles) are already compressed.
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/octet-stream')
+
+HTTP_BYTES = REGISTRY.register(Counter(
+    'hurricanes_http_response_bytes_total', 'Size of the compressed responses before and after compression.',
+    ['encoding', 'stage']))
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Returns the content encoding to use for a request, from its Accept-Encoding header: brotli if the client and the
+    server support it, else gzip, else None.
+    """
+
+    accepted = {value.split(';')[0].strip() for value in accept_encoding.lower().split(',')}
+
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+
+    return None
+
+
+def compress(data: bytes, encoding: str, level: int = COMPRESSION_LEVEL) -> bytes:
+    """
+    Compresses data with the content encoding `encoding` ('gzip' or 'br'). The level ranges from 1 to 9.
+    """
+
+    if encoding == 'br':
+        # Brotli qualities range from 0 to 11, 5 or so is as fast as gzip at level 6 and smaller
+        return brotli.compress(data, quality=min(11, max(0, level - 1)))
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=level)
+
+    raise ValueError('Unsupported content encoding {}'.format(encoding))
+
+
+def compress_stream(chunks: Iterable[bytes], encoding: str, level: int = COMPRESSION_LEVEL) -> Iterator[bytes]:
+    """
+    Compresses the chunks of a streamed response with the content encoding `encoding` ('gzip' or 'br') as they come,
+    and counts their bytes in HTTP_BYTES.
+    """
+
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=min(11, max(0, level - 1)))
+        process, finish = compressor.process, compressor.finish
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, finish = compressor.compress, compressor.flush
+    else:
+        raise ValueError('Unsupported content encoding {}'.format(encoding))
+
+    for chunk in chunks:
+        compressed = process(chunk)
+        HTTP_BYTES.inc(encoding, 'original', amount=len(chunk))
+        HTTP_BYTES.inc(encoding, 'sent', amount=len(compressed))
+        if compressed:
+            yield compressed
+
+    compressed = finish()
+    HTTP_BYTES.inc(encoding, 'sent', amount=len(compressed))
+    yield compressed
+
+
+def deflate_size(data: bytes, level: int = WEBSOCKET_COMPRESSION_LEVEL) -> int:
+    """
+    Returns the size of data compressed as a websocket message by permessage-deflate (raw deflate stream).
+    """
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+
+def compress_response(response):
+    """
+    Flask after_request hook compressing the responses larger than COMPRESSION_MIN_BYTES, if the client accepts it.
+
+    Streamed responses (e.g. the binary columns of /api/storms) are compressed chunk after chunk as they are sent,
+    once their first chunks reach COMPRESSION_MIN_BYTES.
+    """
+
+    from flask import request
+
+    # Static files are streamed from the disk, but other streamed responses are sent as they come
+    streamed = response.is_streamed and not response.direct_passthrough
+
+    if (not COMPRESSION_ENABLED or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)):
+        return response
+
+    response.headers.add('Vary', 'Accept-Encoding')
+
+    encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+    if encoding is None:
+        return response
+
+    # A compressed representation has its own ETag, the one the browser sends back to revalidate it: the conditional
+    # response computed with the ETag of the uncompressed one never matches it
+    etag = response.get_etag()[0]
+    if etag and request.if_none_match.contains(etag + '-' + encoding):
+        response.set_etag(etag + '-' + encoding)
+        return response.make_conditional(request)
+
+    if streamed:
+        return compress_streamed_response(response, encoding, etag)
+
+    response.direct_passthrough = False
+    data = response.get_data()
+    if len(data) < COMPRESSION_MIN_BYTES:
+        return response
+
+    compressed = compress(data, encoding)
+    HTTP_BYTES.inc(encoding, 'original', amount=len(data))
+    HTTP_BYTES.inc(encoding, 'sent', amount=len(compressed))
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.set_etag(etag + '-' + encoding)
+
+    return response
+
+
+def compress_streamed_response(response, encoding: str, etag: Optional[str]):
+    """
+    Compresses a streamed response as it is sent, if its first chunks reach COMPRESSION_MIN_BYTES, and otherwise
+    sends the chunks read, which are the whole response, as they are.
+    """
+
+    chunks = response.iter_encoded()
+    head, size = [], 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= COMPRESSION_MIN_BYTES:
+            break
+    else:
+        response.set_data(b''.join(head))
+        return response
+
+    response.response = compress_stream(itertools.chain(head, chunks), encoding)
+    response.headers['Content-Encoding'] = encoding
+    response.headers.pop('Content-Length', None)
+    if etag:
+        response.set_etag(etag + '-' + encoding)
+
+    return response
+
+
+def enable_websocket_compression(level: int = WEBSOCKET_COMPRESSION_LEVEL):
+    """
+    Negotiates permessage-deflate on the websockets of the bokeh server, which Server does not expose as an option.
+
+    Browsers support the extension, large data replacements of the callbacks are then sent compressed.
+    """
+
+    from bokeh.server.views.ws import WSHandler
+
+    options = {'compression_level': level, 'mem_level': 8}
+    WSHandler.get_compression_options = lambda self: options
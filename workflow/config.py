@@ -0,0 +1,87 @@
+import os
+
+
+# Directory containing the preprocessed csv files used by the bokeh apps.
+FILES_DIR = os.environ.get('HURRICANES_FILES_DIR', 'files/')
+
+# Embedded bokeh server
+BOKEH_PORT = int(os.environ.get('HURRICANES_BOKEH_PORT', '5006'))
+BOKEH_URL = 'http://localhost:{}'.format(BOKEH_PORT)
+ALLOWED_ORIGINS = ["127.0.0.1:8000", "localhost:{}".format(BOKEH_PORT), "localhost:8000"]
+
+# Profiling of the callbacks and of the preprocessing stages, also switched on and off at /admin/profiling
+PROFILE_ENABLED = os.environ.get('HURRICANES_PROFILE', '0') not in ('', '0')
+PROFILE_DIR = os.environ.get('HURRICANES_PROFILE_DIR', 'profiles/')
+
+# At most one profile of each callback of a session every PROFILE_INTERVAL seconds, and PROFILE_MAX_FILES profiles
+# kept in PROFILE_DIR, the oldest ones being removed
+PROFILE_INTERVAL = float(os.environ.get('HURRICANES_PROFILE_INTERVAL', '10'))
+PROFILE_MAX_FILES = int(os.environ.get('HURRICANES_PROFILE_MAX_FILES', '200'))
+
+# Token expected in the X-Admin-Token header of the admin routes. Without it, they only answer to localhost.
+ADMIN_TOKEN = os.environ.get('HURRICANES_ADMIN_TOKEN')
+
+# Seconds between the checks of the version of the preprocessed files, reloaded without restarting the server when
+# preprocessing.py rewrites them (see workflow/versions.py), 0 to only reload them at /admin/reload.
+RELOAD_INTERVAL = float(os.environ.get('HURRICANES_RELOAD_INTERVAL', '10'))
+
+# Basins of the hurricanes shown by the apps, comma separated (AL: Atlantic, EP: Eastern Pacific, CP: Central
+# Pacific). The other basins of the preprocessed files are only served by /api/storms.
+BASINS = tuple(basin.strip() for basin in os.environ.get('HURRICANES_BASINS', 'AL').split(',') if basin.strip())
+
+
+def zones_file(files_dir: str = FILES_DIR) -> str:
+    # HURRICANES_ZONES_FILE, or the zones file of a directory of preprocessed files
+    return os.environ.get('HURRICANES_ZONES_FILE', files_dir + 'zones.geojson')
+
+
+# Polygon file of the zones of the hurricanes (see tools/zones_tools.py), also listing the options of the zone filters.
+# The preprocessing classifies the hurricanes with the same file.
+ZONES_FILE = zones_file()
+
+# Map tiles. The maps request their tiles from TILE_URL, served by the tile proxy of app.py, which fetches them
+# from TILE_UPSTREAM_URL and keeps up to TILE_CACHE_BYTES of them in TILE_CACHE_DIR.
+TILE_UPSTREAM_URL = os.environ.get('HURRICANES_TILE_UPSTREAM_URL',
+                                   'http://a.basemaps.cartocdn.com/rastertiles/voyager/{Z}/{X}/{Y}.png')
+TILE_URL = os.environ.get('HURRICANES_TILE_URL', '/tiles/{Z}/{X}/{Y}.png')
+TILE_CACHE_DIR = os.environ.get('HURRICANES_TILE_CACHE_DIR', 'tile_cache/')
+TILE_CACHE_BYTES = int(os.environ.get('HURRICANES_TILE_CACHE_BYTES', str(256 * 1024 ** 2)))
+TILE_MAX_AGE = int(os.environ.get('HURRICANES_TILE_MAX_AGE', str(7 * 24 * 3600)))
+TILE_PREFETCH_MAX_ZOOM = int(os.environ.get('HURRICANES_TILE_PREFETCH_MAX_ZOOM', '5'))
+
+# Compression of the Flask responses (brotli if installed, else gzip), of the bokeh static assets (gzip) and of the
+# websocket messages (permessage-deflate). Responses smaller than COMPRESSION_MIN_BYTES are sent as they are.
+COMPRESSION_ENABLED = os.environ.get('HURRICANES_COMPRESSION', '1') not in ('', '0')
+COMPRESSION_MIN_BYTES = int(os.environ.get('HURRICANES_COMPRESSION_MIN_BYTES', '1024'))
+COMPRESSION_LEVEL = int(os.environ.get('HURRICANES_COMPRESSION_LEVEL', '6'))
+WEBSOCKET_COMPRESSION_LEVEL = int(os.environ.get('HURRICANES_WEBSOCKET_COMPRESSION_LEVEL', '6'))
+
+# Pre-rendered snapshots of the apps (see workflow/snapshots.py), and the json file listing the filters to render
+# them for, instead of the default ones.
+SNAPSHOT_DIR = os.environ.get('HURRICANES_SNAPSHOT_DIR', 'snapshots/')
+SNAPSHOTS_FILE = os.environ.get('HURRICANES_SNAPSHOTS_FILE')
+SNAPSHOT_MAX_AGE = int(os.environ.get('HURRICANES_SNAPSHOT_MAX_AGE', str(365 * 24 * 3600)))
+
+# Encoding of the web mercator coordinates sent to the browser: float64 (as they are), float32, or int32 offsets of
+# COORDINATES_SCALE metres decoded by the browser (see workflow/encoding.py).
+COORDINATES_ENCODING = os.environ.get('HURRICANES_COORDINATES_ENCODING', 'float64')
+COORDINATES_SCALE = float(os.environ.get('HURRICANES_COORDINATES_SCALE', '1.0'))
+
+# Sessions open at once in the process, the next ones being asked to come back later (0 for no limit), and seconds
+# without user action after which a session is closed (0 to keep them open), see workflow/sessions.py.
+MAX_SESSIONS = int(os.environ.get('HURRICANES_MAX_SESSIONS', '200'))
+SESSION_IDLE_TIMEOUT = float(os.environ.get('HURRICANES_SESSION_IDLE_TIMEOUT', '1800'))
+
+# Drawing of the tracks: 'segments', a dashed segment and two circles per step, or 'lines', a single line separating
+# the hurricanes with NaN, with a marker on the start of each step if HURRICANES_TRACKS_MARKERS=1 (see
+# workflow/polylines.py).
+TRACKS_RENDERING = os.environ.get('HURRICANES_TRACKS_RENDERING', 'segments')
+TRACKS_MARKERS = os.environ.get('HURRICANES_TRACKS_MARKERS', '0') not in ('', '0')
+
+# Number of documents of each app built in advance for the new sessions, 0 to build them when sessions open.
+DOCUMENT_POOL_SIZE = int(os.environ.get('HURRICANES_DOCUMENT_POOL_SIZE', '4'))
+
+# Number of rows of the tracks read at once by the cleaning and feature engineering stages of preprocessing.py, by
+# whole hurricanes, which bounds their memory whatever the size of the files (see tools/chunking_tools.py), 0 to read
+# each file at once.
+PREPROCESSING_CHUNK_ROWS = int(os.environ.get('HURRICANES_PREPROCESSING_CHUNK_ROWS', '0'))
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import pandas as pd
+from typing import Dict, Sequence, Tuple
+from workflow.config import BASINS, FILES_DIR
+from workflow.metrics import REGISTRY, Gauge
+from workflow.versions import versioned, versions_in_memory
+
+
+@versioned
+def load_start_end_df(files_dir: str = FILES_DIR) -> pd.DataFrame:
+    """
+    Loads the start/end DataFrame used by the spawns app, with the hurricanes of BASINS.
+
+    The DataFrame is loaded once per version of the files and shared by the sessions, so it must not be modified
+    in place.
+
+    Parameters
+    ----------
+
+    files_dir: str
+        Path to the directory which contains the preprocessed csv files.
+
+    Return
+    ------
+
+    df: pd.DataFrame
+        The content of df_start_end_bokeh.csv
+    """
+
+    return in_basins(pd.read_csv(files_dir + 'df_start_end_bokeh.csv', index_col=0), BASINS)
+
+
+@versioned
+def load_tracks_df(files_dir: str = FILES_DIR) -> pd.DataFrame:
+    """
+    Loads the full tracks DataFrame used by the tracks app, with the hurricanes of BASINS and the additional columns
+    needed by the figures.
+
+    The DataFrame is loaded once per version of the files and shared by the sessions, so it must not be modified
+    in place.
+
+    Parameters
+    ----------
+
+    files_dir: str
+        Path to the directory which contains the preprocessed csv files.
+
+    Return
+    ------
+
+    df: pd.DataFrame
+        The content of df_full_tracks_bokeh.csv, without the last entry of each hurricane, with steps numbering,
+        year_start, month_start, zone start and maximal speeds in km/h.
+    """
+
+    df = pd.read_csv(files_dir + 'df_full_tracks_bokeh.csv', index_col=0, parse_dates=['Time'])
+
+    return prepare_tracks_df(in_basins(df, BASINS))
+
+
+def in_basins(df: pd.DataFrame, basins: Sequence[str]) -> pd.DataFrame:
+    """
+    Returns the rows of df of the hurricanes of basins, the first two characters of their ID.
+    """
+
+    mask = df['ID'].str[:2].isin(basins)
+
+    return df if mask.all() else df.loc[mask]
+
+
+def prepare_tracks_df(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds the columns needed by the figures to the content of df_full_tracks_bokeh.csv (see load_tracks_df).
+    """
+
+    # Remove last entry for each hurricane, add steps numbering, year_start, year_end, zone start
+    df = df.dropna(subset=['x_end']).sort_values(by=['ID', 'Time'])
+
+    steps = df.groupby(by='ID').Time.count()
+    times = df.groupby(by='ID').Time.first()
+    zones = df.groupby(by='ID').Zones.first()
+
+    df['Step'] = [i for hur in steps.index for i in range(steps[hur])]
+    df['Year_start'] = [times[hur].year for hur in steps.index for i in range(steps[hur])]
+    df['Month_start'] = [times[hur].month for hur in steps.index for i in range(steps[hur])]
+    df['Zones_start'] = [zones[hur]for hur in steps.index for i in range(steps[hur])]
+
+    # Convert knots to km/h
+    df['Max_Speed'] = df['Max_Speed'] * 1.852
+
+    return df
+
+
+@versioned
+def load_intervals_df(files_dir: str = FILES_DIR) -> pd.DataFrame:
+    """
+    Loads the periods of activity of the hurricanes of BASINS, from their first to their last observation.
+
+    The DataFrame is loaded once per version of the files and shared by the sessions, so it must not be modified
+    in place.
+
+    Parameters
+    ----------
+
+    files_dir: str
+        Path to the directory which contains the preprocessed csv files.
+
+    Return
+    ------
+
+    df: pd.DataFrame
+        The content of df_storm_intervals.csv: ID, Time_start and Time_end.
+    """
+
+    df = pd.read_csv(files_dir + 'df_storm_intervals.csv', index_col=0, parse_dates=['Time_start', 'Time_end'])
+
+    return in_basins(df, BASINS)
+
+
+def dataset_version(files_dir: str = FILES_DIR) -> str:
+    """
+    Returns an identifier of the version of the preprocessed csv files, which changes whenever one of them is
+    rewritten.
+    """
+
+    stats = []
+    for name in ('df_start_end_bokeh.csv', 'df_full_tracks_bokeh.csv', 'df_storm_intervals.csv'):
+        stat = os.stat(files_dir + name)
+        stats.append('{}:{}:{}'.format(name, stat.st_size, stat.st_mtime_ns))
+
+    return hashlib.sha1(';'.join(stats).encode()).hexdigest()[:12]
+
+
+def datasets_memory() -> Dict[Tuple[str, ...], float]:
+    """
+    Returns the memory used by each dataset loaded with the default files directory, by all the versions of the
+    files still used by sessions.
+    """
+
+    memory = dict()
+
+    for version in versions_in_memory(FILES_DIR):
+        for name, load in [('start_end', load_start_end_df), ('tracks', load_tracks_df)]:
+            df = version.objects.get(load.cache_name)
+            if df is not None:
+                memory[(name,)] = memory.get((name,), 0.0) + float(df.memory_usage(deep=True).sum())
+
+    return memory
+
+
+REGISTRY.register(Gauge('hurricanes_dataset_memory_bytes', 'Memory used by the datasets shared by the sessions.',
+                        ['dataset'], function=datasets_memory))
@@ -1,10 +1,25 @@
 import pandas as pd
+from typing import Optional
+from tools.chunking_tools import read_storm_chunks, write_chunk
 from tools.features_engineering_tools import haversine
 
 
-def create_full_tracks_df(file_path: str, file_name: str = '../files/df_full_tracks_bokeh.csv'):
+# The DataFrames below are computed hurricane by hurricane: with chunk_rows, their input file is read by chunks of
+# whole hurricanes (see read_storm_chunks) and their output written chunk after chunk, with the same result.
 
-    df_temp = pd.read_csv(file_path, index_col=0, dtype={'Hour': str}, parse_dates=['Time'])
+
+def create_full_tracks_df(file_path: str, file_name: str = '../files/df_full_tracks_bokeh.csv',
+                          chunk_rows: Optional[int] = None):
+
+    chunks = read_storm_chunks(file_path, chunk_rows, index_col=0, dtype={'Hour': str}, parse_dates=['Time'])
+    for i, df_temp in enumerate(chunks):
+        write_chunk(full_tracks(df_temp), file_name, first=i == 0)
+
+
+def full_tracks(df_temp: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the steps of the hurricanes of df_temp, from each observation to the next one (see create_full_tracks_df).
+    """
 
     # Remove columns not used in the bokeh figures.
     cols = [col for col in df_temp.columns if 'Rad' in col] + ['Min_Pressure']
@@ -26,12 +41,46 @@ def create_full_tracks_df(file_path: str, file_name: str = '../files/df_full_tra
                        'Longitude_end', 'Distance', 'Max_Speed', 'Avg_Speed', 'Season', 'Zones',
                        'x_start', 'y_start', 'x_end', 'y_end']]
 
-    df_temp.to_csv(file_name)
+    return df_temp
+
+
+def create_intervals_df(file_path: str, file_name: str = '../files/df_storm_intervals.csv',
+                        chunk_rows: Optional[int] = None):
+
+    # Period of activity of each hurricane, from its first to its last observation, for the interval index
+    df_intervals = pd.concat([df_temp.groupby(by='ID').Time.agg(['min', 'max'])
+                              for df_temp in read_storm_chunks(file_path, chunk_rows, index_col=0,
+                                                               parse_dates=['Time'])]).sort_index()
+    df_intervals.columns = ['Time_start', 'Time_end']
+
+    df_intervals.reset_index().to_csv(file_name)
 
 
-def create_start_end_df(file_path: str, file_name: str = '../files/df_start_end_bokeh.csv'):
+def create_start_end_df(file_path: str, file_name: str = '../files/df_start_end_bokeh.csv',
+                        chunk_rows: Optional[int] = None):
 
-    df_temp = pd.read_csv(file_path, index_col=0, dtype={'Hour': str}, parse_dates=['Time'])
+    rows = 0
+
+    chunks = read_storm_chunks(file_path, chunk_rows, index_col=0, dtype={'Hour': str}, parse_dates=['Time'])
+    for i, df_temp in enumerate(chunks):
+        df_start_end_bokeh = start_end(df_temp)
+
+        # Numbered after the hurricanes of the previous chunks
+        df_start_end_bokeh.index = pd.RangeIndex(rows, rows + len(df_start_end_bokeh))
+        write_chunk(df_start_end_bokeh, file_name, first=i == 0)
+
+        if i == 0:
+            print(df_start_end_bokeh.head(10))
+            print(df_start_end_bokeh.columns)
+
+        rows += len(df_start_end_bokeh)
+
+
+def start_end(df_temp: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the first and last observations of each hurricane of df_temp, with its duration and its distance (see
+    create_start_end_df).
+    """
 
     # Keep only the desired columns
     df_temp.drop(columns=['Status', 'Latitude_end', 'Longitude_end', 'Max_Speed',
@@ -71,7 +120,4 @@ def create_start_end_df(file_path: str, file_name: str = '../files/df_start_end_
     df_start_end_bokeh = df_start_end_bokeh.merge(dist, on='ID')
     df_start_end_bokeh['Distance_draw'] = 42 * df_start_end_bokeh['Distance']
 
-    df_start_end_bokeh.to_csv(file_name)
-
-    print(df_start_end_bokeh.head(10))
-    print(df_start_end_bokeh.columns)
+    return df_start_end_bokeh
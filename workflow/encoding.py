@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+from typing import Union
+from bokeh.models import ColumnDataSource, CustomJSTransform
+from bokeh.transform import transform
+from workflow.config import COORDINATES_ENCODING, COORDINATES_SCALE
+from workflow.metrics import REGISTRY, Counter
+
+
+# Web mercator columns of the data sources, and the axis of each of them
+COORDINATE_COLUMNS = {'x_start': 'x', 'x_end': 'x', 'y_start': 'y', 'y_end': 'y', 'x_line': 'x', 'y_line': 'y'}
+
+# Origin of the int32 offsets: the bottom left corner of the web mercator tile 0/0/0
+ORIGIN = {'x': -20037508.342789244, 'y': -20037508.342789244}
+
+ENCODINGS = ('float64', 'float32', 'int32')
+
+# Missing coordinates, as int32 offsets
+MISSING = np.iinfo(np.int32).min
+
+COORDINATES_BYTES = REGISTRY.register(Counter(
+    'hurricanes_coordinates_bytes_total', 'Size of the coordinates sent to the browser, as float64 and as encoded.',
+    ['app', 'encoding', 'stage']))
+
+DECODE_FUNC = """
+return x === missing ? NaN : origin + x * scale
+"""
+
+DECODE_V_FUNC = """
+const values = new Float64Array(xs.length)
+for (let i = 0; i < xs.length; i++)
+    values[i] = xs[i] === missing ? NaN : origin + xs[i] * scale
+return values
+"""
+
+
+class CoordinatesEncoder:
+    """
+    Encoding of the web mercator coordinates sent to the browser by the apps.
+
+    The coordinates are float64 metres, far more precise than the 0.1 degree of the observations. They can be sent as
+    float32 (half the bytes, about 2 m precision) or as int32 offsets of `scale` metres from the corner of the web
+    mercator world, decoded by the browser with a CustomJSTransform of the glyphs. The bytes saved are counted in
+    COORDINATES_BYTES.
+
+    The transforms are models of the document of the app, one encoder is made for each document.
+
+    Parameters
+    ----------
+
+    app: str
+        Name of the bokeh app, label of the metrics.
+    encoding: str
+        One of ENCODINGS, float64 sending the coordinates as they are.
+    scale: float
+        Metres per unit of the int32 offsets.
+
+    Raises
+    ------
+
+    ValueError
+        If encoding is not one of ENCODINGS.
+    """
+
+    def __init__(self, app: str, encoding: str = COORDINATES_ENCODING, scale: float = COORDINATES_SCALE):
+        if encoding not in ENCODINGS:
+            raise ValueError('Unknown coordinates encoding {}, expected one of {}'.format(encoding, ENCODINGS))
+
+        self.app = app
+        self.encoding = encoding
+        self.scale = scale
+        self.transforms = dict()
+
+        if encoding == 'int32':
+            self.transforms = {axis: CustomJSTransform(args=dict(origin=origin, scale=scale, missing=int(MISSING)),
+                                                       func=DECODE_FUNC, v_func=DECODE_V_FUNC)
+                               for axis, origin in ORIGIN.items()}
+
+    def field(self, column: str) -> Union[str, dict]:
+        """
+        Returns the specification of a glyph coordinate reading `column`, decoded if needed.
+        """
+
+        if column in COORDINATE_COLUMNS and self.encoding == 'int32':
+            return transform(column, self.transforms[COORDINATE_COLUMNS[column]])
+
+        return column
+
+    def points(self, end: str) -> dict:
+        """
+        Returns the x and y of the glyphs drawing the start or end points, e.g. p.circle(**coordinates.points('start')).
+        """
+
+        return {'x': self.field('x_' + end), 'y': self.field('y_' + end)}
+
+    def line(self) -> dict:
+        """
+        Returns the x and y of the glyph drawing the tracks of a source made by storm_line.
+        """
+
+        return {'x': self.field('x_line'), 'y': self.field('y_line')}
+
+    def segments(self) -> dict:
+        """
+        Returns the x0, y0, x1 and y1 of the glyphs drawing the segments from the start to the end points.
+        """
+
+        return {'x0': self.field('x_start'), 'y0': self.field('y_start'),
+                'x1': self.field('x_end'), 'y1': self.field('y_end')}
+
+    def encode(self, data: Union[dict, pd.DataFrame]) -> Union[dict, pd.DataFrame]:
+        """
+        Returns the data of a ColumnDataSource with its coordinates encoded, or data itself with the float64 encoding.
+        """
+
+        if self.encoding == 'float64':
+            return data
+
+        if isinstance(data, pd.DataFrame):
+            data = ColumnDataSource.from_df(data)
+
+        data = dict(data)
+        original, encoded = 0, 0
+        for column, axis in COORDINATE_COLUMNS.items():
+            if column not in data:
+                continue
+
+            values = np.asarray(data[column], dtype=np.float64)
+            data[column] = self._encode_values(values, axis)
+
+            original += values.nbytes
+            encoded += data[column].nbytes
+
+        COORDINATES_BYTES.inc(self.app, self.encoding, 'original', amount=original)
+        COORDINATES_BYTES.inc(self.app, self.encoding, 'sent', amount=encoded)
+
+        return data
+
+    def _encode_values(self, values: np.ndarray, axis: str) -> np.ndarray:
+        if self.encoding == 'float32':
+            return values.astype(np.float32)
+
+        offsets = np.round((values - ORIGIN[axis]) / self.scale)
+
+        return np.where(np.isnan(offsets), MISSING, offsets).astype(np.int32)
+
+    def decode(self, values, column: str) -> np.ndarray:
+        """
+        Returns the web mercator coordinates, in metres, of the values of `column` of encoded data.
+        """
+
+        values = np.asarray(values)
+        if self.encoding != 'int32' or column not in COORDINATE_COLUMNS:
+            return values.astype(np.float64)
+
+        decoded = ORIGIN[COORDINATE_COLUMNS[column]] + values.astype(np.float64) * self.scale
+
+        return np.where(values == MISSING, np.nan, decoded)
@@ -37,17 +37,17 @@ def get_boundaries(df: pd.DataFrame, year: str='Year_start',
     """
 
     # Date and geographical limits for the data.
-    year_min = min(df[year])
-    year_max = max(df[year])
-    print(year_min, year_max, min(df[[lon]]))
+    year_min = df[year].min()
+    year_max = df[year].max()
+
     # Latitude and Longitude boundaries for the bokeh map
-    lon_boundaries = [min(df[lon]) - 15.0,
-                      max(df[lon]) + 15.0]
+    lon_boundaries = [df[lon].min() - 15.0,
+                      df[lon].max() + 15.0]
 
     lon_boundaries = [i * (6378137 * np.pi / 180.0) for i in lon_boundaries]
 
-    lat_boundaries = [min(df[lat]) - 15.0,
-                      max(df[lat]) + 15.0]
+    lat_boundaries = [df[lat].min() - 15.0,
+                      df[lat].max() + 15.0]
 
     lat_boundaries = [np.log(np.tan((90 + i) * np.pi / 360.0)) * 6378137 for i in lat_boundaries]
 
@@ -0,0 +1,88 @@
+import datetime
+import numpy as np
+import pandas as pd
+from workflow.config import FILES_DIR
+from workflow.versions import versioned
+
+
+class StormIntervalIndex:
+    """
+    Interval index of the periods of activity [Time_start, Time_end] of the hurricanes, answering "which hurricanes
+    were active during a period" without scanning every hurricane, nor every step of their tracks.
+
+    The periods are sorted by start, and no hurricane lasts longer than the longest one: the hurricanes active during
+    [start, end] are among the ones which started between start minus the longest duration and end, found by two
+    binary searches. A query takes O(log n + k + m), k being the number of hurricanes found and m the number of
+    hurricanes which started less than the longest duration before start but ended before it.
+
+    Parameters
+    ----------
+
+    df: pd.DataFrame
+        One row per hurricane, with its ID, Time_start and Time_end.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        order = np.argsort(df['Time_start'].values, kind='stable')
+
+        self.ids = df['ID'].values[order]
+        self.starts = df['Time_start'].values[order].astype('datetime64[ns]')
+        self.ends = df['Time_end'].values[order].astype('datetime64[ns]')
+        self.max_duration = (self.ends - self.starts).max() if len(self.ids) else np.timedelta64(0, 'ns')
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def first_day(self) -> datetime.date:
+        return pd.Timestamp(self.starts.min()).date()
+
+    @property
+    def last_day(self) -> datetime.date:
+        return pd.Timestamp(self.ends.max()).date()
+
+    def overlapping(self, start, end) -> np.ndarray:
+        """
+        Returns the IDs of the hurricanes active at some time between start and end (included), by start.
+        """
+
+        start, end = np.datetime64(pd.Timestamp(start), 'ns'), np.datetime64(pd.Timestamp(end), 'ns')
+
+        first = np.searchsorted(self.starts, start - self.max_duration, side='left')
+        last = np.searchsorted(self.starts, end, side='right')
+
+        return self.ids[first:last][self.ends[first:last] >= start]
+
+    def active_between(self, first_day, last_day) -> np.ndarray:
+        """
+        Returns the IDs of the hurricanes active at some time from the day first_day to the day last_day, included.
+        """
+
+        end = pd.Timestamp(last_day) + pd.Timedelta(days=1) - pd.Timedelta(1, 'ns')
+
+        return self.overlapping(pd.Timestamp(first_day), end)
+
+
+@versioned
+def load_interval_index(files_dir: str = FILES_DIR) -> StormIntervalIndex:
+    """
+    Builds the interval index of the hurricanes, once per version of the files.
+    """
+
+    from workflow.datasets import load_intervals_df
+
+    return StormIntervalIndex(load_intervals_df(files_dir=files_dir))
+
+
+def parse_day(value: str) -> datetime.date:
+    """
+    Parses a day given as YYYY-MM-DD.
+
+    Raises
+    ------
+
+    ValueError
+        If value is not a valid day.
+    """
+
+    return datetime.datetime.strptime(value.strip(), '%Y-%m-%d').date()
@@ -1,25 +1,154 @@
 from workflow.fixed_values import get_boundaries, get_gulf_stream, additional_legend
+from workflow.climatology import ROLLING_YEARS, Climatology, load_climatology
+from workflow.datasets import load_start_end_df, load_tracks_df
+from workflow.encoding import CoordinatesEncoder
+from workflow.intervals import load_interval_index
+from workflow.config import FILES_DIR, TILE_URL, ZONES_FILE, TRACKS_RENDERING, TRACKS_MARKERS
+from workflow.metrics import instrument_callback
+from workflow.playback import FRAME_PERIOD, PLAYBACK_COLUMNS, PlaybackFrames
+from workflow.polylines import RENDERINGS, STEP_LOOKUP, storm_line
+from workflow.profiling import profile_callback
+from workflow.queries import select_storms
+from workflow.similarity import load_similarity_index
+from workflow.spatial import load_track_index, parse_center, mercator_to_wgs84, wgs84_to_mercator
+from workflow.versions import DatasetLease
+from tools.zones_tools import load_zone_names
 import numpy as np
-import pandas as pd
+from functools import lru_cache
 from bokeh.plotting import figure
 from bokeh.themes import Theme
 from bokeh.layouts import column, row
-from bokeh.models.widgets import Panel, Tabs, Toggle, DataTable, TableColumn, DateFormatter
-from bokeh.models import ColumnDataSource, WMTSTileSource, RangeSlider, Select, HoverTool
+from bokeh.events import Tap
+from bokeh.models.widgets import Panel, Tabs, Toggle, DataTable, TableColumn, DateFormatter, NumberFormatter
+from bokeh.models import ColumnDataSource, WMTSTileSource, RangeSlider, Select, HoverTool, Slider, TextInput, \
+    DateRangeSlider, BoxAnnotation, Div, CustomJSHover
 
 
-def make_start_end_figure(doc):
+@lru_cache(maxsize=None)
+def load_theme() -> Theme:
+    # Parsed once per process, themes are not modified by the documents using them
+    return Theme(filename="theme.yaml")
+
+
+def make_dates_slider(intervals) -> DateRangeSlider:
+    # Days of activity of the hurricanes, every day by default
+    return DateRangeSlider(start=intervals.first_day, end=intervals.last_day,
+                           value=(intervals.first_day, intervals.last_day), step=1, title="Active between",
+                           name='slider_dates')
+
+
+def storms_active(intervals, slider_dates: DateRangeSlider):
+    """
+    Returns the IDs of the hurricanes active during the days of slider_dates, or None if it covers every day.
+    """
+
+    first_day, last_day = slider_dates.value_as_date
+    if first_day <= intervals.first_day and last_day >= intervals.last_day:
+        return None
+
+    return intervals.active_between(first_day, last_day)
+
+
+def climatology_text(climatology: Climatology, years) -> str:
+    """
+    Returns the totals of the ACE and of the numbers of hurricanes over the years of a year slider.
+    """
+
+    first_year, last_year = int(years[0]), int(years[1])
+    window = climatology.window(first_year, last_year)
+    if not window['Years']:
+        return '<b>{}-{}</b>: no hurricanes'.format(first_year, last_year)
+
+    mean_ace = climatology.window(climatology.years[0], climatology.years[-1])['ACE'] / len(climatology)
+    peak = window['Peak_Speed'] / window['Storms'] if window['Storms'] else 0.0
+
+    return ('<b>{}-{}</b>: ACE {:.0f}, {:.1f} per year ({:.1f} over {}-{})<br>'
+            '{:.0f} storms, {:.0f} hurricanes, {:.0f} major hurricanes, {:.1f} hurricane days<br>'
+            'Mean peak winds {:.0f} kt').format(first_year, last_year, window['ACE'], window['ACE'] / window['Years'],
+                                               mean_ace, climatology.years[0], climatology.years[-1],
+                                               window['Storms'], window['Hurricanes'], window['Major_Hurricanes'],
+                                               window['Hurricane_Days'], peak)
+
+
+def make_climatology_panel(app: str, files_dir: str, lease: DatasetLease, slider_year: RangeSlider, name: str):
+    """
+    Returns the time-series of the ACE and of the numbers of hurricanes of each year, shown beside a map, with the
+    totals of the years of slider_year, answered in constant time (see workflow/climatology.py).
+    """
+
+    with lease.pinned():
+        climatology = load_climatology(files_dir=files_dir)
+
+    source = ColumnDataSource(data=climatology.series(), name=name + '_source')
+    shown = {'climatology': climatology}
+
+    first_year, last_year = slider_year.value
+    bands = [BoxAnnotation(left=first_year - 0.5, right=last_year + 0.5, fill_color='navy', fill_alpha=0.1)
+             for _ in range(2)]
+
+    p_ace = figure(tools='', toolbar_location=None, plot_width=420, plot_height=220,
+                   title='Accumulated Cyclone Energy (10^4 kt^2)')
+    p_ace.vbar(x='Year', top='ACE', width=0.8, source=source, fill_alpha=0.6, legend_label='Year')
+    p_ace.line(x='Year', y='ACE_rolling', source=source, color='red', line_width=2,
+               legend_label='{}-year mean'.format(ROLLING_YEARS))
+    p_ace.legend.location = 'top_left'
+    p_ace.add_tools(HoverTool(tooltips=[('Year', '@Year'), ('ACE', '@ACE{0.0}'),
+                                        ('{}-year mean'.format(ROLLING_YEARS), '@ACE_rolling{0.0}')], mode='vline'))
+
+    p_counts = figure(tools='', toolbar_location=None, plot_width=420, plot_height=220, x_range=p_ace.x_range,
+                      title='Hurricanes per year')
+    for column_name, color in [('Storms', 'gray'), ('Hurricanes', 'orange'), ('Major_Hurricanes', 'firebrick')]:
+        p_counts.line(x='Year', y=column_name, source=source, color=color, line_width=2,
+                      legend_label=column_name.replace('_', ' '))
+    p_counts.legend.location = 'top_left'
+    p_counts.add_tools(HoverTool(tooltips=[('Year', '@Year'), ('Storms', '@Storms'), ('Hurricanes', '@Hurricanes'),
+                                           ('Major hurricanes', '@Major_Hurricanes')], mode='vline'))
+
+    for p, band in zip((p_ace, p_counts), bands):
+        p.add_layout(band)
+
+    div = Div(text=climatology_text(climatology, slider_year.value), width=420, name=name + '_text')
+
+    @instrument_callback(app, 'update_' + name)
+    @profile_callback(app, 'update_' + name)
+    @lease.callback
+    def update_climatology(attr, old, new):
+
+        climatology = load_climatology(files_dir=files_dir)
+
+        # The series are only sent again if the datasets were reloaded
+        if climatology is not shown['climatology']:
+            source.data = climatology.series()
+            shown['climatology'] = climatology
+
+        first_year, last_year = slider_year.value
+        for band in bands:
+            band.left, band.right = first_year - 0.5, last_year + 0.5
+        div.text = climatology_text(climatology, slider_year.value)
+
+    slider_year.on_change('value', update_climatology)
+
+    return column(p_ace, p_counts, div)
+
+
+def make_start_end_figure(doc, files_dir: str = FILES_DIR):
     """
     Creates a Bokeh app for visualizations of start and end of hurricanes
     """
-    df_spawn_end = pd.read_csv('files/df_start_end_bokeh.csv', index_col=0)
+    # Version of the datasets of the session, replaced by the newer ones on the next callback (see workflow/versions.py)
+    lease = DatasetLease(files_dir, doc)
+    doc.on_session_destroyed(lambda session_context: lease.release())
+
+    with lease.pinned():
+        df_spawn_end = load_start_end_df(files_dir=files_dir)
+        intervals = load_interval_index(files_dir=files_dir)
 
     year_min, year_max, lon_boundaries, lat_boundaries = get_boundaries(df_spawn_end)
 
     gulf_stream_lon1, gulf_stream_lon2, gulf_stream_lat1, gulf_stream_lat2 = get_gulf_stream()
 
     # credits of the map
-    url = 'http://a.basemaps.cartocdn.com/rastertiles/voyager/{Z}/{X}/{Y}.png'
+    url = TILE_URL
     attribution = "Tiles by Carto, under CC BY 3.0. Data by OSM, under ODbL"
 
     add_paragraph = additional_legend(loc='tracks')
@@ -30,11 +159,12 @@ def make_start_end_figure(doc):
 
     # definition and configuration of the number selection
     options_number = ['-1'] + [str(x) for x in list(np.arange(1, 21))]
-    select_number = Select(title='Number of hurricanes:', value='5', options=options_number)
+    select_number = Select(title='Number of hurricanes:', value='5', options=options_number,
+                           name='select_number')
 
     # definition and configuration of the zone selection
-    options_zone = ['All', 'Mexico_Caribbean', 'Atlantic']
-    select_zone = Select(title='Spawning Zone:', value='All', options=options_zone)
+    options_zone = ['All'] + load_zone_names(ZONES_FILE)
+    select_zone = Select(title='Spawning Zone:', value='All', options=options_zone, name='select_zone')
 
     # Definition of buttons for end points and distances
     toggle_month = Toggle(label="Show end points", button_type="success")
@@ -42,10 +172,13 @@ def make_start_end_figure(doc):
 
     # definition and configuration of the year and month sliders
     slider_year = RangeSlider(start=year_min, end=year_max,
-                              value=(year_min, year_max), step=1, title="Years")
+                              value=(year_min, year_max), step=1, title="Years", name='slider_year')
 
     slider_month = RangeSlider(start=1, end=12,
-                               value=(1, 12), step=1, title="Months")
+                               value=(1, 12), step=1, title="Months", name='slider_month')
+
+    # definition of the days of activity slider
+    slider_dates = make_dates_slider(intervals)
 
     # End points
     toggle_season = Toggle(label="Show end points", button_type="success")
@@ -53,29 +186,39 @@ def make_start_end_figure(doc):
 
     # definition and configuration of the number selection
     select_number_season = Select(title='Number of hurricanes:', value='5',
-                                  options=options_number)
+                                  options=options_number, name='select_number_season')
 
     # definition and configuration of the zone selection
-    select_zone_season = Select(title='Spawning Zone:', value='All', options=options_zone)
+    select_zone_season = Select(title='Spawning Zone:', value='All', options=options_zone,
+                                name='select_zone_season')
 
     # definition and configuration of the year and sliders
     slider_year_season = RangeSlider(start=year_min, end=year_max,
-                                     value=(year_min, year_max), step=1, title="Years")
+                                     value=(year_min, year_max), step=1, title="Years",
+                                     name='slider_year_season')
 
     # definition and configuration of the season selection
     options_season = ['All', 'Winter', 'Spring', 'Summer', 'Autumn']
-    select_season = Select(title='Season:', value='All', options=options_season)
+    select_season = Select(title='Season:', value='All', options=options_season, name='select_season')
 
     # -------------------------------------------------------
     # DATA SOURCE AND RANDOMIZATION
     # -------------------------------------------------------
-    np.random.seed(42)
-    n = 5
+    # The coordinates are sent to the browser with the encoding of HURRICANES_COORDINATES_ENCODING
+    coordinates = CoordinatesEncoder('spawns')
+
+    # Seeded draw of 5 hurricanes, without touching the global random state (documents are also built by the
+    # documents pools threads)
+    data = coordinates.encode(select_storms(df_spawn_end, years=(year_min, year_max), n=5))
+    source = ColumnDataSource(data=data, name='source')
 
-    select_list = list(np.random.choice(df_spawn_end.index, size=n, replace=False))
-    filtr = df_spawn_end.index.map(lambda x: x in select_list)
+    # Each tab has its own source, so that switching tabs keeps the hurricanes of both. The default filters of the
+    # seasonal tab select the same hurricanes.
+    source_season = ColumnDataSource(data=data, name='source_season')
 
-    source = ColumnDataSource(data=df_spawn_end[filtr])
+    # Filters of the hurricanes of each tab, with the version of the datasets they were selected from: switching
+    # tabs sends nothing unless the datasets were reloaded since
+    selections = {'monthly': None, 'seasonal': None}
 
     # --------------------------------------------------------
     # FIRST TAB
@@ -92,17 +235,17 @@ def make_start_end_figure(doc):
     # - Start
     # - End
     # - Start with size adjusted to the traveled distance
-    c1 = p.circle(x='x_start', y='y_start', fill_color='green', size=8,
+    c1 = p.circle(**coordinates.points('start'), fill_color='green', size=8,
                   source=source, legend_label='Start points')
 
-    c2 = p.circle(x='x_end', y='y_end', fill_color='orange', size=8,
+    c2 = p.circle(**coordinates.points('end'), fill_color='orange', size=8,
                   source=source, legend_label='End points')
 
-    d1 = p.circle(x='x_start', y='y_start', fill_color='green', radius='Distance_draw',
+    d1 = p.circle(**coordinates.points('start'), fill_color='green', radius='Distance_draw',
                   source=source)
 
     # Line between start and end points
-    s1 = p.segment(x0='x_start', y0='y_start', x1='x_end', y1='y_end',
+    s1 = p.segment(**coordinates.segments(),
                    line_dash='dashed', source=source)
 
     # Initial configuration of WIDGETS  for FIRST TAB
@@ -133,48 +276,32 @@ def make_start_end_figure(doc):
     cols = [TableColumn(field=col, title=col) for col in df_spawn_end.columns if col not in no_cols]
     data_table = DataTable(columns=cols, source=source, width=1100, selectable=False)
 
+    def monthly_filters():
+        return (lease.store.current.version, slider_year.value, slider_month.value, select_zone.value,
+                select_number.value, slider_dates.value)
+
     # ------------------------------------------------------------------------
     # UPDATING FIRST TAB
     # ------------------------------------------------------------------------
 
     # updating process of the data underlying the map depending on user actions.
+    @instrument_callback('spawns', 'update_map_se', source)
+    @profile_callback('spawns', 'update_map_se')
+    @lease.callback
     def update_map_se(attr, old, new):
 
-        yr = slider_year.value
-        month = slider_month.value
-        zone = select_zone.value
-        n = select_number.value
-        n = int(n)
-
-        if zone == 'All':
-            df_temp = df_spawn_end.loc[(df_spawn_end['Year_start'] >= yr[0])
-                                       & (df_spawn_end['Year_start'] <= yr[1])
-                                       & (df_spawn_end['Month_start'] >= month[0])
-                                       & (df_spawn_end['Month_start'] <= month[1])]
-
-        else:
-            df_temp = df_spawn_end.loc[(df_spawn_end.Zones_start == zone)
-                                       & (df_spawn_end['Year_start'] >= yr[0])
-                                       & (df_spawn_end['Year_start'] <= yr[1])
-                                       & (df_spawn_end['Month_start'] >= month[0])
-                                       & (df_spawn_end['Month_start'] <= month[1])]
-
-        if n == -1:
-
-            source.data = ColumnDataSource.from_df(df_temp)
-        else:
-
-            if n > len(df_temp):  # For cases where there are not enough data points
-                n = int(len(df_temp))
-
-            np.random.seed(42)
+        df_spawn_end = load_start_end_df(files_dir=files_dir)
+        intervals = load_interval_index(files_dir=files_dir)
 
-            select_list = list(np.random.choice(df_temp.index, size=n, replace=False))
+        df_temp = select_storms(df_spawn_end, years=slider_year.value, months=slider_month.value,
+                                zone=select_zone.value, n=int(select_number.value),
+                                ids=storms_active(intervals, slider_dates))
 
-            filtr = df_temp.index.map(lambda x: x in select_list)
-
-            source.data = ColumnDataSource.from_df(df_temp.loc[filtr])
+        source.data = coordinates.encode(ColumnDataSource.from_df(df_temp))
+        selections['monthly'] = monthly_filters()
 
+    @instrument_callback('spawns', 'month_active')
+    @profile_callback('spawns', 'month_active')
     def month_active(atrr, old, new):
 
         active = toggle_month.active
@@ -205,13 +332,18 @@ def make_start_end_figure(doc):
     slider_year.on_change('value', update_map_se)
     slider_month.on_change('value', update_map_se)
     select_zone.on_change('value', update_map_se)
+    slider_dates.on_change('value', update_map_se)
     toggle_month.on_change('active', month_active)
     toggle_dist_month.on_change('active', month_active)
 
     # Make first tab
-    tab_month = Panel(child=column(row(column(slider_year, slider_month,
+    # ACE and intensity of the years selected
+    climatology_month = make_climatology_panel('spawns', files_dir, lease, slider_year, 'climatology')
+
+    tab_month = Panel(child=column(row(column(slider_year, slider_month, slider_dates,
                                        select_number, select_zone,
-                                       toggle_month, toggle_dist_month), p, add_paragraph), data_table), title="Monthly")
+                                       toggle_month, toggle_dist_month), p, climatology_month, add_paragraph),
+                                   data_table), title="Monthly")
 
     # ----------------------------------------------------------------------------
     # SECOND TAB
@@ -227,18 +359,18 @@ def make_start_end_figure(doc):
     # - Start
     # - End
     # - Start with size adjusted to the traveled distance
-    c3 = p_season.circle(x='x_start', y='y_start', fill_color='green', size=8,
-                         source=source, legend_label='Start points')
+    c3 = p_season.circle(**coordinates.points('start'), fill_color='green', size=8,
+                         source=source_season, legend_label='Start points')
 
-    c4 = p_season.circle(x='x_end', y='y_end', fill_color='orange', size=8,
-                         source=source, legend_label='End points')
+    c4 = p_season.circle(**coordinates.points('end'), fill_color='orange', size=8,
+                         source=source_season, legend_label='End points')
 
-    d2 = p_season.circle(x='x_start', y='y_start', fill_color='green', radius='Distance_draw',
-                         source=source)
+    d2 = p_season.circle(**coordinates.points('start'), fill_color='green', radius='Distance_draw',
+                         source=source_season)
 
     # line between start and end points
-    s2 = p_season.segment(x0='x_start', y0='y_start', x1='x_end', y1='y_end',
-                          line_dash='dashed', source=source)
+    s2 = p_season.segment(**coordinates.segments(),
+                          line_dash='dashed', source=source_season)
 
     # Initial configuration of WIDGETS  for SECOND TAB
     # - Don't show end points
@@ -263,55 +395,34 @@ def make_start_end_figure(doc):
 
     p_season.legend.location = "top_left"
 
+    data_table_season = DataTable(columns=[TableColumn(field=col, title=col) for col in df_spawn_end.columns
+                                           if col not in no_cols],
+                                  source=source_season, width=1100, selectable=False)
+
+    def seasonal_filters():
+        return (lease.store.current.version, slider_year_season.value, select_zone_season.value,
+                select_season.value, select_number_season.value)
+
     # ------------------------------------------------------------------------
     # UPDATING SECOND TAB
     # ------------------------------------------------------------------------
 
     # updating process of the data underlying the map depending on user actions.
+    @instrument_callback('spawns', 'update_map_season', source_season)
+    @profile_callback('spawns', 'update_map_season')
+    @lease.callback
     def update_map_season(attr, old, new):
 
-        yr = slider_year_season.value
-        season = select_season.value
-        zone = select_zone_season.value
-        n = select_number_season.value
-        n = int(n)
-
-        if (zone == 'All') & (season == 'All'):
-            df_temp = df_spawn_end.loc[(df_spawn_end['Year_start'] >= yr[0])
-                                       & (df_spawn_end['Year_start'] <= yr[1])]
+        df_spawn_end = load_start_end_df(files_dir=files_dir)
 
-        elif (zone != 'All') & (season == 'All'):
-            df_temp = df_spawn_end.loc[(df_spawn_end.Zones_start == zone)
-                                       & (df_spawn_end['Year_start'] >= yr[0])
-                                       & (df_spawn_end['Year_start'] <= yr[1])]
+        df_temp = select_storms(df_spawn_end, years=slider_year_season.value, zone=select_zone_season.value,
+                                season=select_season.value, n=int(select_number_season.value))
 
-        elif (zone == 'All') & (season != 'All'):
-            df_temp = df_spawn_end.loc[(df_spawn_end.Season_start == season)
-                                       & (df_spawn_end['Year_start'] >= yr[0])
-                                       & (df_spawn_end['Year_start'] <= yr[1])]
-
-        else:
-            df_temp = df_spawn_end.loc[(df_spawn_end.Zones_start == zone)
-                                       & (df_spawn_end.Season_start == season)
-                                       & (df_spawn_end['Year_start'] >= yr[0])
-                                       & (df_spawn_end['Year_start'] <= yr[1])]
-
-        if n == -1:
-
-            source.data = ColumnDataSource.from_df(df_temp)
-        else:
-
-            if n > len(df_temp):  # For cases where there are not enough data points
-                n = int(len(df_temp))
-
-            np.random.seed(42)
-
-            select_list = list(np.random.choice(df_temp.index, size=n, replace=False))
-
-            filtr = df_temp.index.map(lambda x: x in select_list)
-
-            source.data = ColumnDataSource.from_df(df_temp.loc[filtr])
+        source_season.data = coordinates.encode(ColumnDataSource.from_df(df_temp))
+        selections['seasonal'] = seasonal_filters()
 
+    @instrument_callback('spawns', 'season_active')
+    @profile_callback('spawns', 'season_active')
     def season_active(atrr, old, new):
 
         active = toggle_season.active
@@ -345,57 +456,62 @@ def make_start_end_figure(doc):
     toggle_dist_season.on_change('active', season_active)
 
     # Make second tab
+    climatology_season = make_climatology_panel('spawns', files_dir, lease, slider_year_season,
+                                                'climatology_season')
+
     tab_season = Panel(child=column(row(column(slider_year_season, select_number_season, select_season,
                                         select_zone_season,toggle_season, toggle_dist_season),
-                                        p_season, add_paragraph), data_table), title="Seasonal")
+                                        p_season, climatology_season, add_paragraph), data_table_season),
+                       title="Seasonal")
 
     # ----------------------------------------------------------------------------
     # FINAL SET UP
     # ----------------------------------------------------------------------------
 
-    tabs = Tabs(tabs=[tab_month, tab_season])
+    tabs = Tabs(tabs=[tab_month, tab_season], name='tabs')
 
+    selections.update(monthly=monthly_filters(), seasonal=seasonal_filters())
+
+    @instrument_callback('spawns', 'tab_change')
+    @profile_callback('spawns', 'tab_change')
     def tab_change(atrr, old, new):
 
+        # The hurricanes of the tab are selected again only if the datasets were reloaded since
         if tabs.active == 0:
 
-            update_map_se('', '', '')
+            if selections['monthly'] != monthly_filters():
+                update_map_se('', '', '')
 
         else:
 
-            update_map_season('', '', '')
+            if selections['seasonal'] != seasonal_filters():
+                update_map_season('', '', '')
 
     tabs.on_change('active', tab_change)
 
     # Make document
     doc.add_root(tabs)
     doc.title = 'Hurricanes'
-    doc.theme = Theme(filename="theme.yaml")
+    doc.theme = load_theme()
 
 
-def make_tracks_figure(doc):
+def make_tracks_figure(doc, files_dir: str = FILES_DIR, rendering: str = TRACKS_RENDERING,
+                       markers: bool = TRACKS_MARKERS):
     """
-    Create a Bokeh app for visualization of the tracks of hurricanes
+    Create a Bokeh app for visualization of the tracks of hurricanes, drawn with segments or with a single line (see
+    workflow/polylines.py)
     """
 
-    df = pd.read_csv('files/df_full_tracks_bokeh.csv', index_col=0, parse_dates=['Time'])
-
-    # Remove last entry for each hurricane, add steps numbering, year_start, year_end, zone start
-    df.dropna(subset=['x_end'], inplace=True)
-
-    df.sort_values(by=['ID', 'Time'], inplace=True)
+    if rendering not in RENDERINGS:
+        raise ValueError('Unknown tracks rendering {}, expected one of {}'.format(rendering, RENDERINGS))
 
-    steps = df.groupby(by='ID').Time.count()
-    times = df.groupby(by='ID').Time.first()
-    zones = df.groupby(by='ID').Zones.first()
+    # Version of the datasets of the session, replaced by the newer ones on the next callback (see workflow/versions.py)
+    lease = DatasetLease(files_dir, doc)
+    doc.on_session_destroyed(lambda session_context: lease.release())
 
-    df['Step'] = [i for hur in steps.index for i in range(steps[hur])]
-    df['Year_start'] = [times[hur].year for hur in steps.index for i in range(steps[hur])]
-    df['Month_start'] = [times[hur].month for hur in steps.index for i in range(steps[hur])]
-    df['Zones_start'] = [zones[hur]for hur in steps.index for i in range(steps[hur])]
-
-    # Convert knots to km/h
-    df['Max_Speed'] = df['Max_Speed'] * 1.852
+    with lease.pinned():
+        df = load_tracks_df(files_dir=files_dir)
+        intervals = load_interval_index(files_dir=files_dir)
 
     # -----------------------------------------------------
     # FIGURE
@@ -405,7 +521,7 @@ def make_tracks_figure(doc):
     gulf_stream_lon1, gulf_stream_lon2, gulf_stream_lat1, gulf_stream_lat2 = get_gulf_stream()
 
     # credits of the map
-    url = 'http://a.basemaps.cartocdn.com/rastertiles/voyager/{Z}/{X}/{Y}.png'
+    url = TILE_URL
     attribution = "Tiles by Carto, under CC BY 3.0. Data by OSM, under ODbL"
 
     add_paragraph = additional_legend(loc='spawns')
@@ -416,18 +532,35 @@ def make_tracks_figure(doc):
 
     # definition and configuration of the number selection
     options_number = ['-1'] + [str(x) for x in list(np.arange(1, 21))]
-    select_number = Select(title='Number of hurricanes:', value='5', options=options_number)
+    select_number = Select(title='Number of hurricanes:', value='5', options=options_number,
+                           name='select_number')
 
     # definition and configuration of the zone selection
-    options_zone = ['All', 'Mexico_Caribbean', 'Atlantic']
-    select_zone = Select(title='Spawning Zone:', value='All', options=options_zone)
+    options_zone = ['All'] + load_zone_names(ZONES_FILE)
+    select_zone = Select(title='Spawning Zone:', value='All', options=options_zone, name='select_zone')
 
     # definition and configuration of the year and month sliders
     slider_year = RangeSlider(start=year_min, end=year_max,
-                              value=(year_min, year_max), step=1, title="Years")
+                              value=(year_min, year_max), step=1, title="Years", name='slider_year')
 
     slider_month = RangeSlider(start=1, end=12,
-                               value=(1, 12), step=1, title="Months")
+                               value=(1, 12), step=1, title="Months", name='slider_month')
+
+    # definition of the days of activity slider
+    slider_dates = make_dates_slider(intervals)
+
+    # definition of the proximity query: hurricanes passing within a radius of a place, typed or tapped on the map
+    text_near = TextInput(title='Near (latitude, longitude):', value='', placeholder='25.76, -80.19',
+                          name='text_near')
+    slider_radius = Slider(start=25, end=1000, value=200, step=25, title="Radius (km)", name='slider_radius')
+
+    # definition of the similar tracks query: the most similar tracks of a hurricane, typed or tapped on the map
+    options_tap = ['Search near', 'Find similar tracks']
+    select_tap = Select(title='Tap on the map to:', value=options_tap[0], options=options_tap, name='select_tap')
+    text_similar = TextInput(title='Similar to (ID):', value='', placeholder='AL122005', name='text_similar')
+
+    # definition of the playback of the displayed tracks, time step after time step
+    toggle_play = Toggle(label="Play", button_type="success", name='toggle_play')
 
     # definition and configuration of the number selection
     # select_number_season = Select(title='Number of hurricanes:', value='5',
@@ -447,35 +580,82 @@ def make_tracks_figure(doc):
     # -------------------------------------------------------
     # DATA SOURCE AND RANDOMIZATION
     # -------------------------------------------------------
-    np.random.seed(42)
-    n = 5
+    # The coordinates are sent to the browser with the encoding of HURRICANES_COORDINATES_ENCODING
+    coordinates = CoordinatesEncoder('tracks')
 
-    select_list = list(np.random.choice(df.ID.unique(), size=n, replace=False))
-    filtr = df.ID.map(lambda x: x in select_list)
+    # Seeded draw of 5 hurricanes, without touching the global random state (documents are also built by the
+    # documents pools threads)
+    df_temp = select_storms(df, years=(year_min, year_max), n=5, per_storm=True)
 
-    source = ColumnDataSource(data=df[filtr])
+    # With the 'lines' rendering, the same tracks as a single line. The steps then only carry the columns of the table,
+    # and the start points of the markers.
+    lines = rendering == 'lines'
+    unused_columns = ['x_end', 'y_end'] + ([] if markers else ['x_start', 'y_start']) if lines else []
 
-    # Initialization of the map
+    def steps_data(df_temp):
+        return coordinates.encode(ColumnDataSource.from_df(df_temp.drop(columns=unused_columns)))
+
+    # The steps displayed, with all their columns, for the playback and the taps
+    displayed = {'steps': df_temp}
+    source = ColumnDataSource(data=steps_data(df_temp), name='source')
+
+    if lines:
+        line_source = ColumnDataSource(data=coordinates.encode(storm_line(df_temp)), name='line_source')
+
+    # Hurricanes close to the place of the proximity query, and the circle of the query
+    near_columns = ['ID', 'Closest_distance', 'Closest_time']
+    near_source = ColumnDataSource(data={column: [] for column in near_columns}, name='near_source')
+    center_source = ColumnDataSource(data={'x': [], 'y': [], 'radius': []}, name='center_source')
+
+    # Tracks most similar to the one of a hurricane, drawn with it
+    similar_columns = ['ID', 'Distance']
+    track_columns = ['ID', 'x_start', 'y_start', 'x_end', 'y_end', 'color']
+    similar_source = ColumnDataSource(data={column: [] for column in similar_columns}, name='similar_source')
+    similar_tracks_source = ColumnDataSource(data={column: [] for column in track_columns},
+                                             name='similar_tracks_source')
+
+    # Last time steps of the played tracks, streamed one time step after the other
+    play_source = ColumnDataSource(data={column: [] for column in PLAYBACK_COLUMNS}, name='play_source')
+
+    # Initialization of the map, drawn on canvas: the WebGL line of bokeh 2.0.2 stops at the first NaN of the line
     p = figure(tools='pan, wheel_zoom', x_range=(lon_boundaries[0], lon_boundaries[1]),
                y_range=(lat_boundaries[0], lat_boundaries[1]),
                x_axis_type="mercator", y_axis_type="mercator")
 
     p.add_tile(WMTSTileSource(url=url, attribution=attribution))
 
-    # Add data points
-    # - Start
-    # - End
-    # - Start with size adjusted to the traveled distance
-    c1 = p.circle(x='x_start', y='y_start', fill_color='green', size=5, source=source)
+    if not lines:
+        # Add data points
+        # - Start
+        # - End
+        # - Start with size adjusted to the traveled distance
+        c1 = p.circle(**coordinates.points('start'), fill_color='green', size=5, source=source)
 
-    c2 = p.circle(x='x_end', y='y_end', fill_color='green', size=5, source=source)
+        c2 = p.circle(**coordinates.points('end'), fill_color='green', size=5, source=source)
 
-    # Line between start and end points
-    s1 = p.segment(x0='x_start', y0='y_start', x1='x_end', y1='y_end',
-                   line_dash='dashed', source=source)
+        # Line between start and end points
+        s1 = p.segment(**coordinates.segments(),
+                       line_dash='dashed', source=source)
+
+        track_renderers, hover_renderers, tooltips = [c1, c2, s1], [c1], ['ID', 'Step', 'Distance']
+
+    else:
+        # Every track with a single line, and optionally a marker at the start of each step. The hover of a segment
+        # of the line looks the columns of its step up in the source of the table, by the step of its first point.
+        l1 = p.line(**coordinates.line(), line_width=1.5, source=line_source)
+        track_renderers, hover_renderers, tooltips = [l1], [l1], ['ID', 'Step', 'Distance']
+
+        if markers:
+            m1 = p.circle(**coordinates.points('start'), fill_color='green', size=4, source=source)
+            track_renderers = [l1, m1]
 
     # Configuration of the hovertool
-    hover = HoverTool(tooltips=[("ID", "@ID"), ("Step", "@Step"), ("Distance", "@Distance")], renderers=[c1])
+    if not lines:
+        hover = HoverTool(tooltips=[(column, '@' + column) for column in tooltips], renderers=hover_renderers)
+    else:
+        lookup = CustomJSHover(args=dict(source=source), code=STEP_LOOKUP)
+        hover = HoverTool(tooltips=[(column, '@step{' + column + '}') for column in tooltips],
+                          formatters={'@step': lookup}, renderers=hover_renderers, line_policy='prev')
     p.tools.append(hover)
 
     # Draw the Gulf Stream
@@ -489,6 +669,17 @@ def make_tracks_figure(doc):
 
     p.legend.location = "top_left"
 
+    # Circle of the proximity query. The scale of web mercator is 1 / cos(latitude) around the center.
+    p.circle(x='x', y='y', radius='radius', source=center_source, fill_alpha=0.1, color='navy')
+
+    # Hurricane of the similar tracks query (purple) and its most similar tracks (orange)
+    p.segment(**coordinates.segments(), color='color', line_width=2,
+              source=similar_tracks_source)
+
+    # Played tracks
+    p.segment(**coordinates.segments(), color='firebrick', line_width=3,
+              source=play_source)
+
     # DataFrame display
     no_cols = ['x_start', 'x_end', 'y_start', 'y_end', 'Zones_start', 'ID', 'Time']
     cols = ([TableColumn(field='ID', title='ID')]
@@ -496,54 +687,168 @@ def make_tracks_figure(doc):
             + [TableColumn(field=col, title=col) for col in df.columns if col not in no_cols])
     data_table = DataTable(columns=cols, source=source, width=1100, selectable=False)
 
+    near_table = DataTable(columns=[TableColumn(field='ID', title='ID'),
+                                    TableColumn(field='Closest_distance', title='Distance (km)',
+                                                formatter=NumberFormatter(format='0.0')),
+                                    TableColumn(field='Closest_time', title='Closest on',
+                                                formatter=DateFormatter(format="%d/%m/%Y %H:%M"))],
+                           source=near_source, width=300, height=200, selectable=False)
+
+    similar_table = DataTable(columns=[TableColumn(field='ID', title='ID'),
+                                       TableColumn(field='Distance', title='Distance (km)',
+                                                   formatter=NumberFormatter(format='0.0'))],
+                              source=similar_source, width=300, height=200, selectable=False)
+
+    def storms_near():
+        # Hurricanes within the radius of the place of text_near, and None without a valid place
+        try:
+            lat, lon = parse_center(text_near.value)
+        except ValueError:
+            center_source.data = {'x': [], 'y': [], 'radius': []}
+            return None
+
+        x, y = wgs84_to_mercator(lon, lat)
+        center_source.data = {'x': [x], 'y': [y], 'radius': [slider_radius.value * 1000 / np.cos(np.radians(lat))]}
+
+        return load_track_index(files_dir=files_dir).storms_within(lon, lat, slider_radius.value)
+
+    # State of the playback: the frames of the displayed tracks, the next one, and the periodic callback
+    # (pooled documents hand their roots to the document of the session, the callback is added to the latter)
+    playback = {'frames': None, 'next': 0, 'callback': None, 'document': None}
+
+    # Bokeh removes the periodic callback of a destroyed session, the frames are dropped with it
+    doc.on_session_destroyed(lambda session_context: playback.update(frames=None, callback=None, document=None))
+
+    def stop_playback():
+        if playback['callback'] is not None:
+            playback['document'].remove_periodic_callback(playback['callback'])
+        playback.update(frames=None, next=0, callback=None, document=None)
+
+        play_source.data = {column: [] for column in PLAYBACK_COLUMNS}
+        for renderer in track_renderers:
+            renderer.visible = True
+        toggle_play.label = "Play"
+
+    @instrument_callback('tracks', 'play_step')
+    @profile_callback('tracks', 'play_step')
+    def play_step():
+        frames = playback['frames']
+        if frames is None or playback['next'] >= len(frames):
+            # End of the tracks, stop_playback is called back by the toggle
+            toggle_play.active = False
+            return
+
+        # Only the steps of the next time step are sent, the oldest ones are dropped by the browser and the server
+        play_source.stream(frames.frame(playback['next']), rollover=frames.rollover(playback['next']))
+        playback['next'] += 1
+
+    @instrument_callback('tracks', 'play_active')
+    @profile_callback('tracks', 'play_active')
+    def play_active(attr, old, new):
+        if not toggle_play.active:
+            stop_playback()
+            return
+
+        steps = displayed['steps']
+        frames = PlaybackFrames(coordinates.encode({column: steps[column].values for column in PLAYBACK_COLUMNS}))
+        playback.update(frames=frames, next=0)
+
+        play_source.data = frames.empty()
+        for renderer in track_renderers:
+            renderer.visible = False
+        toggle_play.label = "Stop"
+
+        playback['document'] = toggle_play.document
+        playback['callback'] = playback['document'].add_periodic_callback(play_step, FRAME_PERIOD)
+
     # updating process of the data underlying the map depending on user actions.
+    @instrument_callback('tracks', 'update_map_se', source)
+    @profile_callback('tracks', 'update_map_se')
+    @lease.callback
     def update_map_se(attr, old, new):
 
-        yr = slider_year.value
-        month = slider_month.value
-        zone = select_zone.value
-        n = select_number.value
-        n = int(n)
-
-        if zone == 'All':
-            df_temp = df.loc[(df['Year_start'] >= yr[0])
-                             & (df['Year_start'] <= yr[1])
-                             & (df['Month_start'] >= month[0])
-                             & (df['Month_start'] <= month[1])]
-
-        else:
-            df_temp = df.loc[(df.Zones_start == zone)
-                             & (df['Year_start'] >= yr[0])
-                             & (df['Year_start'] <= yr[1])
-                             & (df['Month_start'] >= month[0])
-                             & (df['Month_start'] <= month[1])]
-
-        if n == -1:
-
-            source.data = ColumnDataSource.from_df(df_temp)
-        else:
+        # The playback is of the previous tracks
+        toggle_play.active = False
 
-            if n > len(df_temp):  # For cases where there are not enough data points
-                n = int(len(df_temp))
+        df = load_tracks_df(files_dir=files_dir)
+        intervals = load_interval_index(files_dir=files_dir)
+        df_near = storms_near()
 
-            np.random.seed(42)
+        ids = df_near['ID'] if df_near is not None else None
+        active = storms_active(intervals, slider_dates)
+        if active is not None:
+            ids = active if ids is None else np.intersect1d(ids, active)
 
-            select_list = list(np.random.choice(df_temp.ID.unique(), size=n, replace=False))
+        df_temp = select_storms(df, years=slider_year.value, months=slider_month.value, zone=select_zone.value,
+                                n=int(select_number.value), per_storm=True, ids=ids)
 
-            filtr = df_temp.ID.map(lambda x: x in select_list)
+        displayed['steps'] = df_temp
+        source.data = steps_data(df_temp)
+        if lines:
+            line_source.data = coordinates.encode(storm_line(df_temp))
 
-            source.data = ColumnDataSource.from_df(df_temp.loc[filtr])
+        if df_near is None:
+            near_source.data = {column: [] for column in near_columns}
+        else:
+            near_source.data = ColumnDataSource.from_df(df_near.loc[df_near['ID'].isin(df_temp['ID']), near_columns])
+
+    @instrument_callback('tracks', 'update_similar', similar_tracks_source)
+    @profile_callback('tracks', 'update_similar')
+    @lease.callback
+    def update_similar(attr, old, new):
+
+        df = load_tracks_df(files_dir=files_dir)
+        similarity = load_similarity_index(files_dir=files_dir)
+
+        storm_id = text_similar.value.strip().upper()
+        try:
+            df_similar = similarity.similar(storm_id)
+        except KeyError:
+            similar_source.data = {column: [] for column in similar_columns}
+            similar_tracks_source.data = {column: [] for column in track_columns}
+            return
+
+        df_temp = df.loc[df['ID'].isin([storm_id] + list(df_similar['ID'])), track_columns[:-1]]
+        df_temp = df_temp.assign(color=np.where(df_temp['ID'] == storm_id, 'purple', 'orange'))
+
+        similar_source.data = ColumnDataSource.from_df(df_similar)
+        similar_tracks_source.data = coordinates.encode(ColumnDataSource.from_df(df_temp))
+
+    @instrument_callback('tracks', 'map_tap')
+    @profile_callback('tracks', 'map_tap')
+    def map_tap(event):
+        if select_tap.value == 'Find similar tracks':
+            # The hurricane displayed closest to the tap
+            steps = displayed['steps']
+            x, y = steps['x_start'].values, steps['y_start'].values
+            if len(x):
+                text_similar.value = steps['ID'].values[int(np.argmin(np.hypot(x - event.x, y - event.y)))]
+            return
+
+        lon, lat = mercator_to_wgs84(event.x, event.y)
+        text_near.value = '{:.2f}, {:.2f}'.format(lat, lon)
 
     # activation of the changes on user action
     select_number.on_change('value', update_map_se)
     slider_year.on_change('value', update_map_se)
     slider_month.on_change('value', update_map_se)
     select_zone.on_change('value', update_map_se)
+    text_near.on_change('value', update_map_se)
+    slider_radius.on_change('value', update_map_se)
+    slider_dates.on_change('value', update_map_se)
+    text_similar.on_change('value', update_similar)
+    toggle_play.on_change('active', play_active)
+    p.on_event(Tap, map_tap)
+
+    # ACE and intensity of the years selected
+    climatology_panel = make_climatology_panel('tracks', files_dir, lease, slider_year, 'climatology')
 
-    layout = column(row(column(slider_year, slider_month, select_number, select_zone),
-                        p, add_paragraph), data_table)
+    layout = column(row(column(slider_year, slider_month, slider_dates, select_number, select_zone,
+                               text_near, slider_radius, near_table, select_tap, text_similar, similar_table,
+                               toggle_play),
+                        p, climatology_panel, add_paragraph), data_table)
 
     # Make document
     doc.add_root(layout)
     doc.title = 'Hurricanes_Tracks'
-    doc.theme = Theme(filename="theme.yaml")
+    doc.theme = load_theme()
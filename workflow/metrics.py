@@ -0,0 +1,276 @@
+import json
+import time
+import numpy as np
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROWS_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+# Rows of the non-numerical columns serialized to estimate the size of the data sent by a callback
+PAYLOAD_SAMPLE = 256
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+
+    def escape(value: str) -> str:
+        return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+    return '{' + ','.join('{}="{}"'.format(name, escape(value)) for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    """
+    Base class of the metrics, in the Prometheus text exposition format.
+
+    Values are stored per tuple of label values, and are safe to update from the bokeh and Flask threads.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = dict()
+        self._lock = Lock()
+
+    def _key(self, labels: Sequence[str]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError('{} expects labels {}, got {}'.format(self.name, self.labelnames, labels))
+        return tuple(str(label) for label in labels)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            return [(self.name, _format_labels(self.labelnames, key), value) for key, value in self._values.items()]
+
+    def expose(self) -> str:
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.kind)]
+        lines += ['{}{} {}'.format(name, labels, _format_value(value)) for name, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. Its value can also be computed by a function at each scrape.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value: float, *labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        if self.function is not None:
+            for key, value in self.function().items():
+                self.set(value, *key)
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value: float, *labels: str):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            counts[int(np.searchsorted(self.buckets, value, side='left'))] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = np.cumsum(counts)
+                for bound, count in zip(self.buckets, cumulative):
+                    labels = _format_labels(self.labelnames + ('le',), key + (_format_value(bound),))
+                    samples.append((self.name + '_bucket', labels, count))
+                labels = _format_labels(self.labelnames, key)
+                samples.append((self.name + '_sum', labels, total))
+                samples.append((self.name + '_count', labels, cumulative[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        """
+        Returns every metric in the Prometheus text exposition format (version 0.0.4).
+        """
+
+        return '\n'.join(metric.expose() for metric in self.metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+CALLBACK_LATENCY = REGISTRY.register(Histogram(
+    'hurricanes_callback_duration_seconds', 'Duration of the bokeh widgets callbacks.', ['app', 'callback']))
+CALLBACK_ERRORS = REGISTRY.register(Counter(
+    'hurricanes_callback_errors_total', 'Number of bokeh widgets callbacks that raised.', ['app', 'callback']))
+CALLBACK_ROWS = REGISTRY.register(Histogram(
+    'hurricanes_callback_rows', 'Number of rows sent to the browser by a callback.', ['app', 'callback'],
+    buckets=ROWS_BUCKETS))
+CALLBACK_BYTES = REGISTRY.register(Histogram(
+    'hurricanes_callback_payload_bytes', 'Size of the serialized data sent to the browser by a callback.',
+    ['app', 'callback'], buckets=BYTES_BUCKETS))
+
+SESSIONS_CREATED = REGISTRY.register(Counter(
+    'hurricanes_sessions_created_total', 'Number of bokeh sessions created.', ['app']))
+SESSIONS_DESTROYED = REGISTRY.register(Counter(
+    'hurricanes_sessions_destroyed_total', 'Number of bokeh sessions destroyed.', ['app']))
+SESSIONS_ACTIVE = REGISTRY.register(Gauge(
+    'hurricanes_sessions_active', 'Number of bokeh sessions currently open.', ['app']))
+SESSION_CREATION = REGISTRY.register(Histogram(
+    'hurricanes_session_creation_duration_seconds', 'Duration of the creation of a bokeh document.', ['app']))
+
+
+def payload_bytes(data: dict, sample: int = PAYLOAD_SAMPLE) -> int:
+    """
+    Returns the size of `data` once serialized by bokeh.
+
+    Numerical columns are sent as binary buffers, the other columns as json lists. The json size of the columns
+    longer than `sample` is estimated from `sample` rows evenly spaced, not to serialize every value of large sources a
+    second time on the event loop of the server.
+    """
+
+    size = 0
+
+    for values in data.values():
+        values = np.asarray(values)
+        if values.dtype.kind in 'biufcmM':
+            size += values.nbytes
+        elif len(values) <= sample:
+            size += len(json.dumps(values.tolist(), default=str))
+        else:
+            rows = values[np.linspace(0, len(values) - 1, sample).astype(np.int64)]
+            size += int(len(json.dumps(rows.tolist(), default=str)) * len(values) / sample)
+
+    return size
+
+
+def instrument_callback(app: str, name: str, source=None) -> Callable:
+    """
+    Decorator recording the duration and errors of a bokeh callback, and, if it replaces the data of `source`,
+    the number of rows and the size of the new data.
+
+    Parameters
+    ----------
+
+    app: str
+        Name of the bokeh app.
+    name: str
+        Name of the callback.
+    source: ColumnDataSource
+        The data source updated by the callback, if any.
+    """
+
+    def decorator(callback: Callable) -> Callable:
+
+        @wraps(callback)
+        def wrapper(*args, **kwargs):
+            data = source.data if source is not None else None
+            t_0 = time.perf_counter()
+
+            try:
+                return callback(*args, **kwargs)
+            except Exception:
+                CALLBACK_ERRORS.inc(app, name)
+                raise
+            finally:
+                CALLBACK_LATENCY.observe(time.perf_counter() - t_0, app, name)
+
+                if source is not None and source.data is not data:
+                    CALLBACK_ROWS.observe(len(next(iter(source.data.values()), [])), app, name)
+                    CALLBACK_BYTES.observe(payload_bytes(source.data), app, name)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def session_metrics(app: str, doc):
+    """
+    Context manager around the creation of the document of a bokeh session: times the creation, counts the session,
+    and counts its destruction once the session ends.
+    """
+
+    t_0 = time.perf_counter()
+    yield
+    SESSION_CREATION.observe(time.perf_counter() - t_0, app)
+
+    SESSIONS_CREATED.inc(app)
+    SESSIONS_ACTIVE.inc(app)
+
+    def session_destroyed(session_context):
+        SESSIONS_DESTROYED.inc(app)
+        SESSIONS_ACTIVE.dec(app)
+
+    doc.on_session_destroyed(session_destroyed)
+
+
+def process_memory() -> Dict[Tuple[str, ...], float]:
+    """
+    Returns the resident memory of the process, read from /proc (Linux only).
+    """
+
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return {(): int(line.split()[1]) * 1024}
+    except OSError:
+        pass
+
+    return dict()
+
+
+REGISTRY.register(Gauge('hurricanes_process_resident_memory_bytes', 'Resident memory of the process.',
+                        function=process_memory))
@@ -0,0 +1,256 @@
+"""
+Tracks dataset partitioned by basin and decade.
+
+Each partition holds the steps of the hurricanes of a basin which started during a decade, in a columnar store (see
+workflow/store.py), and the manifest lists the partitions with the minimum and maximum of their years, latitudes and
+longitudes. Queries only read the partitions whose statistics can match their filters. The partitions are written
+from the root of the repository with
+
+    $ python -m workflow.partitions
+"""
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Sequence
+from workflow.config import FILES_DIR
+from workflow.store import read_columns, write_columns
+from workflow.versions import versioned
+
+
+PARTITIONS_DIR = 'tracks_partitioned/'
+MANIFEST_FILE = 'partitions.json'
+
+# Columns of the steps tested by storms_in_bbox
+BBOX_COLUMNS = ['ID', 'Longitude_start', 'Latitude_start', 'Longitude_end', 'Latitude_end']
+
+# Position of each step in the full tracks DataFrame, to read the partitions back in the same order
+ROW_COLUMN = 'Row'
+
+
+def partition_stats(df: pd.DataFrame) -> dict:
+    """
+    Returns the statistics of a partition: its numbers of rows and hurricanes, and the bounds of the years of the
+    hurricanes start and of the latitudes and longitudes of the steps.
+    """
+
+    latitudes = pd.concat([df['Latitude_start'], df['Latitude_end']])
+    longitudes = pd.concat([df['Longitude_start'], df['Longitude_end']])
+
+    return {'rows': len(df),
+            'storms': int(df['ID'].nunique()),
+            'year_min': int(df['Year_start'].min()), 'year_max': int(df['Year_start'].max()),
+            'lat_min': float(latitudes.min()), 'lat_max': float(latitudes.max()),
+            'lon_min': float(longitudes.min()), 'lon_max': float(longitudes.max())}
+
+
+def write_partitions(df: pd.DataFrame, directory: str, meta: Optional[dict] = None) -> List[dict]:
+    """
+    Writes the tracks DataFrame df partitioned by basin (first two characters of the ID) and decade of the hurricanes
+    start, with the manifest of the partitions.
+
+    Parameters
+    ----------
+
+    df: pd.DataFrame
+        The full tracks DataFrame, as loaded by load_tracks_df.
+    directory: str
+        The directory of the partitions, e.g. files/tracks_partitioned/, replaced.
+    meta: Optional[dict]
+        Information saved with the manifest, e.g. the version of the data it was computed from.
+
+    Return
+    ------
+
+    partitions: List[dict]
+        The entries of the manifest: basin, decade, path (relative to directory) and statistics of each partition.
+    """
+
+    directory = directory.rstrip('/') + '/'
+    tmp_directory = directory.rstrip('/') + '.tmp/'
+
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+
+    df = df.reset_index(drop=True)
+    df[ROW_COLUMN] = np.arange(len(df), dtype=np.int64)
+    basins = df['ID'].str[:2]
+    decades = df['Year_start'] // 10 * 10
+
+    partitions = []
+    for (basin, decade), df_partition in df.groupby([basins, decades], sort=True):
+        path = 'basin={}/decade={}'.format(basin, decade)
+        write_columns(df_partition, tmp_directory + path)
+        partitions.append(dict(basin=basin, decade=int(decade), path=path, **partition_stats(df_partition)))
+
+    with open(tmp_directory + MANIFEST_FILE, 'w') as f:
+        json.dump({'meta': meta or dict(), 'partitions': partitions}, f, indent=2)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_directory, directory)
+
+    return partitions
+
+
+class PartitionedTracks:
+    """
+    The tracks dataset partitioned by basin and decade, read partition by partition.
+
+    Parameters
+    ----------
+
+    directory: str
+        The directory of the partitions, written by write_partitions.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory.rstrip('/') + '/'
+
+        with open(self.directory + MANIFEST_FILE) as f:
+            manifest = json.load(f)
+
+        self.meta = manifest['meta']
+        self.partitions = manifest['partitions']
+        self._frames = dict()  # type: Dict[str, pd.DataFrame]
+
+    def __len__(self) -> int:
+        return len(self.partitions)
+
+    @property
+    def basins(self) -> List[str]:
+        return sorted(set(partition['basin'] for partition in self.partitions))
+
+    def prune(self, basins: Optional[Sequence[str]] = None, years: Optional[Sequence[int]] = None,
+              bbox: Optional[Sequence[float]] = None) -> List[dict]:
+        """
+        Returns the partitions which may hold steps matching the filters, from their statistics.
+
+        Parameters
+        ----------
+
+        basins: Optional[Sequence[str]]
+            The basins of the hurricanes, or None for all of them.
+        years: Optional[Sequence[int]]
+            The bounds of the range of the years of the hurricanes start, or None.
+        bbox: Optional[Sequence[float]]
+            The longitude and latitude bounds of a viewport (lon_min, lat_min, lon_max, lat_max), or None.
+        """
+
+        kept = []
+        for partition in self.partitions:
+            if basins is not None and partition['basin'] not in basins:
+                continue
+            if years is not None and (partition['year_max'] < years[0] or partition['year_min'] > years[1]):
+                continue
+            if bbox is not None and (partition['lon_max'] < bbox[0] or partition['lon_min'] > bbox[2]
+                                     or partition['lat_max'] < bbox[1] or partition['lat_min'] > bbox[3]):
+                continue
+            kept.append(partition)
+
+        return kept
+
+    def frame(self, partition: dict) -> pd.DataFrame:
+        """
+        Returns the steps of a partition, strings as objects, read once per version of the files and shared by the
+        queries, so that it must not be modified in place. Only the partitions queried are ever read.
+        """
+
+        path = partition['path']
+        if path not in self._frames:
+            df = read_columns(self.directory + path, mmap=False)
+            self._frames[path] = df.astype({column: object for column in df.columns
+                                            if isinstance(df[column].dtype, pd.CategoricalDtype)})
+
+        return self._frames[path]
+
+    def read(self, partitions: Sequence[dict], columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """
+        Returns the steps of partitions, in the order of the full tracks DataFrame.
+        """
+
+        # Without any partition, the columns of the first one, without its rows
+        frames = [self.frame(partition) for partition in partitions] or \
+                 [self.frame(partition).iloc[:0] for partition in self.partitions[:1]]
+        if not frames:
+            return pd.DataFrame(columns=columns or [])
+
+        if columns is not None:
+            frames = [frame[list(columns) + [ROW_COLUMN]] for frame in frames]
+
+        df = pd.concat(frames, ignore_index=True)
+        df = df.iloc[np.argsort(df[ROW_COLUMN].values, kind='stable')]
+
+        return df.drop(columns=[ROW_COLUMN]).reset_index(drop=True)
+
+    def select(self, basins: Optional[Sequence[str]] = None, years: Optional[Sequence[int]] = None,
+               bbox: Optional[Sequence[float]] = None, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """
+        Reads the partitions which may hold steps matching the filters (see prune).
+        """
+
+        return self.read(self.prune(basins, years, bbox), columns)
+
+
+def storms_in_bbox(df: pd.DataFrame, bbox: Sequence[float]) -> np.ndarray:
+    """
+    Returns the IDs of the hurricanes of the tracks DataFrame df with a step starting or ending in the viewport bbox
+    (lon_min, lat_min, lon_max, lat_max).
+    """
+
+    inside = np.zeros(len(df), dtype=bool)
+    for end in ('start', 'end'):
+        lon, lat = df['Longitude_' + end].values, df['Latitude_' + end].values
+        inside |= (lon >= bbox[0]) & (lon <= bbox[2]) & (lat >= bbox[1]) & (lat <= bbox[3])
+
+    return pd.unique(df['ID'].values[inside])
+
+
+def build_partitions(files_dir: str = FILES_DIR) -> str:
+    """
+    Writes the tracks of every basin of the preprocessed files, partitioned by basin and decade, to
+    files_dir + PARTITIONS_DIR, with the version of the preprocessed files.
+
+    Return
+    ------
+
+    directory: str
+        The directory of the partitions.
+    """
+
+    from workflow.datasets import dataset_version, prepare_tracks_df
+
+    df = prepare_tracks_df(pd.read_csv(files_dir + 'df_full_tracks_bokeh.csv', index_col=0, parse_dates=['Time']))
+
+    directory = files_dir + PARTITIONS_DIR
+    partitions = write_partitions(df, directory, meta={'version': dataset_version(files_dir)})
+
+    print('{} steps of {} basins written to {} partitions in {}'
+          .format(len(df), len(set(partition['basin'] for partition in partitions)), len(partitions), directory))
+
+    return directory
+
+
+@versioned
+def load_partitioned_tracks(files_dir: str = FILES_DIR) -> Optional[PartitionedTracks]:
+    """
+    Opens the partitioned tracks dataset, once per version of the files, or returns None if it was not written.
+    """
+
+    directory = files_dir + PARTITIONS_DIR
+    if not os.path.exists(directory + MANIFEST_FILE):
+        return None
+
+    return PartitionedTracks(directory)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files-dir', default=FILES_DIR, help='Directory of the preprocessed csv files.')
+    args = parser.parse_args(argv)
+
+    build_partitions(args.files_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import numpy as np
+from typing import Dict, Mapping, Sequence
+
+
+# Period of the playback of the tracks, in milliseconds, and number of time steps kept on the map behind the storms
+FRAME_PERIOD = 150
+TRAIL_STEPS = 8
+
+# Columns of the tracks streamed to the playback source
+PLAYBACK_COLUMNS = ('ID', 'Time', 'x_start', 'y_start', 'x_end', 'y_end')
+
+
+class PlaybackFrames:
+    """
+    The steps of the tracks of some hurricanes, by time step, to be streamed to a ColumnDataSource one time step after
+    the other.
+
+    The steps are sorted by time once, with the offset of the first step of each time in an array: a frame is a slice
+    of the sorted columns, only as large as the number of hurricanes active at that time. Times without any step are
+    skipped.
+
+    Parameters
+    ----------
+
+    data: Mapping[str, Sequence]
+        The tracks, as the data of a ColumnDataSource or a DataFrame, with a Time column and `columns`.
+    columns: Sequence[str]
+        The columns of the frames.
+    """
+
+    def __init__(self, data: Mapping[str, Sequence], columns: Sequence[str] = PLAYBACK_COLUMNS):
+        times = np.asarray(data['Time'])
+        order = np.argsort(times, kind='stable')
+
+        self.columns = {column: np.asarray(data[column])[order] for column in columns}
+        self.times, self.offsets = np.unique(times[order], return_index=True)
+        self.offsets = np.append(self.offsets, len(order))
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def frame(self, i: int) -> Dict[str, np.ndarray]:
+        """
+        Returns the steps of the i-th time step, as new data for ColumnDataSource.stream.
+        """
+
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return {column: values[start:end] for column, values in self.columns.items()}
+
+    def empty(self) -> Dict[str, np.ndarray]:
+        """
+        Returns no step, with the types of the columns, as the data of the playback source before the first frame.
+        """
+
+        return {column: values[:0] for column, values in self.columns.items()}
+
+    def rollover(self, i: int, trail_steps: int = TRAIL_STEPS) -> int:
+        """
+        Returns the number of rows kept by the playback source once the i-th frame is streamed, the frames being
+        streamed in order: the steps of the last trail_steps time steps, those of the hurricanes which ended before
+        are dropped.
+        """
+
+        return int(self.offsets[i + 1] - self.offsets[max(0, i + 1 - trail_steps)])
@@ -0,0 +1,79 @@
+"""
+Tracks of the hurricanes as a single line, for the 'lines' rendering of the tracks app.
+
+The 'segments' rendering draws a dashed segment and the two end points of every step, three glyphs per step. The
+'lines' rendering draws every track with one line glyph, the tracks separated by NaN coordinates, a single path for
+the canvas (the WebGL line of bokeh 2.0.2 stops at the first NaN, and it has no WebGL multi_line). Each point of the
+line carries the row of its step in the data of the table, which the hover looks the columns of the step up in.
+"""
+import numpy as np
+import pandas as pd
+
+
+RENDERINGS = ('segments', 'lines')
+
+# Columns of the data of the line
+LINE_COLUMNS = ('x_line', 'y_line', 'step')
+
+# Formatter of the hover of the line, `@step{column}` giving the column of the step in `source`, the source of the
+# table
+STEP_LOOKUP = """
+return value < 0 ? '' : String(source.data[format][value])
+"""
+
+
+def storm_offsets(ids: np.ndarray) -> np.ndarray:
+    """
+    Returns the offsets of the first step of each hurricane of ids, followed by len(ids). The steps of each
+    hurricane must be contiguous, as in the tracks DataFrame.
+    """
+
+    starts = np.flatnonzero(ids[1:] != ids[:-1]) + 1
+
+    return np.concatenate([[0], starts, [len(ids)]]).astype(np.int64)
+
+
+def storm_line(df: pd.DataFrame) -> dict:
+    """
+    Returns the data of a line source drawing the tracks of df, the tracks separated by NaN coordinates.
+
+    Parameters
+    ----------
+
+    df: pd.DataFrame
+        Steps of the tracks DataFrame, the steps of each hurricane contiguous and in order of time.
+
+    Return
+    ------
+
+    data: dict
+        x_line and y_line, the web mercator coordinates of the start of the steps of each hurricane and of the end
+        of its last step, followed by NaN, and step, the row in df of the step starting at each point (of the last
+        step for its end, -1 for the NaN).
+    """
+
+    if df.empty:
+        return {column: np.zeros(0, dtype=np.int32 if column == 'step' else np.float64) for column in LINE_COLUMNS}
+
+    offsets = storm_offsets(df['ID'].values)
+    last = offsets[1:] - 1
+
+    # Each hurricane takes its steps, the end of its last step and a NaN: the points of the hurricane i are shifted
+    # by 2 * i
+    n_storms = len(offsets) - 1
+    starts = np.arange(len(df)) + 2 * np.repeat(np.arange(n_storms), np.diff(offsets))
+    ends = last + 2 * np.arange(n_storms) + 1
+
+    data = dict()
+    for axis in ('x', 'y'):
+        values = np.full(len(df) + 2 * n_storms, np.nan)
+        values[starts] = df[axis + '_start'].values
+        values[ends] = df[axis + '_end'].values[last]
+        data[axis + '_line'] = values
+
+    step = np.full(len(df) + 2 * n_storms, -1, dtype=np.int32)
+    step[starts] = np.arange(len(df))
+    step[ends] = last
+    data['step'] = step
+
+    return data
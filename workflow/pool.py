@@ -0,0 +1,130 @@
+import time
+from collections import deque
+from threading import Condition, Thread
+from typing import Callable
+from bokeh.document import Document
+from workflow.metrics import REGISTRY, Counter, Gauge
+from workflow.versions import move_leases
+
+
+POOL_REQUESTS = REGISTRY.register(Counter(
+    'hurricanes_document_pool_requests_total',
+    'Number of sessions documents taken from the pool (hit) or built on the spot (miss).', ['app', 'result']))
+
+# Seconds without new sessions before the pool is refilled
+REFILL_QUIET_PERIOD = 0.5
+
+_pools = dict()
+
+
+class DocumentPool:
+    """
+    Documents of an app built in advance, by a background thread, and handed to the new sessions.
+
+    Building the figures and widgets of a document is most of the cost of opening a session. With a warm pool, a new
+    session only gets the roots of a ready document moved to its own, and the pool is refilled in the background.
+    Each pooled document has its own models, data source and callbacks, nothing is shared between sessions.
+
+    Parameters
+    ----------
+
+    app: str
+        Name of the bokeh app.
+    make_figure: Callable[[Document], None]
+        The function building the document of the app.
+    size: int
+        The number of documents kept ready.
+    """
+
+    def __init__(self, app: str, make_figure: Callable[[Document], None], size: int):
+        self.app = app
+        self.make_figure = make_figure
+        self.size = size
+        self._documents = deque()
+        self._condition = Condition()
+        self._last_taken = 0.0
+        _pools[app] = self
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def fill(self):
+        """
+        Builds documents until the pool is full.
+        """
+
+        while len(self._documents) < self.size:
+            self._add()
+
+    def flush(self):
+        """
+        Drops the documents ready, e.g. built with a version of the datasets replaced since, the pool is refilled with
+        new ones.
+        """
+
+        with self._condition:
+            self._documents.clear()
+            self._condition.notify()
+
+    def start(self):
+        """
+        Starts the thread refilling the pool as documents are taken from it.
+        """
+
+        Thread(target=self._refill, name='{}-document-pool'.format(self.app), daemon=True).start()
+
+    def populate(self, doc: Document):
+        """
+        Sets up doc as a new document of the app, with the roots of a pooled document if one is ready.
+        """
+
+        with self._condition:
+            template = self._documents.popleft() if self._documents else None
+            self._last_taken = time.monotonic()
+            self._condition.notify()
+
+        if template is None:
+            POOL_REQUESTS.inc(self.app, 'miss')
+            self.make_figure(doc)
+            return
+
+        POOL_REQUESTS.inc(self.app, 'hit')
+
+        roots = list(template.roots)
+        template.clear()
+
+        # The theme first, so that it is applied once, when the roots are added
+        doc.theme = template.theme
+        doc.title = template.title
+        for root in roots:
+            doc.add_root(root)
+
+        for callback in template.session_destroyed_callbacks:
+            doc.on_session_destroyed(callback)
+
+        move_leases(template, doc)
+
+    def _add(self):
+        doc = Document()
+        self.make_figure(doc)
+        with self._condition:
+            self._documents.append(doc)
+
+    def _refill(self):
+        while True:
+            with self._condition:
+                while len(self._documents) >= self.size:
+                    self._condition.wait()
+
+                # Waits for a burst of sessions to end, not to slow down their callbacks, unless the pool is empty
+                while self._documents and time.monotonic() - self._last_taken < REFILL_QUIET_PERIOD:
+                    self._condition.wait(REFILL_QUIET_PERIOD)
+            try:
+                self._add()
+            except Exception as e:
+                print('Building a {} document for the pool failed: {!r}'.format(self.app, e))
+                time.sleep(1.0)
+
+
+REGISTRY.register(Gauge('hurricanes_document_pool_size', 'Number of documents ready in the pool of each app.',
+                        ['app'], function=lambda: {(app,): len(pool) for app, pool in _pools.items()}))
@@ -1,42 +1,113 @@
 from tools.extraction_tools import extraction_pipeline
+from tools.chunking_tools import read_storm_chunks, write_chunk
 from tools.cleaning_tools import cleaning_pipeline
-from tools.features_engineering_tools import wgs84_to_web_mercator, zones, season
+from tools.features_engineering_tools import wgs84_to_web_mercator, season
+from tools.zones_tools import polygon_zones
+import os
 import pandas as pd
-from workflow.df_for_figures import create_start_end_df, create_full_tracks_df
+from workflow.climatology import build_climatology_tables
+from workflow.config import PREPROCESSING_CHUNK_ROWS, zones_file
+from workflow.df_for_figures import create_start_end_df, create_full_tracks_df, create_intervals_df
+from workflow.partitions import build_partitions
+from workflow.profiling import StageReport
+from workflow.resampling import resample_tracks_to_store, resample_tracks_to_writer
+from workflow.similarity import build_similarity_table
+from workflow.store import ColumnWriter
+
+
+def augment_tracks_chunks(file_path: str, augmented_path: str, files_dir: str, chunk_rows: int):
+    """
+    Adds the web mercator coordinates, the season and the zone of the tracks of file_path, and resamples them, chunk
+    after chunk, by whole hurricanes.
+    """
+
+    with ColumnWriter(files_dir + 'tracks_hourly/') as writer:
+        chunks = read_storm_chunks(file_path, chunk_rows, index_col=0, dtype={'Hour': str}, parse_dates=['Time'])
+        for i, df in enumerate(chunks):
+            df = wgs84_to_web_mercator(df=df)
+            df = season(df=df)
+            df = polygon_zones(df=df, zones_file=zones_file(files_dir))
+
+            write_chunk(df, augmented_path, first=i == 0)
+
+            resample_tracks_to_writer(df, writer, step_hours=1)
 
 
 if __name__ == '__main__':
 
     files_dir = '../files/'
 
-    extraction_pipeline(files_dir=files_dir)
+    # Wall time, CPU time and peak memory of each stage, printed at the end.
+    # Set HURRICANES_PROFILE=1 to also write a cProfile profile of each stage.
+    report = StageReport()
+
+    # Atlantic hurricanes, and those of the Eastern and Central Pacific if their file was downloaded as well
+    hurdat_names = ['hurdat2.txt'] + [name for name in ('hurdat2-nepac.txt',) if os.path.exists(files_dir + name)]
+
+    with report.stage('extraction_pipeline'):
+        extraction_pipeline(files_dir=files_dir, hurdat_name=hurdat_names)
+
+    # Set HURRICANES_PREPROCESSING_CHUNK_ROWS to process the tracks by chunks of hurricanes, in bounded memory.
+    chunk_rows = PREPROCESSING_CHUNK_ROWS
 
-    cleaning_pipeline(files_dir=files_dir)
+    with report.stage('cleaning_pipeline'):
+        cleaning_pipeline(files_dir=files_dir, chunk_rows=chunk_rows)
 
     file_name = 'df_tracks_after_1970.csv'
 
     file_path = files_dir + file_name
 
-    df = pd.read_csv(file_path, index_col=0, dtype={'Hour': str}, parse_dates=['Time'])
+    augmented_path = files_dir + 'df_tracks_augmented.csv'
 
-    print(df.info())
+    if chunk_rows:
+        # Hourly tracks, in a columnar store, written along with the augmented tracks
+        with report.stage('augment_tracks_chunks'):
+            augment_tracks_chunks(file_path, augmented_path, files_dir, chunk_rows)
 
-    df = wgs84_to_web_mercator(df=df)
+    else:
+        with report.stage('read_tracks_after_1970'):
+            df = pd.read_csv(file_path, index_col=0, dtype={'Hour': str}, parse_dates=['Time'])
 
-    df = season(df=df)
+        with report.stage('wgs84_to_web_mercator'):
+            df = wgs84_to_web_mercator(df=df)
 
-    df = zones(df=df)
+        with report.stage('season'):
+            df = season(df=df)
 
-    file_name = 'df_tracks_augmented.csv'
+        with report.stage('zones'):
+            df = polygon_zones(df=df, zones_file=zones_file(files_dir))
 
-    file_path = files_dir + file_name
+        with report.stage('save_tracks_augmented'):
+            df.to_csv(augmented_path)
+
+        # Hourly tracks, in a columnar store
+        with report.stage('resample_tracks'):
+            resample_tracks_to_store(df, directory=files_dir + 'tracks_hourly/', step_hours=1)
 
-    df.to_csv(file_path)
+        del df
 
-    create_full_tracks_df(file_path=file_path)
+    file_path = augmented_path
+
+    with report.stage('create_full_tracks_df'):
+        create_full_tracks_df(file_path=file_path, chunk_rows=chunk_rows)
 
     file_name = 'df_full_tracks_bokeh.csv'
 
     file_path = files_dir + file_name
 
-    create_start_end_df(file_path=file_path)
+    with report.stage('create_start_end_df'):
+        create_start_end_df(file_path=file_path, chunk_rows=chunk_rows)
+
+    with report.stage('create_intervals_df'):
+        create_intervals_df(file_path=file_path, chunk_rows=chunk_rows)
+
+    with report.stage('partition_tracks'):
+        build_partitions(files_dir=files_dir)
+
+    with report.stage('similar_tracks'):
+        build_similarity_table(files_dir=files_dir)
+
+    with report.stage('climatology'):
+        build_climatology_tables(files_dir=files_dir, chunk_rows=chunk_rows)
+
+    report.print_report()
@@ -0,0 +1,210 @@
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+import threading
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Tuple
+from workflow.config import PROFILE_ENABLED, PROFILE_DIR, PROFILE_INTERVAL, PROFILE_MAX_FILES
+
+
+class ProfilingState:
+    """
+    Whether profiling is on, and where the profiles are written. Shared by the bokeh and Flask threads.
+
+    Each callback of a session is profiled at most once every `interval` seconds, only in `session` if it is set, and
+    only the last `max_files` profiles are kept in `directory`.
+    """
+
+    def __init__(self, enabled: bool, directory: str, interval: float = PROFILE_INTERVAL,
+                 max_files: int = PROFILE_MAX_FILES):
+        self.enabled = enabled
+        self.directory = directory
+        self.interval = interval
+        self.max_files = max_files
+        self.session = None
+        self._last = dict()  # type: Dict[Tuple[str, str, str], float]
+        self._lock = threading.Lock()
+
+    def profiles(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if name.endswith('.prof'))
+
+    def sample(self, app: str, name: str, session: str) -> bool:
+        """
+        Returns whether to profile this call of the callback `name` of a session, and if so counts it.
+        """
+
+        if self.session is not None and session != self.session:
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last.get((app, name, session), -self.interval) < self.interval:
+                return False
+
+            # The sessions closed long ago are forgotten
+            if len(self._last) > 1000:
+                self._last = {key: last for key, last in self._last.items() if now - last < self.interval}
+            self._last[(app, name, session)] = now
+
+        return True
+
+    def prune(self):
+        """
+        Removes the oldest profiles, and their tags, beyond max_files.
+        """
+
+        profiles = self.profiles()
+        paths = [os.path.join(self.directory, name) for name in profiles]
+        paths.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0.0)
+
+        for path in paths[:max(0, len(paths) - self.max_files)]:
+            for file_path in (path, path[:-len('.prof')] + '.json'):
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    pass
+
+
+PROFILING = ProfilingState(PROFILE_ENABLED, PROFILE_DIR)
+
+# Callbacks calling other callbacks (e.g. tab_change) are only profiled once, by the outermost one.
+_active = threading.local()
+
+
+def widgets_values(doc) -> dict:
+    """
+    Returns the values of the named widgets of doc, i.e. the filters in use.
+    """
+
+    values = dict()
+
+    if doc is None:
+        return values
+
+    for root in doc.roots:
+        for model in root.references():
+            if model.name and hasattr(model, 'value'):
+                values[model.name] = model.value
+            elif model.name and hasattr(model, 'active'):
+                values[model.name] = model.active
+
+    return values
+
+
+def write_profile(profile: cProfile.Profile, tags: dict) -> str:
+    """
+    Writes a profile, readable with pstats or snakeviz, and its tags as a json file next to it.
+
+    Return
+    ------
+
+    path: str
+        The path of the profile.
+    """
+
+    os.makedirs(PROFILING.directory, exist_ok=True)
+
+    name = '{}-{}-{}-{}'.format(tags.get('app', 'pipeline'), tags['name'], tags.get('session', 'none'),
+                                time.strftime('%Y%m%dT%H%M%S')) + '-' + uuid.uuid4().hex[:6]
+    path = os.path.join(PROFILING.directory, name)
+
+    profile.dump_stats(path + '.prof')
+    with open(path + '.json', 'w') as f:
+        json.dump(tags, f, indent=2, default=str)
+
+    PROFILING.prune()
+
+    return path + '.prof'
+
+
+def profile_callback(app: str, name: str) -> Callable:
+    """
+    Decorator profiling a bokeh callback with cProfile when profiling is on.
+
+    Profiles are tagged with the app, the callback, the session id and the values of the widgets of the document.
+    When profiling is off, the only overhead is a boolean check. When it is on, the calls are sampled (see
+    ProfilingState).
+    """
+
+    def decorator(callback: Callable) -> Callable:
+
+        @wraps(callback)
+        def wrapper(*args, **kwargs):
+            if not PROFILING.enabled or getattr(_active, 'profiling', False):
+                return callback(*args, **kwargs)
+
+            from bokeh.io import curdoc
+            doc = curdoc()
+            session_context = getattr(doc, 'session_context', None)
+            session = session_context.id if session_context is not None else 'none'
+            if not PROFILING.sample(app, name, session):
+                return callback(*args, **kwargs)
+
+            profile = cProfile.Profile()
+            t_0 = time.perf_counter()
+            _active.profiling = True
+            try:
+                return profile.runcall(callback, *args, **kwargs)
+            finally:
+                _active.profiling = False
+                tags = {'app': app, 'name': name,
+                        'session': session,
+                        'duration': time.perf_counter() - t_0,
+                        'filters': widgets_values(doc)}
+                write_profile(profile, tags)
+
+        return wrapper
+
+    return decorator
+
+
+class StageReport:
+    """
+    Wall time, CPU time and peak memory of each stage of the preprocessing pipeline.
+
+    Stages are also profiled with cProfile when profiling is on.
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name: str):
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        # Python 3.9+. Before, the peak is the one since the tracing started, the stage itself unless the caller traces
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+        profile = cProfile.Profile() if PROFILING.enabled else None
+        wall, cpu = time.perf_counter(), time.process_time()
+
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+
+            _, peak = tracemalloc.get_traced_memory()
+            self.stages.append({'name': name, 'wall': time.perf_counter() - wall,
+                                'cpu': time.process_time() - cpu, 'peak_memory': peak})
+            if not tracing:
+                tracemalloc.stop()
+
+            if profile is not None:
+                write_profile(profile, dict(self.stages[-1]))
+
+    def print_report(self, file: Optional[object] = None):
+        print('{:<30} {:>10} {:>10} {:>14}'.format('Stage', 'Wall (s)', 'CPU (s)', 'Peak (MB)'), file=file)
+        for stage in self.stages:
+            print('{name:<30} {wall:>10.3f} {cpu:>10.3f} {peak:>14.1f}'
+                  .format(peak=stage['peak_memory'] / 1e6, **stage), file=file)
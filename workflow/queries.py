@@ -0,0 +1,221 @@
+import json
+import struct
+import numpy as np
+import pandas as pd
+from typing import Iterator, List, Optional, Sequence, Tuple
+from workflow.intervals import parse_day
+
+
+# Size of the chunks of the binary responses
+CHUNK_BYTES = 1024 ** 2
+
+# Datasets of /api/storms, named after the apps using them
+DATASETS = ('spawns', 'tracks')
+
+
+def select_storms(df: pd.DataFrame, years: Sequence[int], months: Optional[Sequence[int]] = None,
+                  zone: str = 'All', season: str = 'All', n: int = -1, per_storm: bool = False,
+                  ids: Optional[Sequence[str]] = None, basins: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    Returns the rows of df matching the filters of the apps widgets.
+
+    Parameters
+    ----------
+
+    df : pd.DataFrame
+        The start/end DataFrame (one row per hurricane) or the full tracks DataFrame (one row per step).
+    years : Sequence[int]
+        The bounds of the range of the years of the hurricanes start.
+    months : Optional[Sequence[int]]
+        The bounds of the range of the months of the hurricanes start, or None to keep every month.
+    zone : str
+        The zone of the hurricanes start, or 'All'.
+    season : str
+        The season of the hurricanes start, or 'All'.
+    n : int
+        The number of hurricanes randomly drawn among the matching ones, or -1 to keep all of them.
+        The draw is seeded, the same filters always return the same hurricanes.
+    per_storm : bool
+        Whether df has several rows per hurricane, drawn together.
+    ids : Optional[Sequence[str]]
+        The IDs of the hurricanes to choose from, e.g. the ones passing close to a place, or None for all of them.
+    basins : Optional[Sequence[str]]
+        The basins of the hurricanes (first two characters of their ID), or None for all of them.
+
+    Return
+    ------
+
+    df_temp : pd.DataFrame
+        The matching rows, in the order of df.
+    """
+
+    mask = (df['Year_start'] >= years[0]) & (df['Year_start'] <= years[1])
+
+    if months is not None:
+        mask &= (df['Month_start'] >= months[0]) & (df['Month_start'] <= months[1])
+
+    if zone != 'All':
+        mask &= df['Zones_start'] == zone
+
+    if season != 'All':
+        if 'Season_start' in df.columns:
+            mask &= df['Season_start'] == season
+        else:
+            # Tracks only have the season of each step
+            mask &= df.groupby('ID')['Season'].transform('first') == season
+
+    if ids is not None:
+        mask &= df['ID'].isin(ids)
+
+    if basins is not None:
+        mask &= df['ID'].str[:2].isin(basins)
+
+    df_temp = df.loc[mask]
+
+    if n == -1:
+        return df_temp
+
+    keys = df_temp.ID if per_storm else df_temp.index
+    candidates = keys.unique() if per_storm else keys
+
+    # For cases where there are not enough data points
+    n = min(n, len(candidates))
+
+    select_list = np.random.RandomState(42).choice(candidates, size=n, replace=False)
+
+    return df_temp.loc[keys.isin(select_list)]
+
+
+def parse_filters(args) -> Tuple[str, dict, List[str]]:
+    """
+    Parses the query string of /api/storms, e.g. ?dataset=tracks&years=1980,2000&months=6,9&zone=Atlantic&n=10,
+    ?near=25.76,-80.19,200 for the hurricanes passing within 200 km of Miami, ?dates=2005-09-01,2005-09-15 for
+    the hurricanes active during the first half of September 2005, ?basin=AL,EP for the hurricanes of the Atlantic
+    and Eastern Pacific basins, or ?bbox=-100,15,-80,30 for the hurricanes with a step in a viewport (longitude and
+    latitude bounds).
+
+    Parameters
+    ----------
+
+    args : Mapping[str, str]
+        The query string arguments.
+
+    Return
+    ------
+
+    dataset : str
+        'spawns' (one row per hurricane) or 'tracks' (one row per step of the hurricanes).
+    filters : dict
+        The keyword arguments of select_storms, 'near', the latitude, longitude and radius of a proximity query,
+        'dates', the first and last days of the period of activity, and 'bbox', the longitude and latitude bounds of a
+        viewport.
+    columns : List[str]
+        The requested columns, all of them if empty.
+
+    Raises
+    ------
+
+    ValueError
+        If an argument is invalid.
+    """
+
+    def int_range(name: str, default: List[int]) -> List[int]:
+        value = args.get(name)
+        if value is None:
+            return default
+        bounds = [int(bound) for bound in value.split(',')]
+        if len(bounds) != 2 or bounds[0] > bounds[1]:
+            raise ValueError('{} must be two increasing integers separated by a comma'.format(name))
+        return bounds
+
+    dataset = args.get('dataset', 'spawns')
+    if dataset not in DATASETS:
+        raise ValueError('dataset must be one of {}'.format(', '.join(DATASETS)))
+
+    filters = {'years': int_range('years', [0, 9999]),
+               'months': int_range('months', [1, 12]),
+               'zone': args.get('zone', 'All'),
+               'season': args.get('season', 'All'),
+               'n': int(args.get('n', '-1'))}
+    if filters['n'] < -1:
+        raise ValueError('n must be -1 (every hurricane) or a number of hurricanes')
+
+    if 'near' in args:
+        near = [float(value) for value in args['near'].split(',')]
+        if len(near) != 3 or not (-90 <= near[0] <= 90 and -180 <= near[1] <= 180) or near[2] <= 0:
+            raise ValueError('near must be a latitude, a longitude and a radius in km separated by commas')
+        filters['near'] = near
+
+    if 'dates' in args:
+        days = [parse_day(value) for value in args['dates'].split(',')]
+        if len(days) != 2 or days[0] > days[1]:
+            raise ValueError('dates must be two increasing days (YYYY-MM-DD) separated by a comma')
+        filters['dates'] = [day.isoformat() for day in days]
+
+    if 'basin' in args:
+        basins = [basin.strip().upper() for basin in args['basin'].split(',')]
+        if not all(len(basin) == 2 and basin.isalpha() for basin in basins):
+            raise ValueError('basin must be basin codes (e.g. AL, EP, CP) separated by commas')
+        filters['basins'] = basins
+
+    if 'bbox' in args:
+        bbox = [float(value) for value in args['bbox'].split(',')]
+        if len(bbox) != 4 or not (-180 <= bbox[0] <= bbox[2] <= 180 and -90 <= bbox[1] <= bbox[3] <= 90):
+            raise ValueError('bbox must be increasing longitude and latitude bounds (lon_min,lat_min,lon_max,lat_max) '
+                             'separated by commas')
+        filters['bbox'] = bbox
+
+    columns = [column for column in args.get('columns', '').split(',') if column]
+
+    return dataset, filters, columns
+
+
+def encode_column(values: pd.Series) -> Tuple[dict, np.ndarray]:
+    """
+    Returns the description of a column and its values as a little-endian array.
+
+    Numbers are sent as they are, dates as int64 nanoseconds since the epoch, and strings as int32 codes into the
+    list of their distinct values, given in the description.
+    """
+
+    description = {'name': values.name}
+
+    if values.dtype.kind == 'M':
+        array = values.values.astype('datetime64[ns]').view('<i8')
+        description['unit'] = 'ns'
+    elif values.dtype.kind in 'biuf':
+        array = values.values.astype(values.dtype.newbyteorder('<'))
+    else:
+        codes, categories = pd.factorize(values, sort=True)
+        array = codes.astype('<i4')
+        description['categories'] = [str(category) for category in categories]
+
+    description['dtype'] = array.dtype.str
+
+    return description, np.ascontiguousarray(array)
+
+
+def binary_columns(df: pd.DataFrame, meta: dict, chunk_bytes: int = CHUNK_BYTES) -> Iterator[bytes]:
+    """
+    Yields df in a binary columnar format, in chunks of at most chunk_bytes.
+
+    The stream starts with the length of a json header (uint32, little-endian), then the header, giving the number
+    of rows and the name, dtype and byte length of each column, and `meta`. The columns follow one after the other,
+    as raw little-endian arrays.
+    """
+
+    columns = []
+    arrays = []  # type: List[np.ndarray]
+    for name in df.columns:
+        description, array = encode_column(df[name])
+        description['bytes'] = array.nbytes
+        columns.append(description)
+        arrays.append(array)
+
+    header = json.dumps(dict(meta, rows=len(df), columns=columns)).encode()
+    yield struct.pack('<I', len(header)) + header
+
+    for array in arrays:
+        buffer = memoryview(array.view(np.uint8))
+        for start in range(0, len(buffer), chunk_bytes):
+            yield bytes(buffer[start:start + chunk_bytes])
@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+from typing import Iterator, Sequence
+from tools.features_engineering_tools import haversine_distance
+from workflow.spatial import MERCATOR_RATIO
+from workflow.store import ColumnWriter
+
+
+# Columns interpolated linearly between two observations
+LINEAR_COLUMNS = ('Max_Speed', 'Min_Pressure')
+
+# Maximal number of resampled rows computed at once, which bounds the memory used by the resampling
+MAX_ROWS = 2 ** 18
+
+
+def _to_vectors(lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    lon, lat = np.radians(lon), np.radians(lat)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=1)
+
+
+def slerp(lon_1: np.ndarray, lat_1: np.ndarray, lon_2: np.ndarray, lat_2: np.ndarray, fraction: np.ndarray):
+    """
+    Returns the points at `fraction` of the great circle arcs from (lon_1, lat_1) to (lon_2, lat_2), element-wise.
+    """
+
+    a, b = _to_vectors(lon_1, lat_1), _to_vectors(lon_2, lat_2)
+    omega = np.arccos(np.clip((a * b).sum(axis=1), -1.0, 1.0))
+    sin_omega = np.sin(omega)
+
+    # Points too close for the spherical formula are interpolated linearly, which is then as precise
+    close = sin_omega < 1e-9
+    sin_omega = np.where(close, 1.0, sin_omega)
+    weight_1 = np.where(close, 1 - fraction, np.sin((1 - fraction) * omega) / sin_omega)
+    weight_2 = np.where(close, fraction, np.sin(fraction * omega) / sin_omega)
+
+    p = weight_1[:, None] * a + weight_2[:, None] * b
+    lon = np.degrees(np.arctan2(p[:, 1], p[:, 0]))
+    lat = np.degrees(np.arctan2(p[:, 2], np.hypot(p[:, 0], p[:, 1])))
+
+    return lon, lat
+
+
+def resample_tracks(df: pd.DataFrame, step_hours: float = 1.0, columns: Sequence[str] = LINEAR_COLUMNS) -> pd.DataFrame:
+    """
+    Resamples the tracks of every hurricane of df every `step_hours`, from its first observation to its last one.
+
+    Positions are interpolated along the great circle between the two observations around each time, the columns of
+    `columns` linearly, and the status is the one of the last observation. All the hurricanes are resampled at
+    once: their observations are stored one after the other, with the offset of each hurricane in an array.
+
+    Parameters
+    ----------
+
+    df: pd.DataFrame
+        The tracks DataFrame, one row per observation, with the columns ID, Time, Status, Latitude, Longitude and
+        `columns`.
+    step_hours: float
+        The time step of the resampled tracks, in hours.
+    columns: Sequence[str]
+        The columns interpolated linearly.
+
+    Return
+    ------
+
+    df_resampled: pd.DataFrame
+        One row per hurricane and time step, with the ID, Time, Status, Latitude, Longitude, the web mercator x and y,
+        `columns`, the speed of the hurricane center (Translation_Speed, in km/h, until the next time step) and whether
+        the row is an observation (Observed).
+    """
+
+    df = df.sort_values(by=['ID', 'Time'], kind='stable')
+    codes, ids = pd.factorize(df['ID'])
+    seconds = df['Time'].values.astype('datetime64[s]').astype(np.int64)
+    step = int(round(step_hours * 3600))
+
+    # Observations of hurricane i are the rows offsets[i] to offsets[i + 1] - 1
+    offsets = np.searchsorted(codes, np.arange(len(ids) + 1))
+    first, last = offsets[:-1], offsets[1:] - 1
+
+    counts = (seconds[last] - seconds[first]) // step + 1
+    storms = np.repeat(np.arange(len(ids)), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    times = seconds[first][storms] + k * step
+
+    # The observation before each time, and the next one, in the same hurricane: times are sorted by hurricane, then
+    # time, like the keys of the observations
+    origin = seconds.min() if len(seconds) else 0
+    span = seconds.max() - origin + 1 if len(seconds) else 1
+    before = np.searchsorted(codes * span + (seconds - origin), storms * span + (times - origin), side='right') - 1
+    before = np.maximum(np.minimum(before, last[storms] - 1), first[storms])
+    after = np.minimum(before + 1, last[storms])
+
+    duration = seconds[after] - seconds[before]
+    fraction = np.where(duration > 0, (times - seconds[before]) / np.maximum(duration, 1), 0.0)
+
+    lon_values, lat_values = df['Longitude'].values, df['Latitude'].values
+    lon, lat = slerp(lon_values[before], lat_values[before], lon_values[after], lat_values[after], fraction)
+
+    df_resampled = pd.DataFrame({'ID': np.asarray(ids)[storms],
+                                 'Time': times.astype('datetime64[s]').astype('datetime64[ns]'),
+                                 'Status': df['Status'].values[np.where(times == seconds[after], after, before)],
+                                 'Latitude': lat,
+                                 'Longitude': lon,
+                                 'x': lon * MERCATOR_RATIO,
+                                 'y': np.log(np.tan((90 + lat) * np.pi / 360.0)) * 6378137})
+
+    for column in columns:
+        values = df[column].values.astype(float)
+        df_resampled[column] = values[before] + fraction * (values[after] - values[before])
+
+    # Speed until the next time step of the same hurricane
+    next_step = np.minimum(np.arange(len(times)) + 1, len(times) - 1)
+    same_storm = (storms[next_step] == storms) & (next_step > np.arange(len(times)))
+    distance = haversine_distance(lon, lat, lon[next_step], lat[next_step])
+    df_resampled['Translation_Speed'] = np.where(same_storm, distance / (step / 3600), np.nan)
+
+    df_resampled['Observed'] = (times == seconds[before]) | (times == seconds[after])
+
+    return df_resampled
+
+
+def storm_batches(df: pd.DataFrame, step_hours: float, max_rows: int = MAX_ROWS,
+                  columns: Sequence[str] = LINEAR_COLUMNS) -> Iterator[pd.DataFrame]:
+    """
+    Yields the observations of df, with the columns needed by resample_tracks, by batches of whole hurricanes whose
+    resampled tracks have at most max_rows rows (unless a single hurricane has more).
+    """
+
+    df = df[['ID', 'Time', 'Status', 'Latitude', 'Longitude'] + list(columns)].sort_values(by=['ID', 'Time'],
+                                                                                            kind='stable')
+    codes, ids = pd.factorize(df['ID'])
+    offsets = np.searchsorted(codes, np.arange(len(ids) + 1))
+
+    seconds = df['Time'].values.astype('datetime64[s]').astype(np.int64)
+    counts = (seconds[offsets[1:] - 1] - seconds[offsets[:-1]]) // int(round(step_hours * 3600)) + 1
+
+    start = 0
+    while start < len(ids):
+        # As many hurricanes as fit in max_rows, at least one
+        end = max(start + 1, int(np.searchsorted(np.cumsum(counts[start:]), max_rows, side='right')) + start)
+        yield df.iloc[offsets[start]:offsets[end]]
+        start = end
+
+
+def resample_tracks_to_store(df: pd.DataFrame, directory: str, step_hours: float = 1.0,
+                             max_rows: int = MAX_ROWS) -> int:
+    """
+    Resamples the tracks of df (see resample_tracks) by batches of hurricanes, and writes them to the columnar store
+    `directory`, so that the memory used does not depend on the number of hurricanes.
+
+    Return
+    ------
+
+    rows: int
+        The number of rows written.
+    """
+
+    with ColumnWriter(directory) as writer:
+        resample_tracks_to_writer(df, writer, step_hours, max_rows)
+
+    return writer.rows
+
+
+def resample_tracks_to_writer(df: pd.DataFrame, writer: ColumnWriter, step_hours: float = 1.0,
+                              max_rows: int = MAX_ROWS):
+    """
+    Resamples the tracks of df by batches of hurricanes, and appends them to an open columnar store, e.g. once for
+    each chunk of the tracks when they are not all in memory.
+    """
+
+    for batch in storm_batches(df, step_hours, max_rows):
+        writer.append(resample_tracks(batch, step_hours))
@@ -0,0 +1,232 @@
+"""
+Bookkeeping of the bokeh sessions of the process: their memory, their activity and their number.
+
+The DataFrames are shared by the sessions (see workflow/versions.py), but each session keeps the data of its sources,
+as long as its browser tab stays open. The sessions without user action for SESSION_IDLE_TIMEOUT seconds are evicted:
+their websocket is closed, and bokeh destroys them right after. Beyond MAX_SESSIONS open sessions, the new ones are
+refused with a message instead of the app.
+"""
+import time
+import weakref
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Iterable, List, Tuple
+from bokeh.document import Document
+from bokeh.models import ColumnDataSource, Div
+from workflow.config import MAX_SESSIONS, SESSION_IDLE_TIMEOUT
+from workflow.metrics import REGISTRY, Counter, Gauge, payload_bytes
+
+
+SESSIONS_EVICTED = REGISTRY.register(Counter(
+    'hurricanes_sessions_evicted_total', 'Number of bokeh sessions closed after SESSION_IDLE_TIMEOUT without action.',
+    ['app']))
+SESSIONS_REFUSED = REGISTRY.register(Counter(
+    'hurricanes_sessions_refused_total', 'Number of bokeh sessions refused beyond MAX_SESSIONS.', ['app']))
+
+# Seconds between the checks of the idle sessions
+EVICTION_PERIOD = 30.0
+
+REFUSED_TEXT = ('<h3>The server is busy</h3>'
+                '<p>Too many maps are open at the moment, please try again in a few minutes.</p>')
+
+
+def close_connections(server_session) -> bool:
+    """
+    Closes the websockets of the connections of a bokeh ServerSession, so that bokeh destroys it once it is expired:
+    bokeh only destroys the sessions without connections, and ServerConnection has no public way to close its
+    websocket.
+
+    The private attributes used are the ones of bokeh==2.0.2 (see requirements.txt). With other versions of bokeh,
+    where they may be missing, nothing is closed and False is returned.
+    """
+
+    try:
+        connections = list(server_session._subscribed_connections)
+        sockets = [connection._socket for connection in connections]
+    except (AttributeError, TypeError) as e:
+        print('The connections of the session {} cannot be closed: {!r}'.format(server_session.id, e))
+        return False
+
+    for socket in sockets:
+        socket.close()
+
+    return True
+
+
+class SessionRegistry:
+    """
+    The open sessions of the apps, with the time of their last user action.
+
+    Parameters
+    ----------
+
+    max_sessions: int
+        The number of sessions open at once, 0 for no limit.
+    idle_timeout: float
+        The seconds without user action after which a session is evicted, 0 to never evict them.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, idle_timeout: float = SESSION_IDLE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions = dict()  # type: Dict[Document, dict]
+        self._lock = Lock()
+        # Size of the data of each source, computed again only when its data is replaced
+        self._sizes = weakref.WeakKeyDictionary()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    @contextmanager
+    def open_session(self, app: str, doc: Document):
+        """
+        Context manager around the creation of the document of a new session: yields whether the session is
+        admitted, and then registers its document, or, beyond max_sessions, sets it up with a message asking to come
+        back later.
+        """
+
+        with self._lock:
+            admitted = not self.max_sessions or len(self._sessions) < self.max_sessions
+            if admitted:
+                self._sessions[doc] = {'app': app, 'last_action': time.monotonic(), 'sources': [], 'evicted': False}
+
+        if not admitted:
+            SESSIONS_REFUSED.inc(app)
+            doc.add_root(Div(text=REFUSED_TEXT))
+            doc.title = 'Hurricanes'
+            yield False
+            return
+
+        try:
+            yield True
+        except Exception:
+            self.release(doc)
+            raise
+
+        # The destroyed documents do not list their models any more
+        self._sessions[doc]['sources'] = list(doc.select({'type': ColumnDataSource}))
+
+        def document_changed(event):
+            # The changes made by the browser are set by the bokeh session, the others by the callbacks
+            if getattr(event, 'setter', None) is not None and doc in self._sessions:
+                self._sessions[doc]['last_action'] = time.monotonic()
+
+        doc.on_change(document_changed)
+        doc.on_session_destroyed(lambda session_context: self.release(doc))
+
+    def release(self, doc: Document):
+        """
+        Forgets the document of a destroyed session, and drops the data of its sources, which would otherwise stay
+        in memory until the garbage collection of its callbacks.
+        """
+
+        with self._lock:
+            session = self._sessions.pop(doc, None)
+
+        for source in session['sources'] if session is not None else []:
+            self._sizes.pop(source, None)
+            source.data = dict()
+
+    def memory(self, doc: Document) -> int:
+        """
+        Returns the bytes of the data of the sources of a session.
+        """
+
+        size = 0
+        for source in self._sessions.get(doc, {}).get('sources', []):
+            cached = self._sizes.get(source)
+            if cached is None or cached[0] is not source.data:
+                cached = (source.data, payload_bytes(source.data))
+                self._sizes[source] = cached
+            size += cached[1]
+
+        return size
+
+    def sessions_memory(self) -> Dict[Tuple[str, ...], float]:
+        """
+        Returns the bytes of the data of the sources of the open sessions of each app.
+        """
+
+        memory = dict()
+        for doc, session in list(self._sessions.items()):
+            key = (session['app'],)
+            memory[key] = memory.get(key, 0.0) + float(self.memory(doc))
+
+        return memory
+
+    def report(self) -> List[dict]:
+        """
+        Returns the app, the seconds since the last user action and the bytes of the sources of each open session.
+        """
+
+        now = time.monotonic()
+
+        return [{'app': session['app'], 'idle': round(now - session['last_action'], 1), 'bytes': self.memory(doc)}
+                for doc, session in list(self._sessions.items())]
+
+    def evict_idle(self, server_sessions: Iterable) -> int:
+        """
+        Closes the connections of the sessions without user action for idle_timeout seconds, which are then
+        destroyed by bokeh.
+
+        Parameters
+        ----------
+
+        server_sessions: Iterable[ServerSession]
+            The sessions of the bokeh server, e.g. server.get_sessions().
+
+        Return
+        ------
+
+        evicted: int
+            The number of sessions evicted.
+        """
+
+        if not self.idle_timeout:
+            return 0
+
+        now = time.monotonic()
+        evicted = 0
+        for server_session in list(server_sessions):
+            if server_session.destroyed:
+                continue
+
+            session = self._sessions.get(server_session.document)
+            if session is None or session['evicted'] or now - session['last_action'] < self.idle_timeout:
+                continue
+
+            # Tried once: without its connections closed, the session is only destroyed when its tab is closed
+            session['evicted'] = True
+            server_session.request_expiration()
+            if not close_connections(server_session):
+                continue
+
+            SESSIONS_EVICTED.inc(session['app'])
+            evicted += 1
+
+        return evicted
+
+    def start(self, server):
+        """
+        Checks the idle sessions of a bokeh server every EVICTION_PERIOD seconds, from its IO loop.
+        """
+
+        if not self.idle_timeout:
+            return
+
+        from tornado.ioloop import PeriodicCallback
+
+        def evict():
+            evicted = self.evict_idle(server.get_sessions())
+            if evicted:
+                print('Evicted {} sessions idle for more than {}s'.format(evicted, self.idle_timeout))
+
+        server.io_loop.add_callback(lambda: PeriodicCallback(evict, EVICTION_PERIOD * 1000).start())
+
+
+SESSIONS = SessionRegistry()
+
+REGISTRY.register(Gauge('hurricanes_sessions_memory_bytes', 'Bytes of the data of the sources of the open sessions.',
+                        ['app'], function=SESSIONS.sessions_memory))
+REGISTRY.register(Gauge('hurricanes_sessions_registered', 'Number of open sessions, bounded by MAX_SESSIONS.',
+                        function=lambda: {(): float(len(SESSIONS))}))
@@ -0,0 +1,282 @@
+"""
+Similar tracks search.
+
+Each track is resampled to a fixed number of points evenly spaced along its length, in web mercator coordinates, and
+tracks are compared by the root mean square distance between their points. The most similar tracks of every
+hurricane can be computed in advance, from the root of the repository, with
+
+    $ python -m workflow.similarity
+
+and are then only looked up, while the preprocessed files are the ones they were computed from.
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from typing import List, Optional, Tuple
+from workflow.config import FILES_DIR
+from workflow.store import read_columns, read_meta, write_columns
+from workflow.versions import versioned
+
+
+# Points per track, and number of similar tracks shown by the tracks app and kept in the table
+TRACK_POINTS = 32
+SIMILAR_COUNT = 10
+
+# Maximal number of coordinates differences computed at once, which bounds the memory used by the searches
+CHUNK_VALUES = 2 ** 22
+
+SIMILAR_DIR = 'similar_tracks/'
+
+
+def track_vectors(df: pd.DataFrame, n_points: int = TRACK_POINTS) -> Tuple[pd.Index, np.ndarray]:
+    """
+    Resamples the track of every hurricane of df to n_points points evenly spaced along its length.
+
+    All the tracks are resampled at once: their points are stored one after the other, with the offset of each
+    hurricane in an array.
+
+    Parameters
+    ----------
+
+    df: pd.DataFrame
+        The full tracks DataFrame, one row per step from (x_start, y_start) to (x_end, y_end), in web mercator
+        coordinates.
+    n_points: int
+        The number of points of the resampled tracks.
+
+    Return
+    ------
+
+    ids: pd.Index
+        The IDs of the hurricanes.
+    vectors: np.ndarray
+        One row per hurricane, the x then the y (in km) of the points of its resampled track.
+    """
+
+    df = df.sort_values(by=['ID', 'Time'], kind='stable')
+    codes, ids = pd.factorize(df['ID'])
+    offsets = np.searchsorted(codes, np.arange(len(ids) + 1))
+
+    # The points of the track: the start of each step, then the end of the last one
+    ends = offsets[1:] - 1
+    x = np.insert(df['x_start'].values, offsets[1:], df['x_end'].values[ends]) / 1000
+    y = np.insert(df['y_start'].values, offsets[1:], df['y_end'].values[ends]) / 1000
+    storms = np.insert(codes, offsets[1:], codes[ends])
+    point_offsets = offsets + np.arange(len(ids) + 1)
+    first, last = point_offsets[:-1], point_offsets[1:] - 1
+
+    # Length of the track from its start to each point
+    lengths = np.hypot(np.diff(x), np.diff(y))
+    lengths[last[:-1]] = 0.0
+    arc = np.concatenate([[0.0], np.cumsum(lengths)])
+    arc -= np.repeat(arc[first], last - first + 1)
+    total = arc[last]
+
+    # Position of the targets, at evenly spaced fractions of the length, among the points of their track
+    fractions = np.linspace(0.0, 1.0, n_points)
+    target_storms = np.repeat(np.arange(len(ids)), n_points)
+    targets = (total[:, None] * fractions[None, :]).ravel()
+
+    span = total.max() + 1.0 if len(total) else 1.0
+    before = np.searchsorted(storms * span + arc, target_storms * span + targets, side='right') - 1
+    before = np.maximum(np.minimum(before, last[target_storms] - 1), first[target_storms])
+    after = before + 1
+
+    step = arc[after] - arc[before]
+    weight = np.where(step > 0, (targets - arc[before]) / np.where(step > 0, step, 1.0), 0.0)
+    x_targets = x[before] + weight * (x[after] - x[before])
+    y_targets = y[before] + weight * (y[after] - y[before])
+
+    vectors = np.concatenate([x_targets.reshape(-1, n_points), y_targets.reshape(-1, n_points)], axis=1)
+
+    return ids, vectors.astype(np.float32)
+
+
+def nearest(queries: np.ndarray, vectors: np.ndarray, k: int,
+            exclude: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the k rows of vectors closest to each query, and their squared distances, sorted by distance.
+
+    The distances are computed by blocks of vectors, so that at most CHUNK_VALUES differences of coordinates are in
+    memory, and the k best of each block are merged with the ones of the previous blocks.
+
+    Parameters
+    ----------
+
+    queries: np.ndarray
+        The vectors searched for, one per row.
+    vectors: np.ndarray
+        The vectors searched in, one per row.
+    k: int
+        The number of neighbours of each query.
+    exclude: Optional[np.ndarray]
+        For each query, a row of vectors not to return (e.g. itself), or -1.
+    """
+
+    k = min(k, len(vectors) - (1 if exclude is not None else 0))
+    best = np.zeros((len(queries), 0), dtype=np.int64)
+    best_distances = np.zeros((len(queries), 0))
+    if k <= 0:
+        return best, best_distances
+
+    queries = queries.astype(np.float64)
+
+    block = max(1, CHUNK_VALUES // max(1, queries.size))
+    for start in range(0, len(vectors), block):
+        # From the differences, which are exact, rather than by expanding the squares
+        differences = vectors[None, start:start + block, :] - queries[:, None, :]
+        distances = np.einsum('ijk,ijk->ij', differences, differences)
+        rows = np.arange(start, start + distances.shape[1])
+        if exclude is not None:
+            distances[exclude[:, None] == rows[None, :]] = np.inf
+
+        candidates = np.concatenate([best, np.broadcast_to(rows, distances.shape)], axis=1)
+        distances = np.concatenate([best_distances, distances], axis=1)
+
+        kept = np.argpartition(distances, k - 1, axis=1)[:, :k] if distances.shape[1] > k else \
+            np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+        best = np.take_along_axis(candidates, kept, axis=1)
+        best_distances = np.take_along_axis(distances, kept, axis=1)
+
+    order = np.argsort(best_distances, axis=1, kind='stable')
+
+    return np.take_along_axis(best, order, axis=1), np.take_along_axis(best_distances, order, axis=1)
+
+
+class TrackSimilarityIndex:
+    """
+    The resampled tracks of the hurricanes, answering similar tracks queries.
+
+    Parameters
+    ----------
+
+    df: pd.DataFrame
+        The full tracks DataFrame (see track_vectors).
+    n_points: int
+        The number of points of the resampled tracks.
+    """
+
+    def __init__(self, df: pd.DataFrame, n_points: int = TRACK_POINTS):
+        self.n_points = n_points
+        self.ids, self.vectors = track_vectors(df, n_points)
+        self.table = None  # type: Optional[pd.DataFrame]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def top_k_table(self, k: int = SIMILAR_COUNT) -> pd.DataFrame:
+        """
+        Returns the k most similar tracks of every hurricane, as rows ID, Rank, Similar_ID and Distance.
+        """
+
+        tables = []
+        # By blocks of queries too, so that each block of queries is compared to a few blocks of tracks
+        block = max(1, CHUNK_VALUES // max(1, self.vectors.size))
+        for start in range(0, len(self.ids), block):
+            rows = np.arange(start, min(start + block, len(self.ids)))
+            neighbours, distances = nearest(self.vectors[rows], self.vectors, k, exclude=rows)
+            tables.append(self._rows(rows, neighbours, distances))
+
+        return pd.concat(tables, ignore_index=True)
+
+    def attach_table(self, table: pd.DataFrame):
+        """
+        Uses the similar tracks computed in advance by top_k_table, instead of computing them for each query.
+        """
+
+        self.table = table.set_index('ID').sort_values(['ID', 'Rank'])
+
+    def similar(self, storm_id: str, k: int = SIMILAR_COUNT) -> pd.DataFrame:
+        """
+        Returns the k tracks most similar to the one of the hurricane storm_id, with their Distance (the root mean
+        square distance between the points of the resampled tracks, in web mercator km).
+
+        Raises
+        ------
+
+        KeyError
+            If storm_id is not a hurricane of the index.
+        """
+
+        row = self.ids.get_loc(storm_id)
+
+        if self.table is not None and storm_id in self.table.index:
+            table = self.table.loc[[storm_id]]
+            if len(table) >= min(k, len(self.ids) - 1):
+                return table.iloc[:k][['Similar_ID', 'Distance']].rename(columns={'Similar_ID': 'ID'}) \
+                    .reset_index(drop=True)
+
+        neighbours, distances = nearest(self.vectors[[row]], self.vectors, k, exclude=np.array([row]))
+        df_similar = self._rows(np.array([row]), neighbours, distances)
+
+        return df_similar[['Similar_ID', 'Distance']].rename(columns={'Similar_ID': 'ID'})
+
+    def _rows(self, rows: np.ndarray, neighbours: np.ndarray, distances: np.ndarray) -> pd.DataFrame:
+        k = neighbours.shape[1]
+        ids = np.asarray(self.ids)
+
+        return pd.DataFrame({'ID': np.repeat(ids[rows], k),
+                             'Rank': np.tile(np.arange(1, k + 1), len(rows)),
+                             'Similar_ID': ids[neighbours.ravel()],
+                             'Distance': np.sqrt(distances.ravel() / self.n_points)})
+
+
+def build_similarity_table(files_dir: str = FILES_DIR, k: int = SIMILAR_COUNT, n_points: int = TRACK_POINTS) -> str:
+    """
+    Computes the k most similar tracks of every hurricane of the tracks dataset, and writes them to the columnar
+    store files_dir + SIMILAR_DIR, with the version of the preprocessed files.
+
+    Return
+    ------
+
+    directory: str
+        The directory of the store.
+    """
+
+    from workflow.datasets import dataset_version, load_tracks_df
+
+    index = TrackSimilarityIndex(load_tracks_df(files_dir=files_dir), n_points)
+    table = index.top_k_table(k)
+
+    directory = files_dir + SIMILAR_DIR
+    write_columns(table, directory, meta={'version': dataset_version(files_dir), 'k': k, 'n_points': n_points})
+
+    print('Similar tracks of {} hurricanes written to {}'.format(len(index), directory))
+
+    return directory
+
+
+@versioned
+def load_similarity_index(files_dir: str = FILES_DIR) -> TrackSimilarityIndex:
+    """
+    Builds the similar tracks index of the tracks dataset, once per version of the files, with the table computed in
+    advance if it is up to date.
+    """
+
+    from workflow.datasets import dataset_version, load_tracks_df
+
+    index = TrackSimilarityIndex(load_tracks_df(files_dir=files_dir))
+
+    directory = files_dir + SIMILAR_DIR
+    if os.path.exists(directory):
+        meta = read_meta(directory)
+        if meta.get('version') == dataset_version(files_dir) and meta.get('n_points') == index.n_points:
+            index.attach_table(read_columns(directory, mmap=False).astype({'ID': str, 'Similar_ID': str}))
+        else:
+            print('The similar tracks of {} are out of date, they are computed for each query'.format(directory))
+
+    return index
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files-dir', default=FILES_DIR, help='Directory of the preprocessed csv files.')
+    parser.add_argument('-k', type=int, default=SIMILAR_COUNT, help='Number of similar tracks of each hurricane.')
+    args = parser.parse_args(argv)
+
+    build_similarity_table(args.files_dir, args.k)
+
+
+if __name__ == '__main__':
+    main()
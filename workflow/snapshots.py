@@ -0,0 +1,280 @@
+"""
+Pre-rendered snapshots of the apps, for the most common filters.
+
+Most visitors only look at the default view. The pages of the apps display a snapshot rendered in advance when one
+matches the filters of the url, and open a live bokeh session at the first interaction.
+
+Snapshots are exported, from the root of the repository, with
+
+    $ python -m workflow.snapshots
+
+and are only served while the preprocessed files are the ones they were rendered from.
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+from threading import Lock
+from typing import Dict, List, Optional
+from urllib.parse import urlencode
+from workflow.config import FILES_DIR, SNAPSHOT_DIR, SNAPSHOTS_FILE
+from workflow.intervals import parse_day
+
+
+# Widgets whose values can be given in the url of the apps pages
+WIDGETS = {'spawns': ('select_number', 'select_zone', 'slider_year', 'slider_month', 'slider_dates',
+                      'select_number_season', 'select_zone_season', 'slider_year_season', 'select_season'),
+           'tracks': ('select_number', 'select_zone', 'slider_year', 'slider_month', 'slider_dates', 'text_near',
+                      'slider_radius', 'text_similar')}
+
+# Snapshots rendered when SNAPSHOTS_FILE is not set: the default views, and a few more hurricanes.
+DEFAULT_SNAPSHOTS = [{'app': 'spawns', 'filters': {}},
+                     {'app': 'spawns', 'filters': {'select_number': '10'}},
+                     {'app': 'spawns', 'filters': {'select_number': '20'}},
+                     {'app': 'spawns', 'filters': {'select_number': '-1'}},
+                     {'app': 'tracks', 'filters': {}},
+                     {'app': 'tracks', 'filters': {'select_number': '10'}},
+                     {'app': 'tracks', 'filters': {'select_number': '20'}}]
+
+INDEX_FILE = 'index.json'
+
+
+def widget_filters(app: str, args) -> Dict[str, str]:
+    """
+    Returns the widgets values given in the query string arguments `args`, e.g. ?select_number=10&slider_year=1980,2000
+    """
+
+    return {name: args[name] for name in WIDGETS[app] if name in args}
+
+
+def session_filters(app: str, doc) -> Dict[str, str]:
+    """
+    Returns the widgets values given in the url of the session of doc.
+    """
+
+    session_context = getattr(doc, 'session_context', None)
+    if session_context is None or session_context.request is None:
+        return dict()
+
+    arguments = {name: values[-1].decode() for name, values in session_context.request.arguments.items() if values}
+
+    return widget_filters(app, arguments)
+
+
+def apply_filters(doc, filters: Dict[str, str]):
+    """
+    Sets the widgets of doc to the values of filters, which runs their callbacks. Range sliders values are two
+    integers separated by a comma, or two days (YYYY-MM-DD) for the date range sliders, sliders values numbers, and
+    selects values one of their options. Invalid values are ignored, the widget keeps its default value.
+    """
+
+    for name, value in filters.items():
+        widget = doc.get_model_by_name(name)
+        default = widget.value
+        try:
+            parsed = parse_widget_value(widget, value)
+        except ValueError as e:
+            print('Invalid value {!r} for {}: {}'.format(value, name, e))
+            continue
+
+        try:
+            widget.value = parsed
+        except Exception as e:
+            # The callbacks of the widget failed with this value, which would make them fail until it is changed
+            print('Value {!r} of {} not applied: {!r}'.format(value, name, e))
+            widget.value = default
+
+
+def parse_widget_value(widget, value: str):
+    """
+    Returns the value of widget given in the url as `value` (see apply_filters).
+
+    Raises
+    ------
+
+    ValueError
+        If value is not a valid value of widget: not an option of a select, or out of the range of a slider.
+    """
+
+    from bokeh.models import DateRangeSlider, Select
+
+    if isinstance(widget, Select):
+        if value not in widget.options:
+            raise ValueError('not one of the options')
+        return value
+
+    if isinstance(widget, DateRangeSlider):
+        bounds = tuple(parse_day(bound) for bound in value.split(','))
+        start, end = as_day(widget.start), as_day(widget.end)
+    elif isinstance(widget.value, tuple):
+        bounds = tuple(int(bound) for bound in value.split(','))
+        start, end = widget.start, widget.end
+    elif isinstance(widget.value, (int, float)):
+        bounds = (float(value),)
+        start, end = widget.start, widget.end
+    else:
+        return value
+
+    expected = len(widget.value) if isinstance(widget.value, tuple) else 1
+    if len(bounds) != expected:
+        raise ValueError('expected {} values'.format(expected))
+    if list(bounds) != sorted(bounds):
+        raise ValueError('the bounds are not in increasing order')
+    if bounds[0] < start or bounds[-1] > end:
+        raise ValueError('out of the range {} to {}'.format(start, end))
+
+    return bounds if len(bounds) > 1 else bounds[0]
+
+
+def as_day(value) -> datetime.date:
+    """
+    Returns the day of a bound of a date range slider, a date, a datetime or milliseconds since the epoch.
+    """
+
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+
+    return datetime.datetime.utcfromtimestamp(value / 1000).date()
+
+
+def snapshot_key(app: str, filters: Dict[str, str]) -> str:
+    return app + '?' + urlencode(sorted(filters.items()))
+
+
+def render_snapshot(app: str, filters: Dict[str, str], files_dir: str = FILES_DIR) -> dict:
+    """
+    Returns the json_item of the document of the app set up with filters, to be displayed with
+    Bokeh.embed.embed_item.
+    """
+
+    from bokeh.document import Document
+    from bokeh.embed import json_item
+    from workflow.make_figures import make_start_end_figure, make_tracks_figure
+
+    make_figure = {'spawns': make_start_end_figure, 'tracks': make_tracks_figure}[app]
+
+    doc = Document()
+    make_figure(doc, files_dir=files_dir)
+    apply_filters(doc, filters)
+
+    # Bokeh warns that the python callbacks won't run in the snapshot, which is expected: the page opens a session
+    logger = logging.getLogger('bokeh.embed.util')
+    level = logger.level
+    logger.setLevel(logging.ERROR)
+    try:
+        return json_item(doc.roots[0], theme=doc.theme)
+    finally:
+        logger.setLevel(level)
+
+
+def export_snapshots(snapshots: List[dict], directory: str = SNAPSHOT_DIR, files_dir: str = FILES_DIR) -> dict:
+    """
+    Renders the snapshots and writes them in directory, with an index mapping their filters to their files.
+
+    Files are named after a hash of their content, so that they can be cached for good by the browsers.
+
+    Parameters
+    ----------
+
+    snapshots: List[dict]
+        The snapshots to render, as dicts with an 'app' ('spawns' or 'tracks') and 'filters', widgets values as in
+        the url of the apps pages.
+    directory: str
+        The directory to write the snapshots to.
+    files_dir: str
+        Path to the directory which contains the preprocessed csv files.
+
+    Return
+    ------
+
+    index: dict
+        The version of the preprocessed files, and the file of each snapshot.
+    """
+
+    from workflow.datasets import dataset_version
+
+    os.makedirs(directory, exist_ok=True)
+
+    index = {'version': dataset_version(files_dir), 'snapshots': dict()}
+
+    for snapshot in snapshots:
+        app, filters = snapshot['app'], {name: str(value) for name, value in snapshot.get('filters', {}).items()}
+
+        content = json.dumps(render_snapshot(app, filters, files_dir)).encode()
+        name = '{}-{}.json'.format(app, hashlib.sha1(content).hexdigest()[:16])
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(content)
+
+        index['snapshots'][snapshot_key(app, filters)] = name
+        print('Snapshot {} written to {} ({} bytes)'.format(snapshot_key(app, filters), name, len(content)))
+
+    # Written last and atomically, the server never sees an index pointing to missing files
+    tmp_path = os.path.join(directory, INDEX_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, os.path.join(directory, INDEX_FILE))
+
+    return index
+
+
+class SnapshotIndex:
+    """
+    The index of the exported snapshots, reloaded whenever it is rewritten.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = Lock()
+        self._mtime = None
+        self._index = {'version': None, 'snapshots': dict()}
+
+    def find(self, app: str, filters: Dict[str, str], version: str) -> Optional[str]:
+        """
+        Returns the file name of the snapshot of app with filters, if it was rendered from the version `version` of
+        the preprocessed files.
+        """
+
+        path = os.path.join(self.directory, INDEX_FILE)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+        with self._lock:
+            if mtime != self._mtime:
+                with open(path) as f:
+                    self._index = json.load(f)
+                self._mtime = mtime
+            index = self._index
+
+        if index['version'] != version:
+            return None
+
+        return index['snapshots'].get(snapshot_key(app, filters))
+
+
+SNAPSHOTS = SnapshotIndex(SNAPSHOT_DIR)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--snapshots', default=SNAPSHOTS_FILE,
+                        help='Json file listing the snapshots to render, as [{"app": ..., "filters": {...}}, ...].')
+    parser.add_argument('--output', default=SNAPSHOT_DIR, help='Directory to write the snapshots to.')
+    parser.add_argument('--files-dir', default=FILES_DIR, help='Directory of the preprocessed csv files.')
+    args = parser.parse_args(argv)
+
+    snapshots = DEFAULT_SNAPSHOTS
+    if args.snapshots:
+        with open(args.snapshots) as f:
+            snapshots = json.load(f)
+
+    export_snapshots(snapshots, args.output, args.files_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import math
+import numpy as np
+import pandas as pd
+from typing import Tuple
+from tools.features_engineering_tools import EARTH_RADIUS, haversine_distance
+from workflow.config import FILES_DIR
+from workflow.versions import versioned
+
+
+# Web mercator meters per degree of longitude
+MERCATOR_RATIO = 6378137 * np.pi / 180.0
+
+
+def wgs84_to_mercator(lon: float, lat: float) -> Tuple[float, float]:
+    """
+    Returns the web mercator coordinates of a point given by its longitude and latitude, clipped to the latitudes
+    of the maps.
+    """
+
+    lat = min(max(lat, -85.05), 85.05)
+
+    return lon * MERCATOR_RATIO, math.log(math.tan((90 + lat) * math.pi / 360.0)) * 6378137
+
+
+def mercator_to_wgs84(x: float, y: float) -> Tuple[float, float]:
+    """
+    Returns the longitude and latitude of a point given in web mercator coordinates, e.g. a tap on the maps.
+    """
+
+    lon = x / MERCATOR_RATIO
+    lat = math.degrees(2 * math.atan(math.exp(y / 6378137)) - math.pi / 2)
+
+    return lon, lat
+
+
+class TrackPointIndex:
+    """
+    Grid index of the observations of every hurricane, answering radius queries without scanning the whole archive.
+
+    Observations are bucketed in cells of `cell_degrees` of latitude and longitude, stored contiguously by cell with
+    the offset of each cell in an array. A query only computes the distance to the observations of the cells
+    overlapping the bounding box of the circle.
+
+    Parameters
+    ----------
+
+    df: pd.DataFrame
+        The full tracks DataFrame, one row per step from (Longitude_start, Latitude_start) to
+        (Longitude_end, Latitude_end).
+    cell_degrees: float
+        The size of the cells.
+    """
+
+    def __init__(self, df: pd.DataFrame, cell_degrees: float = 1.0):
+        self.cell_degrees = cell_degrees
+        self.n_lat = int(math.ceil(180 / cell_degrees))
+        self.n_lon = int(math.ceil(360 / cell_degrees))
+
+        # Both ends of each step: the last observation of a hurricane is only the end of its last step
+        lon = np.concatenate([df['Longitude_start'].values, df['Longitude_end'].values])
+        lat = np.concatenate([df['Latitude_start'].values, df['Latitude_end'].values])
+        codes, self.ids = pd.factorize(df['ID'])
+        storms = np.tile(codes, 2)
+        times = np.tile(df['Time'].values, 2)
+
+        cells = self._lat_index(lat) * self.n_lon + self._lon_index(lon)
+        order = np.argsort(cells, kind='stable')
+
+        self.lon, self.lat, self.storms, self.times = lon[order], lat[order], storms[order], times[order]
+        self.offsets = np.searchsorted(cells[order], np.arange(self.n_lat * self.n_lon + 1))
+
+    def __len__(self) -> int:
+        return len(self.lon)
+
+    def _lat_index(self, lat):
+        return np.clip(np.floor((np.asarray(lat) + 90) / self.cell_degrees).astype(int), 0, self.n_lat - 1)
+
+    def _lon_index(self, lon):
+        return np.floor(((np.asarray(lon) + 180) % 360) / self.cell_degrees).astype(int) % self.n_lon
+
+    def _candidate_cells(self, lon: float, lat: float, radius: float) -> np.ndarray:
+        d_lat = math.degrees(radius / EARTH_RADIUS)
+        rows = np.arange(self._lat_index(lat - d_lat), self._lat_index(lat + d_lat) + 1)
+
+        # Widest longitude span of the circle, at the latitude of the box closest to a pole
+        max_lat = min(abs(lat) + d_lat, 90.0)
+        if max_lat >= 89.0 or d_lat >= 90.0:
+            columns = np.arange(self.n_lon)
+        else:
+            d_lon = d_lat / math.cos(math.radians(max_lat))
+            if d_lon >= 180.0:
+                columns = np.arange(self.n_lon)
+            else:
+                first = int(math.floor((lon - d_lon + 180) / self.cell_degrees))
+                last = int(math.floor((lon + d_lon + 180) / self.cell_degrees))
+                columns = np.unique(np.arange(first, last + 1) % self.n_lon)
+
+        return (rows[:, None] * self.n_lon + columns[None, :]).ravel()
+
+    def query(self, lon: float, lat: float, radius: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the positions, in the index, of the observations within `radius` km of (lon, lat), and their
+        distances.
+        """
+
+        cells = self._candidate_cells(lon, lat, radius)
+        starts, ends = self.offsets[cells], self.offsets[cells + 1]
+        lengths = ends - starts
+
+        # Concatenation of the ranges [start, end) of the cells
+        total = lengths.sum()
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+
+        distances = haversine_distance(lon, lat, self.lon[positions], self.lat[positions])
+        within = distances <= radius
+
+        return positions[within], distances[within]
+
+    def storms_within(self, lon: float, lat: float, radius: float) -> pd.DataFrame:
+        """
+        Returns the hurricanes with an observation within `radius` km of (lon, lat), with their closest approach.
+
+        Parameters
+        ----------
+
+        lon: float
+            The longitude of the center.
+        lat: float
+            The latitude of the center.
+        radius: float
+            The radius, in km.
+
+        Return
+        ------
+
+        df_near: pd.DataFrame
+            One row per hurricane: its ID, the distance (in km), time and position of its closest observation,
+            sorted by distance.
+        """
+
+        positions, distances = self.query(lon, lat, radius)
+
+        # The closest observation of each hurricane is the first one once sorted by hurricane, then distance
+        order = np.lexsort((distances, self.storms[positions]))
+        positions, distances = positions[order], distances[order]
+        first = np.ones(len(positions), dtype=bool)
+        first[1:] = self.storms[positions][1:] != self.storms[positions][:-1]
+        positions, distances = positions[first], distances[first]
+
+        df_near = pd.DataFrame({'ID': np.asarray(self.ids)[self.storms[positions]],
+                                'Closest_distance': distances,
+                                'Closest_time': self.times[positions],
+                                'Closest_latitude': self.lat[positions],
+                                'Closest_longitude': self.lon[positions]})
+
+        return df_near.sort_values('Closest_distance').reset_index(drop=True)
+
+
+@versioned
+def load_track_index(files_dir: str = FILES_DIR) -> TrackPointIndex:
+    """
+    Builds the index of the observations of the tracks dataset, once per version of the files.
+    """
+
+    from workflow.datasets import load_tracks_df
+
+    return TrackPointIndex(load_tracks_df(files_dir=files_dir))
+
+
+def parse_center(value: str) -> Tuple[float, float]:
+    """
+    Parses a position given as "latitude, longitude" in degrees.
+
+    Raises
+    ------
+
+    ValueError
+        If value is not a valid position.
+    """
+
+    lat, lon = (float(coordinate) for coordinate in value.split(','))
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError('{} is not a valid position'.format(value))
+
+    return lat, lon
@@ -0,0 +1,68 @@
+import time
+from contextlib import contextmanager
+from threading import Event, Lock
+from typing import Dict, Optional
+
+
+class Startup:
+    """
+    Keeps track of the startup sequence of the app: timing of each phase, readiness and failure.
+
+    A phase is timed with the `phase` context manager. The app is ready once `mark_ready` is called,
+    and is considered failed if a phase raises.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.phases = {}  # type: Dict[str, float]
+        self.current = None  # type: Optional[str]
+        self.error = None  # type: Optional[str]
+        self._ready = Event()
+        self._lock = Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Times the enclosed block and records it under `name`. Exceptions are recorded, then re-raised.
+        """
+
+        with self._lock:
+            self.current = name
+        t_0 = time.perf_counter()
+
+        try:
+            yield
+        except Exception as e:
+            with self._lock:
+                self.error = '{}: {!r}'.format(name, e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - t_0
+            with self._lock:
+                self.phases[name] = elapsed
+                self.current = None
+            print('Startup phase {} took {:.3f}s'.format(name, elapsed))
+
+    def mark_ready(self):
+        self._ready.set()
+        print('Startup done in {:.3f}s'.format(time.time() - self.started_at))
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set() and self.error is None
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def report(self) -> dict:
+        """
+        Returns the state of the startup sequence as a json-serializable dictionary.
+        """
+
+        with self._lock:
+            return {'ready': self.ready,
+                    'failed': self.error is not None,
+                    'error': self.error,
+                    'current_phase': self.current,
+                    'phases': {name: round(elapsed, 6) for name, elapsed in self.phases.items()},
+                    'uptime': round(time.time() - self.started_at, 3)}
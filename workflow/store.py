@@ -0,0 +1,169 @@
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Sequence
+
+# Description of the columns of a store, written last
+COLUMNS_FILE = 'columns.json'
+
+
+class ColumnWriter:
+    """
+    Writes a DataFrame to a columnar store, chunk after chunk, so that it never has to be in memory all at once.
+
+    A store is a directory with one file per column, holding its values as a raw little-endian array, and a json
+    description of the columns, as in the binary format of /api/storms: dates are int64 nanoseconds since the epoch and
+    strings int32 codes into the list of their distinct values. The store is written in a temporary directory, which
+    replaces the previous store when the writer is closed.
+
+    Parameters
+    ----------
+
+    directory: str
+        The directory of the store.
+    meta: Optional[dict]
+        Information saved with the description of the columns, e.g. the version of the data it was computed from.
+    """
+
+    def __init__(self, directory: str, meta: Optional[dict] = None):
+        self.directory = directory.rstrip('/')
+        self.meta = meta or dict()
+        self.tmp_directory = self.directory + '.tmp'
+        self.rows = 0
+        self.columns = None  # type: Optional[List[dict]]
+        self._categories = dict()  # type: Dict[str, Dict[str, int]]
+
+        shutil.rmtree(self.tmp_directory, ignore_errors=True)
+        os.makedirs(self.tmp_directory)
+
+    def __enter__(self) -> 'ColumnWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            shutil.rmtree(self.tmp_directory, ignore_errors=True)
+
+    def append(self, df: pd.DataFrame):
+        """
+        Appends the rows of df, which must have the columns of the first chunk, with the same types.
+        """
+
+        if self.columns is None:
+            self.columns = [self._describe(df[name]) for name in df.columns]
+
+        for description in self.columns:
+            array = self._encode(df[description['name']], description)
+            with open(os.path.join(self.tmp_directory, description['name']), 'ab') as f:
+                f.write(np.ascontiguousarray(array).tobytes())
+
+        self.rows += len(df)
+
+    def close(self):
+        """
+        Writes the description of the columns and replaces the previous store.
+        """
+
+        columns = []
+        for description in self.columns or []:
+            if 'categories' in description:
+                description = dict(description, categories=list(self._categories[description['name']]))
+            columns.append(description)
+
+        with open(os.path.join(self.tmp_directory, COLUMNS_FILE), 'w') as f:
+            json.dump({'rows': self.rows, 'columns': columns, 'meta': self.meta}, f, indent=2)
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.replace(self.tmp_directory, self.directory)
+
+    @staticmethod
+    def _describe(values: pd.Series) -> dict:
+        if values.dtype.kind == 'M':
+            return {'name': values.name, 'dtype': '<i8', 'unit': 'ns'}
+        if values.dtype.kind in 'biuf':
+            return {'name': values.name, 'dtype': values.dtype.newbyteorder('<').str}
+
+        return {'name': values.name, 'dtype': '<i4', 'categories': []}
+
+    def _encode(self, values: pd.Series, description: dict) -> np.ndarray:
+        if 'unit' in description:
+            return values.values.astype('datetime64[ns]').view('<i8')
+        if 'categories' not in description:
+            return values.values.astype(description['dtype'])
+
+        # The codes of the values already seen are kept, the new values are appended to the categories
+        categories = self._categories.setdefault(description['name'], dict())
+        codes, uniques = pd.factorize(values)
+        mapping = np.array([categories.setdefault(str(value), len(categories)) for value in uniques], dtype='<i4')
+
+        return np.where(codes < 0, -1, mapping[codes] if len(mapping) else codes).astype('<i4')
+
+
+def write_columns(df: pd.DataFrame, directory: str, meta: Optional[dict] = None):
+    """
+    Writes df to the columnar store `directory` at once (see ColumnWriter).
+    """
+
+    with ColumnWriter(directory, meta) as writer:
+        writer.append(df)
+
+
+def read_meta(directory: str) -> dict:
+    """
+    Returns the information saved with a columnar store.
+    """
+
+    with open(os.path.join(directory.rstrip('/'), COLUMNS_FILE)) as f:
+        return json.load(f).get('meta', dict())
+
+
+def read_columns(directory: str, columns: Optional[Sequence[str]] = None, mmap: bool = True) -> pd.DataFrame:
+    """
+    Reads a columnar store written by ColumnWriter.
+
+    Parameters
+    ----------
+
+    directory: str
+        The directory of the store.
+    columns: Optional[Sequence[str]]
+        The columns to read, or None to read all of them. Only their files are read.
+    mmap: bool
+        Whether to map the numeric columns from the files instead of reading them, the pages of the files are then only
+        loaded as they are accessed.
+
+    Return
+    ------
+
+    df: pd.DataFrame
+        The content of the store, strings as categoricals.
+    """
+
+    directory = directory.rstrip('/')
+    with open(os.path.join(directory, COLUMNS_FILE)) as f:
+        description = json.load(f)
+
+    data = dict()
+    for column in description['columns']:
+        if columns is not None and column['name'] not in columns:
+            continue
+
+        path = os.path.join(directory, column['name'])
+        if description['rows'] == 0:
+            array = np.zeros(0, dtype=column['dtype'])
+        elif mmap:
+            array = np.memmap(path, dtype=column['dtype'], mode='r')
+        else:
+            array = np.fromfile(path, dtype=column['dtype'])
+
+        if 'unit' in column:
+            data[column['name']] = pd.to_datetime(np.asarray(array).view('datetime64[ns]'))
+        elif 'categories' in column:
+            data[column['name']] = pd.Categorical.from_codes(np.asarray(array), categories=column['categories'])
+        else:
+            data[column['name']] = array
+
+    return pd.DataFrame(data, columns=[column for column in (columns or data) if column in data])
@@ -0,0 +1,226 @@
+import hashlib
+import math
+import os
+import urllib.request
+from collections import OrderedDict
+from threading import Lock
+from typing import Iterator, List, Optional, Tuple
+from workflow.metrics import REGISTRY, Counter, Gauge
+
+
+# Half of the circumference of the earth in web mercator meters.
+ORIGIN_SHIFT = 6378137 * math.pi
+
+MAX_ZOOM = 20
+
+TILE_REQUESTS = REGISTRY.register(Counter(
+    'hurricanes_tile_requests_total', 'Number of map tiles served by the tile proxy, by cache result.', ['result']))
+
+
+class TileCache:
+    """
+    An on-disk cache of map tiles fetched from an upstream WMTS server, bounded in size.
+
+    Tiles are evicted in least recently used order. The access order survives restarts through the files
+    modification times.
+
+    Parameters
+    ----------
+
+    directory: str
+        The directory containing the cached tiles.
+    max_bytes: int
+        The maximal size of the cached tiles.
+    upstream_url: str
+        The url template of the upstream server, with {Z}, {X} and {Y} placeholders.
+    timeout: float
+        Timeout of the requests to the upstream server, in seconds.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, upstream_url: str, timeout: float = 10.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.upstream_url = upstream_url
+        self.timeout = timeout
+
+        self._lock = Lock()
+        self._index = OrderedDict()  # file name -> (size, etag), in access order
+        self._size = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+        files = [entry for entry in os.scandir(directory) if entry.is_file() and entry.name.endswith('.png')]
+        for entry in sorted(files, key=lambda e: e.stat().st_mtime):
+            self._index[entry.name] = (entry.stat().st_size, None)
+            self._size += entry.stat().st_size
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def get(self, z: int, x: int, y: int) -> Tuple[bytes, str]:
+        """
+        Returns a tile and its ETag, from the cache or else from the upstream server.
+
+        Raises
+        ------
+
+        ValueError
+            If the tile coordinates are out of range.
+        OSError
+            If the tile is not cached and the upstream server can't be reached.
+        """
+
+        if not (0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise ValueError('Tile {}/{}/{} out of range'.format(z, x, y))
+
+        name = '{}-{}-{}.png'.format(z, x, y)
+        path = os.path.join(self.directory, name)
+
+        with self._lock:
+            cached = self._index.get(name)
+            if cached is not None:
+                self._index.move_to_end(name)
+
+        if cached is not None:
+            try:
+                with open(path, 'rb') as f:
+                    content = f.read()
+                os.utime(path)
+            except OSError:
+                # Evicted, or removed from the disk, in the meantime
+                cached = None
+            else:
+                etag = cached[1] or self._etag(content)
+                with self._lock:
+                    if name in self._index:
+                        self._index[name] = (len(content), etag)
+                TILE_REQUESTS.inc('hit')
+                return content, etag
+
+        try:
+            content = self._fetch(z, x, y)
+        except OSError:
+            TILE_REQUESTS.inc('error')
+            raise
+        TILE_REQUESTS.inc('miss')
+        etag = self._etag(content)
+
+        tmp_path = path + '.{}.tmp'.format(os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            previous = self._index.pop(name, None)
+            if previous is not None:
+                self._size -= previous[0]
+            self._index[name] = (len(content), etag)
+            self._size += len(content)
+            evicted = self._evict()
+
+        for old_name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old_name))
+            except OSError:
+                pass
+
+        return content, etag
+
+    def prefetch(self, tiles: Iterator[Tuple[int, int, int]]) -> int:
+        """
+        Fetches tiles into the cache. Stops at the first tile that can't be fetched, the upstream server being most
+        likely unreachable.
+
+        Return
+        ------
+
+        count: int
+            The number of tiles now in the cache.
+        """
+
+        count = 0
+
+        for z, x, y in tiles:
+            try:
+                self.get(z, x, y)
+            except OSError as e:
+                print('Prefetch of tile {}/{}/{} failed, stopping: {!r}'.format(z, x, y, e))
+                break
+            count += 1
+
+        return count
+
+    def _evict(self) -> List[str]:
+        # Must be called with the lock held. Keeps at least the most recent tile.
+        evicted = []
+        while self._size > self.max_bytes and len(self._index) > 1:
+            name, (size, _) = self._index.popitem(last=False)
+            self._size -= size
+            evicted.append(name)
+        return evicted
+
+    def _fetch(self, z: int, x: int, y: int) -> bytes:
+        url = self.upstream_url.replace('{Z}', str(z)).replace('{X}', str(x)).replace('{Y}', str(y))
+        request = urllib.request.Request(url, headers={'User-Agent': 'hurricanes_visualization tile proxy'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return response.read()
+
+    @staticmethod
+    def _etag(content: bytes) -> str:
+        return '"{}"'.format(hashlib.sha1(content).hexdigest())
+
+
+def tiles_covering(x_range: Tuple[float, float], y_range: Tuple[float, float],
+                   max_zoom: int, min_zoom: int = 0) -> Iterator[Tuple[int, int, int]]:
+    """
+    Yields the (z, x, y) coordinates of the tiles covering a web mercator extent, for each zoom level.
+
+    Parameters
+    ----------
+
+    x_range : Tuple[float, float]
+        The web mercator x boundaries of the extent.
+    y_range : Tuple[float, float]
+        The web mercator y boundaries of the extent.
+    max_zoom : int
+        The highest zoom level.
+    min_zoom : int
+        The lowest zoom level.
+    """
+
+    def clip(value: float) -> float:
+        return min(max(value, -ORIGIN_SHIFT), ORIGIN_SHIFT * (1 - 1e-12))
+
+    for z in range(min_zoom, max_zoom + 1):
+        n = 2 ** z
+        x_min, x_max = [int((clip(x) + ORIGIN_SHIFT) / (2 * ORIGIN_SHIFT) * n) for x in sorted(x_range)]
+        # Tile rows are numbered from the north
+        y_min, y_max = [int((ORIGIN_SHIFT - clip(y)) / (2 * ORIGIN_SHIFT) * n) for y in sorted(y_range, reverse=True)]
+
+        for x in range(x_min, x_max + 1):
+            for y in range(y_min, y_max + 1):
+                yield z, x, y
+
+
+_cache = None  # type: Optional[TileCache]
+_cache_lock = Lock()
+
+
+def get_tile_cache() -> TileCache:
+    """
+    Returns the tile cache of the process, created on first use from the configuration.
+    """
+
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            from workflow.config import TILE_CACHE_DIR, TILE_CACHE_BYTES, TILE_UPSTREAM_URL
+            _cache = TileCache(TILE_CACHE_DIR, TILE_CACHE_BYTES, TILE_UPSTREAM_URL)
+
+    return _cache
+
+
+REGISTRY.register(Gauge('hurricanes_tile_cache_bytes', 'Size of the map tiles cached on disk.',
+                        function=lambda: {(): _cache.size} if _cache is not None else dict()))
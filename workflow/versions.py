@@ -0,0 +1,437 @@
+"""
+Versions of the datasets, reloaded without restarting the server.
+
+The datasets and indexes built from the preprocessed files are cached per version of the files, instead of once per
+process. A watcher thread polls the version of the files written by preprocessing.py. Once the new version has been
+stable for a poll interval, it is loaded in the background, validated, and swapped in for the new sessions and
+queries. The sessions keep the version they started with until their next callback, then move to the new one. A
+version is freed once no session holds it any more.
+"""
+import json
+import os
+import threading
+import time
+import weakref
+import pandas as pd
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, List, Optional
+from workflow.config import FILES_DIR
+from workflow.metrics import REGISTRY, Counter, Gauge
+
+
+RELOADS = REGISTRY.register(Counter(
+    'hurricanes_dataset_reloads_total', 'Number of new versions of the datasets loaded, or rejected.', ['result']))
+
+# Loaders cached per version, in the order of their definition, all loaded before a version is swapped in
+LOADERS = []  # type: List[Callable]
+
+# Checks of a new version waiting for the files derived from the csv files (partitions, similar tracks and
+# climatology) to be written for it, before loading it with the outdated ones
+DERIVED_CHECKS = 10
+
+_local = threading.local()
+_stores = dict()  # type: Dict[str, DatasetStore]
+_versions = weakref.WeakSet()
+_documents_leases = weakref.WeakKeyDictionary()
+
+
+class DatasetVersion:
+    """
+    The datasets and indexes of one version of the preprocessed files.
+
+    Parameters
+    ----------
+
+    files_dir: str
+        Path to the directory which contains the preprocessed files.
+    version: str
+        The version of the files (see dataset_version).
+    """
+
+    def __init__(self, files_dir: str, version: str):
+        self.files_dir = files_dir
+        self.version = version
+        self.objects = dict()
+        self.leases = weakref.WeakSet()
+        self.freed = False
+        self._lock = threading.RLock()
+        _versions.add(self)
+
+    def get(self, name: str, build: Callable):
+        """
+        Returns the object `name` of this version, built once with the loaders reading this version, or of the version
+        in service if this one was freed: its files were replaced.
+        """
+
+        if self.freed:
+            return dataset_store(self.files_dir).current.get(name, build)
+
+        with self._lock:
+            if name not in self.objects:
+                with pinned(self):
+                    self.objects[name] = build()
+            return self.objects[name]
+
+    def load(self):
+        """
+        Builds every dataset and index of LOADERS.
+        """
+
+        with pinned(self):
+            for loader in LOADERS:
+                loader(self.files_dir)
+
+    def free(self):
+        with self._lock:
+            self.freed = True
+            self.objects.clear()
+
+
+@contextmanager
+def pinned(version: DatasetVersion):
+    """
+    Context manager making the loaders called by the thread return the objects of `version`.
+    """
+
+    previous = getattr(_local, 'version', None)
+    _local.version = version
+    try:
+        yield version
+    finally:
+        _local.version = previous
+
+
+def versioned(loader: Callable) -> Callable:
+    """
+    Decorator caching the result of a loader taking the files directory, like lru_cache, but per version of the
+    files: in the version pinned by the thread (the one of the session or of the version being loaded), or else in
+    the version in service.
+    """
+
+    name = '{}.{}'.format(loader.__module__, loader.__name__)
+
+    @wraps(loader)
+    def wrapper(files_dir: str = FILES_DIR):
+        version = getattr(_local, 'version', None)
+        if version is None or version.files_dir != files_dir:
+            version = dataset_store(files_dir).current
+
+        return version.get(name, lambda: loader(files_dir))
+
+    def cache_clear():
+        for version in list(_versions):
+            with version._lock:
+                version.objects.pop(name, None)
+
+    wrapper.cache_clear = cache_clear
+    wrapper.cache_name = name
+    LOADERS.append(wrapper)
+
+    return wrapper
+
+
+class DatasetStore:
+    """
+    The version of the datasets in service for a files directory, and its replacement by newer versions.
+
+    Parameters
+    ----------
+
+    files_dir: str
+        Path to the directory which contains the preprocessed files.
+    """
+
+    def __init__(self, files_dir: str):
+        self.files_dir = files_dir
+        self._current = None  # type: Optional[DatasetVersion]
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._seen = None  # type: Optional[str]
+        self._checks = 0
+        self._rejected = None  # type: Optional[str]
+        self._listeners = []  # type: List[Callable[[DatasetVersion], None]]
+
+    @property
+    def current(self) -> DatasetVersion:
+        if self._current is None:
+            from workflow.datasets import dataset_version
+
+            with self._lock:
+                if self._current is None:
+                    self._current = DatasetVersion(self.files_dir, dataset_version(self.files_dir))
+
+        return self._current
+
+    def on_reload(self, listener: Callable[[DatasetVersion], None]):
+        """
+        Calls listener with each new version, once it is in service.
+        """
+
+        self._listeners.append(listener)
+
+    def check(self, wait_stable: bool = True) -> bool:
+        """
+        Loads the version of the files if it changed, and puts it in service if it is valid.
+
+        Parameters
+        ----------
+
+        wait_stable: bool
+            Whether to wait for the version to be the same on two checks, and for the files derived from it to be
+            written (at most DERIVED_CHECKS checks), so that preprocessing.py is done writing the files.
+
+        Return
+        ------
+
+        reloaded: bool
+            Whether a new version was put in service.
+        """
+
+        with self._check_lock:
+            return self._check(wait_stable)
+
+    def _check(self, wait_stable: bool) -> bool:
+        from workflow.datasets import dataset_version
+
+        try:
+            version = dataset_version(self.files_dir)
+        except OSError:
+            # Files being rewritten
+            return False
+
+        self._checks = self._checks + 1 if version == self._seen else 0
+        self._seen = version
+        if version in (self.current.version, self._rejected):
+            return False
+        if wait_stable and not (self._checks and (self.derived_written(version) or self._checks >= DERIVED_CHECKS)):
+            return False
+
+        t_0 = time.perf_counter()
+        new = DatasetVersion(self.files_dir, version)
+        try:
+            new.load()
+            self.validate(new)
+        except Exception as e:
+            new.free()
+            self._rejected = version
+            RELOADS.inc('rejected')
+            print('Version {} of the datasets of {} rejected: {!r}'.format(version, self.files_dir, e))
+            return False
+
+        with self._lock:
+            old, self._current = self._current, new
+
+        # Without sessions, the old version is freed right away, else when its last session moves to the new one
+        if not old.leases:
+            old.free()
+
+        RELOADS.inc('loaded')
+        print('Version {} of the datasets of {} in service, loaded in {:.3f}s'
+              .format(version, self.files_dir, time.perf_counter() - t_0))
+
+        for listener in self._listeners:
+            listener(new)
+
+        return True
+
+    def derived_written(self, version: str) -> bool:
+        """
+        Returns whether the files derived from the csv files by preprocessing.py, the partitions of the tracks, the
+        similar tracks and the climatology, were written for version (or were never written).
+        """
+
+        from workflow.climatology import STORMS_DIR, YEARS_DIR
+        from workflow.partitions import MANIFEST_FILE, PARTITIONS_DIR
+        from workflow.similarity import SIMILAR_DIR
+        from workflow.store import read_meta
+
+        try:
+            if os.path.exists(self.files_dir + PARTITIONS_DIR + MANIFEST_FILE):
+                with open(self.files_dir + PARTITIONS_DIR + MANIFEST_FILE) as f:
+                    if json.load(f)['meta'].get('version') != version:
+                        return False
+            for directory in (SIMILAR_DIR, STORMS_DIR, YEARS_DIR):
+                if os.path.exists(self.files_dir + directory):
+                    if read_meta(self.files_dir + directory).get('version') != version:
+                        return False
+        except (OSError, ValueError, KeyError):
+            # Files being rewritten
+            return False
+
+        return True
+
+    def validate(self, new: DatasetVersion):
+        """
+        Checks that a new version can replace the version in service: that the files did not change while it was
+        loaded, and that its DataFrames are not empty and have the columns and types of the ones in service.
+
+        Raises
+        ------
+
+        ValueError
+            If the new version is not valid.
+        """
+
+        from workflow.datasets import dataset_version
+
+        if dataset_version(self.files_dir) != new.version:
+            raise ValueError('the files changed while they were loaded')
+
+        for name, df in new.objects.items():
+            if not isinstance(df, pd.DataFrame):
+                continue
+            if df.empty:
+                raise ValueError('{} is empty'.format(name))
+
+            df_current = self.current.objects.get(name)
+            if df_current is not None:
+                kinds = {column: dtype.kind for column, dtype in df.dtypes.items()}
+                current_kinds = {column: dtype.kind for column, dtype in df_current.dtypes.items()}
+                if kinds != current_kinds:
+                    raise ValueError('the columns of {} changed: {} instead of {}'.format(name, kinds, current_kinds))
+
+    def watch(self, interval: float):
+        """
+        Starts a thread checking the version of the files every interval seconds.
+        """
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.check()
+                except Exception as e:
+                    print('Checking the version of the datasets of {} failed: {!r}'.format(self.files_dir, e))
+
+        threading.Thread(target=run, name='dataset-watcher', daemon=True).start()
+
+
+def dataset_store(files_dir: str = FILES_DIR) -> DatasetStore:
+    """
+    Returns the store of the datasets of files_dir, the same for the whole process.
+    """
+
+    if files_dir not in _stores:
+        _stores.setdefault(files_dir, DatasetStore(files_dir))
+
+    return _stores[files_dir]
+
+
+class DatasetLease:
+    """
+    The version of the datasets used by a session, so that all the callbacks of a session read the same version,
+    until a newer one is in service: the session then moves to it on its next callback. A request holds one too, while
+    its response is sent.
+
+    Parameters
+    ----------
+
+    files_dir: str
+        Path to the directory which contains the preprocessed files.
+    doc: Optional[Document]
+        The document of the app using the lease, counted as a session once the document has one (not while it waits
+        in a pool of documents, see move_leases).
+    """
+
+    def __init__(self, files_dir: str = FILES_DIR, doc=None):
+        self.store = dataset_store(files_dir)
+        self.version = None  # type: Optional[DatasetVersion]
+        self.document = None  # type: Optional[weakref.ref]
+        self._hold(self.store.current)
+        if doc is not None:
+            self.attach(doc)
+
+    def attach(self, doc):
+        """
+        Binds the lease to the document of the app using it.
+        """
+
+        self.document = weakref.ref(doc)
+        _documents_leases.setdefault(doc, []).append(self)
+
+    @property
+    def in_session(self) -> bool:
+        doc = self.document() if self.document is not None else None
+        return doc is not None and doc.session_context is not None
+
+    def _hold(self, version: Optional[DatasetVersion]):
+        old, self.version = self.version, version
+        if version is not None:
+            version.leases.add(self)
+        if old is not None and old is not version:
+            old.leases.discard(self)
+            if not old.leases and old is not self.store.current:
+                old.free()
+
+    def renew(self) -> bool:
+        """
+        Moves the session to the version in service, returning whether it changed.
+        """
+
+        current = self.store.current
+        if self.version is current:
+            return False
+
+        self._hold(current)
+        return True
+
+    def release(self, session_context=None):
+        """
+        Lets go of the version, when the session is destroyed.
+        """
+
+        self._hold(None)
+
+    def pinned(self):
+        """
+        Context manager making the loaders return the objects of the version of the session.
+        """
+
+        return pinned(self.version or self.store.current)
+
+    def callback(self, callback: Callable) -> Callable:
+        """
+        Decorator of the callbacks of a session: moves the session to the version in service, and makes the loaders
+        return its objects during the callback.
+        """
+
+        @wraps(callback)
+        def wrapper(*args, **kwargs):
+            self.renew()
+            with self.pinned():
+                return callback(*args, **kwargs)
+
+        return wrapper
+
+
+def move_leases(template, doc):
+    """
+    Binds the leases of a document to another one, e.g. of a pooled document to the document of the session it is
+    handed to.
+    """
+
+    for lease in _documents_leases.pop(template, []):
+        lease.attach(doc)
+
+
+def versions_in_memory(files_dir: str = FILES_DIR) -> List[DatasetVersion]:
+    """
+    Returns the versions of the datasets of files_dir with objects in memory.
+    """
+
+    return [version for version in list(_versions) if version.files_dir == files_dir and version.objects]
+
+
+def versions_sessions() -> Dict[tuple, float]:
+    """
+    Returns the number of sessions of each version of the datasets still in memory, without the pooled documents and
+    the requests.
+    """
+
+    return {(version.version,): float(sum(lease.in_session for lease in list(version.leases)))
+            for version in versions_in_memory()}
+
+
+REGISTRY.register(Gauge('hurricanes_dataset_version_sessions', 'Number of sessions of each version of the datasets.',
+                        ['version'], function=versions_sessions))